@@ -0,0 +1,365 @@
+"""Forward-mode automatic differentiation of compiled expressions.
+
+A program from expr is evaluated once over truncated Taylor series ("jets")
+instead of plain floats. Order 1 jets are dual numbers (f, f'); higher
+orders behave like nested duals and carry f''/2!, f'''/3! and so on, so
+every derivative up to the requested order comes out of a single pass.
+Jets live in flat per-program arrays, K coefficients per stack slot.
+
+Derivatives are taken with respect to x unless wrt names a slot of the
+variable store, which is how the system solver builds its Jacobians.
+"""
+
+from array import array
+from math import sin, cos, log, exp, sqrt, asin, acos, atan
+from expr import (
+    OP_CONST, OP_X, OP_ADD, OP_SUB, OP_MUL, OP_DIV, OP_POW, OP_NEG,
+    OP_SIN, OP_COS, OP_TAN, OP_LOG, OP_EXP, OP_SQRT, OP_ABS, OP_ASIN,
+    OP_ACOS, OP_ATAN, OP_DIF, OP_LOAD, OP_STORE,
+    OP_SOLVE, OP_VAR, OP_INTEG, OP_ARG, OP_CALL, variables, user_functions,
+)
+
+# Number of scratch jets each evaluation needs
+SCRATCH = 4
+
+# wrt value for derivatives with respect to x
+WRT_X = -1
+
+
+class _Buffers:
+    def __init__(self, size, k):
+        # Stack slots followed by temp slots, k coefficients each
+        self.stack = array("f", [0.0] * (size * k))
+        self.scratch = [array("f", [0.0] * k) for _ in range(SCRATCH)]
+
+
+def _buffers(prog, k):
+    buf = prog.jet_buffers.get(k)
+    if buf is None:
+        buf = _Buffers(prog.depth + prog.ntemps, k)
+        prog.jet_buffers[k] = buf
+    return buf
+
+
+def _mul(out, a, ao, b, bo, k):
+    # out must not alias a or b
+    for n in range(k):
+        s = 0.0
+        for i in range(n + 1):
+            s += a[ao + i] * b[bo + n - i]
+        out[n] = s
+
+
+def _div(out, a, ao, b, bo, k):
+    b0 = b[bo]
+    for n in range(k):
+        s = a[ao + n]
+        for i in range(1, n + 1):
+            s -= b[bo + i] * out[n - i]
+        out[n] = s / b0
+
+
+def _exp(out, a, ao, k):
+    out[0] = exp(a[ao])
+    for n in range(1, k):
+        s = 0.0
+        for i in range(1, n + 1):
+            s += i * a[ao + i] * out[n - i]
+        out[n] = s / n
+
+
+def _log(out, a, ao, k):
+    a0 = a[ao]
+    out[0] = log(a0)
+    for n in range(1, k):
+        s = 0.0
+        for i in range(1, n):
+            s += i * out[i] * a[ao + n - i]
+        out[n] = (a[ao + n] - s / n) / a0
+
+
+def _sincos(s_out, c_out, a, ao, k):
+    s_out[0] = sin(a[ao])
+    c_out[0] = cos(a[ao])
+    for n in range(1, k):
+        s = 0.0
+        c = 0.0
+        for i in range(1, n + 1):
+            s += i * a[ao + i] * c_out[n - i]
+            c += i * a[ao + i] * s_out[n - i]
+        s_out[n] = s / n
+        c_out[n] = -c / n
+
+
+def _sqrt(out, a, ao, k):
+    r0 = sqrt(a[ao])
+    out[0] = r0
+    for n in range(1, k):
+        s = a[ao + n]
+        for i in range(1, n):
+            s -= out[i] * out[n - i]
+        out[n] = s / (2 * r0)
+
+
+def _powc(out, a, ao, p, tmp, k):
+    # a ** p for a constant exponent p
+    a0 = a[ao]
+    if a0 != 0:
+        out[0] = a0 ** p
+        for n in range(1, k):
+            s = 0.0
+            for i in range(1, n + 1):
+                s += ((p + 1) * i - n) * a[ao + i] * out[n - i]
+            out[n] = s / (n * a0)
+        return
+    if p != int(p) or p < 0:
+        raise ValueError("derivative undefined")
+    for n in range(k):
+        out[n] = 0.0
+    # Every coefficient below t ** p vanishes
+    if p >= k:
+        return
+    out[0] = 1.0
+    for _ in range(int(p)):
+        _mul(tmp, out, 0, a, ao, k)
+        for n in range(k):
+            out[n] = tmp[n]
+
+
+def _integrate(out, f0, d, k):
+    # out is the jet whose derivative series is d
+    for n in range(k - 1, 0, -1):
+        out[n] = d[n - 1] / n
+    out[0] = f0
+
+
+def _derive(out, a, ao, k):
+    for n in range(k - 1):
+        out[n] = (n + 1) * a[ao + n + 1]
+    out[k - 1] = 0.0
+
+
+def _dif(out, sub, order, a, ao, g, r, k, wrt):
+    # The order-th derivative of sub composed with the jet a
+    if wrt != WRT_X and sub.uses_vars:
+        raise ValueError("mixed derivative")
+    c = eval_jet(sub, a[ao], order + k - 1)
+    # Taylor coefficients of that derivative around a[0]
+    for i in range(k):
+        f = c[order + i]
+        for j in range(i + 1, order + i + 1):
+            f *= j
+        g[i] = f
+    _compose(out, g, a, ao, r, k)
+
+
+def _antiderivative(out, sub, a, ao, g, r, k):
+    # F(a) - F(a[0]) for an antiderivative F of sub, as a jet
+    g[0] = 0.0
+    if k > 1:
+        c = eval_jet(sub, a[ao], k - 2)
+        for i in range(1, k):
+            g[i] = c[i - 1] / i
+    _compose(out, g, a, ao, r, k)
+
+
+def _compose(out, g, a, ao, r, k):
+    # The series g evaluated at s = a - a[0], by Horner's rule
+    for n in range(k):
+        r[n] = 0.0
+    r[0] = g[k - 1]
+    a0 = a[ao]
+    a[ao] = 0.0
+    for i in range(k - 2, -1, -1):
+        _mul(out, r, 0, a, ao, k)
+        for n in range(k):
+            r[n] = out[n]
+        r[0] += g[i]
+    a[ao] = a0
+    for n in range(k):
+        out[n] = r[n]
+
+
+def eval_jet(prog, x, order, wrt=WRT_X, args=None, ao=0):
+    """Evaluate prog at x and return its jet of Taylor coefficients.
+
+    args holds the parameter jets of a user function body, back to back
+    from args[ao].
+    """
+    k = order + 1
+    buf = _buffers(prog, k)
+    st = buf.stack
+    w0, w1, w2, w3 = buf.scratch
+    code = prog.code
+    consts = prog.consts
+    n = len(code)
+    sp = -k
+    pc = 0
+    while pc < n:
+        op = code[pc]
+        pc += 1
+        if op == OP_CONST or op == OP_X or op == OP_VAR:
+            sp += k
+            seed = False
+            if op == OP_CONST:
+                st[sp] = consts[code[pc]]
+                pc += 1
+            elif op == OP_VAR:
+                st[sp] = variables[code[pc]]
+                seed = code[pc] == wrt
+                pc += 1
+            else:
+                st[sp] = x
+                seed = wrt == WRT_X
+            for i in range(1, k):
+                st[sp + i] = 0.0
+            if seed and k > 1:
+                st[sp + 1] = 1.0
+            continue
+        if op == OP_ARG:
+            sp += k
+            a = ao + code[pc] * k
+            pc += 1
+            for i in range(k):
+                st[sp + i] = args[a + i]
+            continue
+        if op == OP_LOAD or op == OP_STORE:
+            t = (prog.depth + code[pc]) * k
+            pc += 1
+            if op == OP_LOAD:
+                sp += k
+                for i in range(k):
+                    st[sp + i] = st[t + i]
+            else:
+                for i in range(k):
+                    st[t + i] = st[sp + i]
+            continue
+        if op == OP_ADD or op == OP_SUB:
+            sp -= k
+            b = sp + k
+            if op == OP_ADD:
+                for i in range(k):
+                    st[sp + i] += st[b + i]
+            else:
+                for i in range(k):
+                    st[sp + i] -= st[b + i]
+            continue
+        if op == OP_NEG:
+            for i in range(k):
+                st[sp + i] = -st[sp + i]
+            continue
+        if op == OP_MUL:
+            sp -= k
+            _mul(w0, st, sp, st, sp + k, k)
+        elif op == OP_DIV:
+            sp -= k
+            _div(w0, st, sp, st, sp + k, k)
+        elif op == OP_POW:
+            sp -= k
+            b = sp + k
+            constant = True
+            for i in range(1, k):
+                if st[b + i] != 0:
+                    constant = False
+            if constant:
+                _powc(w0, st, sp, st[b], w1, k)
+            else:
+                # a ** b == exp(b * log(a))
+                _log(w1, st, sp, k)
+                _mul(w2, w1, 0, st, b, k)
+                _exp(w0, w2, 0, k)
+        elif op == OP_SIN:
+            _sincos(w0, w1, st, sp, k)
+        elif op == OP_COS:
+            _sincos(w1, w0, st, sp, k)
+        elif op == OP_TAN:
+            _sincos(w1, w2, st, sp, k)
+            _div(w0, w1, 0, w2, 0, k)
+        elif op == OP_LOG:
+            _log(w0, st, sp, k)
+        elif op == OP_EXP:
+            _exp(w0, st, sp, k)
+        elif op == OP_SQRT:
+            _sqrt(w0, st, sp, k)
+        elif op == OP_ABS:
+            sign = -1.0 if st[sp] < 0 else 1.0
+            for i in range(k):
+                w0[i] = sign * st[sp + i]
+        elif op == OP_ASIN or op == OP_ACOS or op == OP_ATAN:
+            # Integrate a' * g(a) where g is the derivative of the function
+            _mul(w1, st, sp, st, sp, k)
+            if op == OP_ATAN:
+                w1[0] += 1.0
+                _derive(w3, st, sp, k)
+                _div(w2, w3, 0, w1, 0, k)
+                f0 = atan(st[sp])
+            else:
+                for i in range(k):
+                    w1[i] = -w1[i]
+                w1[0] += 1.0
+                _sqrt(w2, w1, 0, k)
+                _derive(w3, st, sp, k)
+                _div(w1, w3, 0, w2, 0, k)
+                if op == OP_ASIN:
+                    f0 = asin(st[sp])
+                    for i in range(k):
+                        w2[i] = w1[i]
+                else:
+                    f0 = acos(st[sp])
+                    for i in range(k):
+                        w2[i] = -w1[i]
+            _integrate(w0, f0, w2, k)
+        elif op == OP_SOLVE:
+            # A root does not move with the interval around it
+            from solver import first_root
+            sp -= k
+            w0[0] = first_root(prog.subs[code[pc]], st[sp], st[sp + k])
+            for i in range(1, k):
+                w0[i] = 0.0
+            pc += 1
+        elif op == OP_INTEG:
+            # Leibniz: the limits move the value, the integrand is fixed
+            from integrate import integral
+            sub = prog.subs[code[pc]]
+            pc += 1
+            if wrt != WRT_X and sub.uses_vars:
+                raise ValueError("mixed derivative")
+            sp -= k
+            b = sp + k
+            value = integral(sub, st[sp], st[b])
+            _antiderivative(w3, sub, st, b, w1, w2, k)
+            _antiderivative(w0, sub, st, sp, w1, w2, k)
+            for i in range(k):
+                w0[i] = w3[i] - w0[i]
+            w0[0] = value
+        elif op == OP_DIF:
+            _dif(w0, prog.subs[code[pc]], code[pc + 1], st, sp, w1, w2, k, wrt)
+            pc += 2
+        elif op == OP_CALL:
+            # The body runs on its own buffers with the argument jets
+            fn = user_functions[code[pc]]
+            sp -= (code[pc + 1] - 1) * k
+            pc += 2
+            res = eval_jet(fn, x, order, wrt, st, sp)
+            for i in range(k):
+                w0[i] = res[i]
+        else:
+            raise ValueError("bad opcode %d" % op)
+        for i in range(k):
+            st[sp + i] = w0[i]
+    return st
+
+
+def eval_dual(prog, x, wrt=WRT_X):
+    """Return (f(x), f'(x)) from a single dual-number evaluation."""
+    st = eval_jet(prog, x, 1, wrt)
+    return st[0], st[1]
+
+
+def derivative(prog, x, order=1, wrt=WRT_X):
+    """Return the order-th derivative of prog at x."""
+    st = eval_jet(prog, x, order, wrt)
+    d = st[order]
+    for i in range(2, order + 1):
+        d *= i
+    return d
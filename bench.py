@@ -0,0 +1,156 @@
+# Benchmarks for the calculator engines. Run on the board with
+# "import bench; bench.run()" or on a PC with "python bench.py".
+from math import *
+
+try:
+    from utime import ticks_us, ticks_diff  # type: ignore
+except ImportError:
+    from time import perf_counter_ns
+
+    def ticks_us():
+        return perf_counter_ns() // 1000
+
+    def ticks_diff(a, b):
+        return a - b
+
+import expr
+import solver
+import integrate
+import matrix
+import gpio
+
+# The constant ones fold to a single constant at compile time; the ones
+# in x time the evaluation loop, the last two with repeated sub-terms
+EXPRESSIONS = [
+    "1+2*3",
+    "pow(10, 3)/7",
+    "sin(3.14159/2)+cos(0.5)*tan(0.25)",
+    "log(2.5)*pow(1.5, 2)-(4/3)",
+    "x*x*x-2*x-5",
+    "log(x+2.5)*pow(x, 2)-(4/3)",
+    "sin(x)*cos(x)+x**2",
+    "cos(x)*cos(x)+cos(x)",
+]
+
+# x for the expressions and their reference eval()
+X = 0.7
+
+
+def timed(fn, repeat):
+    start = ticks_us()
+    for _ in range(repeat):
+        fn()
+    return ticks_diff(ticks_us(), start) / repeat
+
+
+def bench_expr(repeat=200):
+    print("expression                          eval(us)  compile(us)  run(us)")
+    for text in EXPRESSIONS:
+        scope = {"x": X}
+        t_eval = timed(lambda: eval(text, globals(), scope), repeat)
+
+        def compile_fresh():
+            expr._programs.clear()
+            expr.compile_expr(text)
+
+        t_compile = timed(compile_fresh, repeat)
+        prog = expr.compile_expr(text)
+        t_run = timed(lambda: prog.run(X), repeat)
+        print("%-34s %9.1f %12.1f %8.1f" % (text, t_eval, t_compile, t_run))
+
+
+SOLVER_CASES = [
+    ("x**3-2*x-5", -5, 5),
+    ("x**4-10*x**2+9", -3.7, 3.3),
+    ("sin(x)-0.5", 0, 10),
+    ("cos(x)-x", -3, 3),
+]
+
+
+def bench_solver(repeat=20):
+    print("equation                    roots     ms  iterations/evaluations")
+    for text, a, b in SOLVER_CASES:
+        prog = expr.compile_expr(text)
+        roots = solver.find_roots(prog, a, b)
+        t = timed(lambda: solver.find_roots(prog, a, b), repeat)
+        stats = " ".join("%d/%d" % (r[1], r[2]) for r in roots)
+        print("%-26s %6d %6.2f  %s" % (text, len(roots), t / 1000, stats))
+
+
+INTEGRAL_CASES = [
+    ("sin(x)", 0, 3.14159),
+    ("exp(-x*x)", -5, 5),
+    ("sqrt(x)", 0, 1),
+    ("sin(1/x)", 0.001, 1),
+]
+
+
+def bench_integrate(repeat=5):
+    print("integrand                   value        error   evals     ms")
+    for text, a, b in INTEGRAL_CASES:
+        prog = expr.compile_expr(text)
+        value, err, evals = integrate.integrate(prog, a, b)
+        t = timed(lambda: integrate.integrate(prog, a, b), repeat)
+        print("%-22s %12.7f %10.2e %7d %6.1f" % (text, value, err, evals, t / 1000))
+
+
+def bench_matrix(repeat=20):
+    print("size   add(us)   mul(us)  trn(us)  det(us)  inv(us)")
+    for n in range(3, 9):
+        # Diagonally dominant, so never singular
+        values = [1.0 / (1 + i + j) for i in range(n) for j in range(n)]
+        a = matrix.Matrix(n, n, values)
+        for i in range(n):
+            a.set(i, i, a.get(i, i) + n)
+        b = matrix.Matrix(n, n, values)
+        out = matrix.Matrix(n, n)
+        t_add = timed(lambda: matrix.add(a, b, out), repeat)
+        t_mul = timed(lambda: matrix.mul(a, b, out), repeat)
+        t_trn = timed(lambda: matrix.transpose(a, out), repeat)
+        t_det = timed(lambda: matrix.det(a), repeat)
+        t_inv = timed(lambda: matrix.inverse(a, out), repeat)
+        print("%dx%d %9.1f %9.1f %8.1f %8.1f %8.1f" % (n, n, t_add, t_mul, t_trn,
+                                                      t_det, t_inv))
+
+
+# Key matrix as wired in calculate.py
+KEY_ROWS = (32, 33, 25, 26, 27, 13, 12, 14)
+KEY_COLS = (34, 16, 17, 4, 35)
+
+
+def bench_keypad(repeat=200):
+    # Register scans of the 8x5 matrix; on a PC against the register stub,
+    # which also counts the accesses one scan makes
+    try:
+        import machine  # type: ignore
+    except ImportError:
+        machine = None
+    if hasattr(machine, "mem32"):
+        mem = None
+    else:
+        from gpio_stub import Registers
+        mem = Registers()
+        mem.press(KEY_ROWS[3], KEY_COLS[2])
+    port = gpio.MatrixPort(KEY_ROWS, KEY_COLS, mem)
+    t = timed(port.scan, repeat)
+    print("keypad scan(us)  scans/s  reads  writes")
+    if mem is None:
+        print("%14.1f %8d      -       -" % (t, 1e6 / t))
+    else:
+        reads = mem.reads
+        writes = mem.writes
+        port.scan()
+        print("%14.1f %8d %6d %7d" % (t, 1e6 / t, mem.reads - reads,
+                                      mem.writes - writes))
+
+
+def run():
+    bench_expr()
+    bench_solver()
+    bench_integrate()
+    bench_matrix()
+    bench_keypad()
+
+
+if __name__ == "__main__":
+    run()
@@ -3,7 +3,27 @@ from lcd_api import LcdApi
 from i2c_lcd import I2cLcd
 import utime as time  # type: ignore
 from math import *
-from menu import menu_fun
+from menu import (menu_fun, take_pending, complex_enabled, refresh_user_menu,
+                  refresh_saved_menu, menu_open, menu_active)
+from menu import default_key as menu_key
+from expr import (evaluate, evaluate_complex, compile_expr, variables,
+                  assignment, split_args, X_SLOT)
+from live import LiveExpr, ERROR, OK
+from result_cache import ResultCache
+import matrix
+from history import History
+import userfn
+import numfmt
+import saved
+import systems
+import solver
+import table
+from keypad import Keypad, LONG
+import keymap
+from runtime import Runtime, run_steps
+from integrate import integrate_steps
+import replay
+from stats import Stats, Store
 
 # LCD address, width, and height
 I2C_ADDR = 0x27
@@ -24,12 +44,21 @@ numCols = 5  # Number of columns
 
 rowPins = [32, 33, 25, 26, 27, 13, 12, 14]
 colPins = [34, 16, 17, 4, 35]
+keypad = Keypad(rowPins, colPins)
+# Arrows and backspace repeat while held
+for _key in keymap.repeat_keys():
+    keypad.set_repeat(*_key)
 
 
 # Backlight toggle
 on = -1
 
-big_text = "Creating a 10,000-word essay on mechanical engineering in a single paragraph is highly unconventional and impractical for readability and comprehension."
+# Result line, formatted in place by numfmt
+result_buf = bytearray(I2C_NUM_COLS)
+# Live preview, "=" and the value, also formatted in place
+preview_buf = bytearray(I2C_NUM_COLS)
+preview_buf[0] = ord("=")
+preview_view = memoryview(preview_buf)
 
 # String buffer
 text = ""
@@ -40,6 +69,45 @@ text = ""
 text_pos = 0
 cursor_pos = 0
 
+# Set by cal_async(); None while running the blocking loop
+runtime = None
+# Keys go to the menu instead while the runtime shows it
+in_menu = False
+# Session logged by cal_async(record=True)
+recording = None
+
+# Shift layer of the keypad
+keys = keymap.Keymap()
+
+# Data points added with the stat key
+data = Stats(Store())
+# Summary page shown by the stat key on an empty text
+stat_page = 0
+
+# Incremental parse state of text, for the live preview
+live = LiveExpr()
+
+# Mode setting results depend on (Settings > Angle); x and the other
+# variables live in the expr variable store
+angle_unit = "rad"
+
+# Recently evaluated results, keyed on text and mode
+results = ResultCache(max_entries=32, max_bytes=2048)
+
+# Evaluated expressions and their results, browsed with up/down
+history = History()
+# Text being edited when browsing started, given back past the newest entry
+draft = ""
+
+# Roots found by roots(E, A, B), browsed with up/down, and the one shown;
+# None when the roots are not on screen
+found_roots = None
+root_index = 0
+# Table opened by table(E, X0, STEP), scrolled with up/down, and its top
+# row; None when no table is on screen
+value_table = None
+table_top = 0
+
 def update_pos(text_nav):
     global cursor_pos, text_pos, text
     if cursor_pos < 0 and text_pos == 0:
@@ -70,6 +138,13 @@ def update_pos(text_nav):
                 text_pos -= 16
     return 0
 
+def refresh():
+    # Redraw now, or with the runtime on its next frame
+    if runtime is None:
+        update_display()
+    else:
+        runtime.request_render()
+
 def update_display():
     lcd.clear()
     for i in range(32):
@@ -77,39 +152,89 @@ def update_display():
         if char_index < len(text):
             lcd.move_to(i % 16, i // 16)
             lcd.putchar(text[char_index])
+    # Preview the partial result on the second line while it is free
+    if len(text) - text_pos <= 16:
+        value = live.preview()
+        if value is not None:
+            try:
+                n = 1 + numfmt.format_number(value, preview_buf, 1, 15)
+                lcd.move_to(16 - n, 1)
+                lcd.putbytes(preview_view[:n])
+            except ValueError:
+                pass
     if cursor_pos >= 0:
         lcd.move_to(cursor_pos % 16, cursor_pos // 16)
     return 0
 
 def new_text(data):
     global text, cursor_pos, text_pos
+    edit_pos = len(text)
     if len(data) > 0:
+        edit_pos = text_pos + cursor_pos
         text = text[:text_pos + cursor_pos] + data + text[text_pos + cursor_pos:]
         cursor_pos += len(data)
     elif data == "" and not (cursor_pos == 0 and text_pos == 0):
         rem = text_pos + cursor_pos - 1
+        edit_pos = rem
         text = text[:rem] + text[rem + 1:]
         cursor_pos -= 1
+    live.update(text, edit_pos)
+    history.stop()
     update_pos("text")
-    update_display()
+    refresh()
     print(f"text_pos={text_pos} and cursor_pos={cursor_pos}")
     return 0
 
 def navigate(dir):
-    global cursor_pos
+    global cursor_pos, draft, root_index, table_top
+    if found_roots is not None and (dir == "u" or dir == "d"):
+        step = 1 if dir == "d" else -1
+        root_index = (root_index + step) % len(found_roots)
+        show_root()
+        return 0
+    if value_table is not None and (dir == "u" or dir == "d"):
+        # Only rows scrolling into view are computed
+        step = 1 if dir == "d" else -1
+        table_top = max(0, min(table_top + step, value_table.count - 2))
+        value_table.show_lcd(lcd, table_top)
+        return 0
     if dir == "l":
         cursor_pos -= 1
     elif dir == "r":
         cursor_pos += 1
     elif dir == "u":
+        # Up from the first line steps back through the history
+        if text_pos == 0 and cursor_pos < 16:
+            if not history.browsing():
+                draft = text
+            expression = history.older()
+            if expression is None:
+                return 0
+            return recall(expression)
         cursor_pos -= 16
     elif dir == "d":
+        if history.browsing():
+            expression = history.newer()
+            if expression is None:
+                expression = draft
+            return recall(expression)
         cursor_pos += 16
     update_pos("nav")
-    update_display()
+    refresh()
     print(f"text_pos={text_pos} and cursor_pos={cursor_pos}")
     return 0
 
+def recall(expression):
+    # Replace the text with a history entry without leaving browse mode
+    global text, cursor_pos, text_pos
+    text = expression
+    text_pos = 0
+    cursor_pos = len(text) % 32
+    live.update(text, 0)
+    update_pos("text")
+    refresh()
+    return 0
+
 def backspace():
     new_text("")
     return 0
@@ -131,205 +256,438 @@ def backlight_toggle(one):
     on *= -1
     return 0
 
-def dif(expr, num):
-    y1=eval(expr.replace("x", str(num-0.0001)))
-    y2=eval(expr.replace("x", str(num+0.0001)))
-    result=(y2-y1)/0.0002
-    print(y1, y2, result)
-    return result
-
-def sol():
+def define():
+    # "f(x) = body": compile it, keep it on flash and list it in the menu
+    try:
+        name = userfn.define(text)
+        userfn.save()
+    except Exception as e:
+        lcd.clear()
+        print(e)
+        return ""
+    refresh_user_menu()
+    # Cached results may have called the old definition
+    results.clear()
+    lcd.clear()
+    lcd.putstr("Defined")
+    lcd.move_to(0, 1)
+    lcd.putstr(userfn.signature(name)[:16])
+    return ""
+
+def split_integ(start):
+    # Texts of E, A and B when the text from position start on is a single
+    # integ(E, A, B) call, else None; read off the live token list
+    tokens = live.tokens
+    first = 0
+    while first < len(tokens) and tokens[first][2] < start:
+        first += 1
+    if len(tokens) - first < 2 or tokens[first][1] != "integ" or \
+            tokens[first + 1][1] != "(":
+        return None
+    depth = 0
+    commas = []
+    for i in range(first + 1, len(tokens)):
+        value = tokens[i][1]
+        if value == "(":
+            depth += 1
+        elif value == ")":
+            depth -= 1
+            if depth == 0 and i != len(tokens) - 1:
+                return None
+        elif value == "," and depth == 1:
+            commas.append(i)
+    if len(commas) != 2:
+        return None
+    src = live.text
+    ends = (first + 1, commas[0], commas[1], len(tokens) - 1)
+    return [src[tokens[ends[j]][3]:tokens[ends[j + 1]][2]] for j in range(3)]
+
+def integ_steps(parts, x):
+    # A top-level integral as a job yielding after every interval
+    body, a, b = parts
+    prog = compile_expr(body)
+    value = (yield from integrate_steps(prog, evaluate(a, x), evaluate(b, x)))[0]
+    return value, 0.0
+
+def solve_system(equations):
+    # "sys(E1, E2, ...)": Newton from 1 for every unknown; the solution
+    # stays in x, y, z, ... and as many as fit are shown
+    try:
+        solution = systems.solve(equations)
+    except Exception as e:
+        lcd.clear()
+        print(e)
+        return ""
+    variables[X_SLOT] = solution[0]
+    lines = ["", ""]
+    for j in range(len(solution)):
+        item = "%s=%.5g" % (systems.UNKNOWNS[j], solution[j])
+        for row in range(2):
+            line = lines[row]
+            if len(line) + len(item) + (1 if line else 0) <= 16:
+                lines[row] = line + " " + item if line else item
+                break
+    lcd.clear()
+    lcd.putstr(lines[0])
+    lcd.move_to(0, 1)
+    lcd.putstr(lines[1])
+    return ""
+
+def find_all_roots(parts):
+    # "roots(E, A, B)": every root of E in [A, B], the first one shown; a
+    # job yielding after each root it refines
+    global found_roots, root_index
+    body, a, b = parts
+    x = variables[X_SLOT]
+    lcd.clear()
+    try:
+        roots = yield from solver.find_roots_steps(
+            compile_expr(body), evaluate(a, x), evaluate(b, x))
+    except Exception as e:
+        print(e)
+        return ""
+    if not roots:
+        lcd.putstr("No roots")
+        return ""
+    found_roots = roots
+    root_index = 0
+    show_root()
+    return ""
+
+def open_table(parts):
+    # "table(E, X0, STEP)": rows x0 + i * step from the top, none computed
+    # before it is shown
+    global value_table, table_top
+    body, x0, step = parts
+    x = variables[X_SLOT]
+    lcd.clear()
+    try:
+        value_table = table.ValueTable(compile_expr(body), evaluate(x0, x),
+                                       evaluate(step, x), table.ROWS)
+    except Exception as e:
+        print(e)
+        return ""
+    table_top = 0
+    value_table.show_lcd(lcd, table_top)
+    return ""
+
+def show_root():
+    # The root, then the Newton iterations and f/f' evaluations refining
+    # it took (after the one sampling pass) and which root of how many
+    root, iterations, evaluations = found_roots[root_index]
+    lcd.clear()
+    lcd.putstr(("x=%.9g" % root)[:16])
+    lcd.move_to(0, 1)
+    counts = ("it%d ev%d" % (iterations, evaluations))[:10]
+    place = "%d/%d" % (root_index + 1, len(found_roots))
+    lcd.putstr(counts + " " * (16 - len(counts) - len(place)) + place)
+
+def sol_steps():
+    # Evaluates the text as a job; returns the text answer_steps() starts
+    # the next expression with
     global text
     expression = text
+    if userfn.is_definition(expression):
+        return define()
+    equations = systems.split(expression)
+    if equations is not None:
+        return solve_system(equations)
+    parts = solver.split(expression)
+    if parts is not None:
+        return (yield from find_all_roots(parts))
+    parts = table.split(expression)
+    if parts is not None:
+        return open_table(parts)
+    # "A = expr" evaluates expr and stores it in A's slot
+    target = assignment(expression)
+    start = 0
+    if target is not None:
+        start = target[1]
+        expression = expression[start:]
+    # "MA = expr" keeps a matrix result in register MA
+    register = matrix.assignment(expression)
+    if register is not None:
+        expression = expression[register[1]:]
+    # Cheap structural check before compiling anything
+    if live.status != OK:
+        lcd.clear()
+        lcd.putstr("Syntax error" if live.status == ERROR else "Incomplete")
+        if live.error_pos >= 0:
+            lcd.move_to(0, 1)
+            lcd.putstr("at %d" % live.error_pos)
+        return ""
     try:
-        result = eval(expression)
-        buffer = f"{result:.6f}"
-        # Print the result to the LCD
+        if register is not None or matrix.uses_matrices(expression):
+            # Register contents are not part of the cache key, so no caching
+            result = matrix.evaluate(expression)
+            if register is not None:
+                result = matrix.store(register[0], result)
+        else:
+            complex_on = complex_enabled()
+            x = variables[X_SLOT]
+            parts = None if complex_on else split_integ(start)
+            if parts is not None:
+                # Not cached, and not compiled whole: that would fold a
+                # constant integral in one go instead of in steps
+                result = yield from integ_steps(parts, x)
+            else:
+                # Variables are read at run time, so the values of the ones
+                # this program reads are part of the key
+                prog = compile_expr(expression, complex_on)
+                mode = (angle_unit, x, complex_on,
+                        tuple([variables[s] for s in prog.var_slots]))
+                result = results.get(expression, mode)
+                if result is None:
+                    # (re, im); real programs still run on the float path
+                    result = evaluate_complex(expression, x, complex_on)
+                    results.put(expression, mode, result)
+        if target is not None:
+            if isinstance(result, matrix.Matrix) or \
+                    not isinstance(result, float) and result[1] != 0:
+                raise ValueError("only real values can be stored")
+            variables[target[0]] = result if isinstance(result, float) else result[0]
         lcd.clear()
         lcd.putstr("Result:")
         lcd.move_to(0, 1)
-        lcd.putstr(buffer[:15])
+        if isinstance(result, matrix.Matrix):
+            buffer = "[%dx%d] %.4g" % (result.rows, result.cols, result.data[0])
+            lcd.putstr(buffer[:16])
+            return buffer[:16]
+        if isinstance(result, float):
+            # A scalar from a matrix expression such as det(MA)
+            re, im = result, 0.0
+        else:
+            re, im = result
+        history.add(text, re, im)
+        numfmt.format_result(re, im, result_buf)
+        lcd.putbytes(result_buf)
+        # Text only for answer_steps() when the result cannot go through ANS
+        buffer = ""
+        if im != 0:
+            buffer = result_buf.decode().strip()
     except Exception as e:
         # Handle parse error
         lcd.clear()
         # lcd.putstr(e)
         print(e)
         buffer = ""
-    return buffer[:15]
+    return buffer
 
-def answer():
+def answer_steps():
+    # Start a new expression from the result; ANS carries the exact value
+    # where the formatted text would round it
     global text, cursor_pos, text_pos
-    sol_text = sol()
+    head = history.head
+    sol_text = yield from sol_steps()
     text = ""
     cursor_pos = 0
     text_pos = 0
+    if history.head != head and history.result()[1] == 0:
+        sol_text = "ANS"
     new_text(sol_text)
     return 0
 
-def alpha():
-    new_text(big_text)
-    return 0
-
-def beta():
-    return 0
-
 def home():
+    global in_menu
+    if runtime is not None:
+        # The runtime hands keys to the menu until it is left
+        in_menu = True
+        menu_open()
+        return 0
     menu_fun()
+    # The menu scans the keys with its own pins
+    keypad.start()
+    leave_menu()
+    return 0
+
+def leave_menu():
     navigate("l")
     navigate("r")
+    # A menu entry such as the equation solver may hand back a template
+    template = take_pending()
+    if template:
+        new_text(template)
     return 0
 
 def power_on():
     return 0
 
 def ok():
+    # OK keeps the expression, compiled, under Saved Data > Equations
+    expression = text
+    target = assignment(expression)
+    if target is not None:
+        expression = expression[target[1]:]
+    lcd.clear()
+    if userfn.is_definition(text) or live.status != OK or \
+            matrix.uses_matrices(expression):
+        lcd.putstr("Cannot save")
+        return 0
+    try:
+        saved.add(text, compile_expr(expression, complex_enabled()))
+    except Exception as e:
+        print(e)
+        lcd.putstr("Cannot save")
+        return 0
+    refresh_saved_menu()
+    lcd.putstr("Saved")
     return 0
 
-def blank():
-    new_text("x")
+def fx():
     return 0
 
-def diff():
-    new_text("dif(\"\",)")
+def stat_add():
+    # "x" or "x, y" adds a data point and shows the count and mean; on an
+    # empty text each press shows the next summary page instead
+    global stat_page
+    if text.strip() == "":
+        if data.n:
+            stat_page = (stat_page + 1) % 4
+            show_stats(stat_page)
+        return 0
+    try:
+        parts = split_args(text)
+        if parts is None or len(parts) > 2:
+            raise ValueError("x or x, y")
+        x = variables[X_SLOT]
+        point = [evaluate(part, x) for part in parts]
+        data.add(point[0], point[1] if len(point) == 2 else None)
+    except Exception as e:
+        print(e)
+        lcd.clear()
+        lcd.putstr("Not a number")
+        return 0
+    stat_page = 0
+    show_stats(0)
     return 0
 
-def fx():
+def show_stats(page):
+    # 0: n, mean and stdev; 1: min and max; 2: median and quartiles;
+    # 3: regression line and r, once every point is paired
+    lcd.clear()
+    if page == 0:
+        top = "n=%d" % data.n
+        bottom = "%.6g %.6g" % (data.mean(), data.stdev())
+    elif page == 1:
+        top = "min %.7g" % data.min
+        bottom = "max %.7g" % data.max
+    elif page == 2:
+        top = "med %.7g" % data.median()
+        bottom = "%.6g %.6g" % (data.quantile(0.25), data.quantile(0.75))
+    elif data.paired != data.n:
+        top = "y=ax+b"
+        bottom = "needs x, y"
+    else:
+        slope, intercept, r = data.regression()
+        top = "a=%.5g r=%.3g" % (slope, r)
+        bottom = "b=%.7g" % intercept
+    lcd.putstr(top[:16])
+    lcd.move_to(0, 1)
+    lcd.putstr(bottom[:16])
+
+def stat_clear():
+    global stat_page
+    data.clear()
+    stat_page = 0
+    lcd.clear()
+    lcd.putstr("Data cleared")
     return 0
 
+# Action IDs from the keymap to what they do here
+actions = keymap.action_table({
+    keymap.UP: lambda: navigate("u"),
+    keymap.DOWN: lambda: navigate("d"),
+    keymap.LEFT: lambda: navigate("l"),
+    keymap.RIGHT: lambda: navigate("r"),
+    keymap.HOME: home,
+    keymap.POWER: power_on,
+    keymap.BACKLIGHT: lambda: backlight_toggle(on),
+    keymap.OK: ok,
+    keymap.FX: fx,
+    keymap.BACKSPACE: backspace,
+    keymap.CLEAR: allclear,
+    keymap.ANSWER: lambda: background(answer_steps()),
+    keymap.SOLVE: lambda: background(sol_steps()),
+    keymap.STAT: stat_add,
+    keymap.STAT_CLEAR: stat_clear,
+})
+
+def background(steps):
+    # Evaluation runs as a job of the runtime's compute task, if there is one
+    if runtime is None:
+        run_steps(steps)
+    elif runtime.full():
+        # Presses queued up behind a slow evaluation; the jobs already
+        # waiting evaluate the same text
+        print("busy, key dropped")
+    else:
+        runtime.submit(steps)
+
+def on_key(row, col, kind):
+    global in_menu
+    # A long press has no meaning of its own here yet
+    if kind == LONG:
+        return
+    if in_menu:
+        menu_key(row, col)
+        if not menu_active():
+            in_menu = False
+            leave_menu()
+        return
+    default_key(row, col)
+
 def default_key(r, c):
-    if r == 0:
-        if c == 0:
-            alpha()
-        elif c == 1:
-            beta()
-        elif c == 2:
-            navigate("u")
-        elif c == 3:
-            home()
-        elif c == 4:
-            power_on()
-    elif r == 1:
-        if c == 0:
-            backlight_toggle(on)
-        elif c == 1:
-            navigate("l")
-        elif c == 2:
-            ok()
-        elif c == 3:
-            navigate("r")
-        elif c == 4:
-            blank()
-    elif r == 2:
-        if c == 0:
-            diff()
-        elif c == 1:
-            fx()
-        elif c == 2:
-            navigate("d")
-        elif c == 3:
-            new_text("(")
-        elif c == 4:
-            new_text(")")
-    elif r == 3:
-        if c == 0:
-            new_text("pow( , ")
-        elif c == 1:
-            new_text("sin(")
-        elif c == 2:
-            new_text("cos(")
-        elif c == 3:
-            new_text("tan(")
-        elif c == 4:
-            new_text("log(")
-    elif r == 4:
-        if c == 0:
-            new_text("7")
-        elif c == 1:
-            new_text("8")
-        elif c == 2:
-            new_text("9")
-        elif c == 3:
-            new_text("")
-        elif c == 4:
-            allclear()
-    elif r == 5:
-        if c == 0:
-            new_text("4")
-        elif c == 1:
-            new_text("5")
-        elif c == 2:
-            new_text("6")
-        elif c == 3:
-            new_text("*")
-        elif c == 4:
-            new_text("/")
-    elif r == 6:
-        if c == 0:
-            new_text("1")
-        elif c == 1:
-            new_text("2")
-        elif c == 2:
-            new_text("3")
-        elif c == 3:
-            new_text("+")
-        elif c == 4:
-            new_text("-")
-    elif r == 7:
-        if c == 0:
-            new_text(".")
-        elif c == 1:
-            new_text("0")
-        elif c == 2:
-            new_text("pow(10, ")
-        elif c == 3:
-            answer()
-        elif c == 4:
-            sol()
+    global found_roots, value_table
+    entry = keys.key(r, c)
+    # Up and down step through the roots or the table on screen; anything
+    # else ends that
+    if entry != keymap.UP and entry != keymap.DOWN:
+        found_roots = None
+        value_table = None
+    if isinstance(entry, str):
+        new_text(entry)
+    elif actions[entry] is not None:
+        actions[entry]()
     return 0
 
 def setup():
     print("Setup")
+    # User functions saved on flash, already compiled
+    userfn.load()
+    refresh_user_menu()
+    # Saved expressions: only the file is read here, each one is unpacked
+    # when recalled
+    saved.load()
+    refresh_saved_menu()
     # lcd.init()  # initialize the lcd
     lcd.backlight_off()
     lcd.show_cursor()
     lcd.clear()
     
-    # Set row pins as INPUT_PULLUP
-    for pin in colPins:
-        Pin(pin, Pin.IN, Pin.PULL_UP)
-    
-    # Set column pins as OUTPUT and HIGH
-    for pin in rowPins:
-        p = Pin(pin, Pin.OUT)
-        p.value(1)
+    # Rows are driven, columns read with pull-ups
+    keypad.start()
 
 def loop():
-    global numRows, rowPins, numCols, colPins
+    # Sleeps until a key interrupt, then handles whatever was queued
     while True:
-        # Loop through each column
-        # for col in range(numCols):
-        for row in range(numRows):
-            # Activate the current column
-            # Pin(colPins[col], Pin.OUT).value(0)
-            Pin(rowPins[row], Pin.OUT).value(0)
-            
-            
-            # Check each row in the current column
-            # for row in range(numRows):
-            for col in range(numCols):
-                # buttonState = Pin(rowPins[row], Pin.IN, Pin.PULL_UP).value()
-                buttonState = Pin(colPins[col], Pin.IN, Pin.PULL_UP).value()
-                
-                # If button is pressed (LOW), print the row and column
-                if buttonState == 0:
-                    default_key(row, col)
-                    time.sleep(0.2)  # Debounce delay
-            
-            # Deactivate the current column
-            # Pin(colPins[col], Pin.OUT).value(1)
-            Pin(rowPins[row], Pin.OUT).value(1)
+        keypad.wait()
+        while keypad.any():
+            row, col, kind, t = keypad.get()
+            on_key(row, col, kind)
 
 
 def cal_fun():
     setup()
-    loop()
\ No newline at end of file
+    loop()
+
+def cal_async(record=False):
+    # Keys, display and evaluation as tasks of one runtime. With record,
+    # the key presses are logged in recording for replay.py
+    global runtime, recording
+    setup()
+    keys_in = keypad
+    if record:
+        recording = replay.Session()
+        keys_in = replay.RecordingKeypad(keypad, recording)
+    runtime = Runtime(keys_in, on_key, update_display)
+    runtime.run()
\ No newline at end of file
@@ -0,0 +1,264 @@
+"""Complex evaluation of compiled programs.
+
+A program is compiled for complex evaluation when it mentions i or when
+the calculator is in complex mode. It then runs here instead of in
+Program.run, over the same bytecode. Every stack slot is a pair of floats,
+re at 2k and im at 2k+1, in one preallocated array per program. Operations
+work on those slots in place rather than building complex objects, and
+real programs never pay for any of this.
+
+sin, cos, tan, exp, log, sqrt, abs, pow and user functions are complex.
+asin, acos, atan, dif, solve and integ accept real arguments only.
+"""
+
+from array import array
+from math import sin, cos, log, exp, sqrt, atan2, asin, acos, atan
+from expr import (
+    OP_CONST, OP_X, OP_ADD, OP_SUB, OP_MUL, OP_DIV, OP_POW, OP_NEG,
+    OP_SIN, OP_COS, OP_TAN, OP_LOG, OP_EXP, OP_SQRT, OP_ABS,
+    OP_ASIN, OP_ACOS, OP_ATAN, OP_DIF, OP_LOAD, OP_STORE, OP_SOLVE,
+    OP_VAR, OP_INTEG, OP_I, OP_ARG, OP_CALL, variables, user_functions,
+)
+
+# Integer powers up to this size use repeated multiplication, so i**2 is -1
+# exactly rather than exp(2 log i)
+MAX_INT_POW = 64
+
+
+def _buffer(prog):
+    s = prog.complex_stack
+    if s is None:
+        s = array("f", [0.0] * (2 * (prog.depth + prog.ntemps)))
+        prog.complex_stack = s
+    return s
+
+
+def _args(fn):
+    # (re, im) parameter values of a user function body
+    a = fn.complex_args
+    if a is None:
+        a = array("f", [0.0] * (2 * fn.nargs))
+        fn.complex_args = a
+    return a
+
+
+def _mul(s, k, c, d):
+    # s[k] *= c + di
+    a = s[k]
+    b = s[k + 1]
+    s[k] = a * c - b * d
+    s[k + 1] = a * d + b * c
+
+
+def _div(s, k, c, d):
+    den = c * c + d * d
+    if den == 0:
+        raise ZeroDivisionError("complex division by zero")
+    a = s[k]
+    b = s[k + 1]
+    s[k] = (a * c + b * d) / den
+    s[k + 1] = (b * c - a * d) / den
+
+
+def _exp(s, k):
+    m = exp(s[k])
+    b = s[k + 1]
+    s[k] = m * cos(b)
+    s[k + 1] = m * sin(b)
+
+
+def _log(s, k):
+    a = s[k]
+    b = s[k + 1]
+    r = a * a + b * b
+    if r == 0:
+        raise ValueError("log of zero")
+    s[k] = 0.5 * log(r)
+    s[k + 1] = atan2(b, a)
+
+
+def _sincos(s, k, want_cos):
+    a = s[k]
+    b = s[k + 1]
+    e = exp(b)
+    ch = 0.5 * (e + 1 / e)
+    sh = 0.5 * (e - 1 / e)
+    if want_cos:
+        s[k] = cos(a) * ch
+        s[k + 1] = -sin(a) * sh
+    else:
+        s[k] = sin(a) * ch
+        s[k + 1] = cos(a) * sh
+
+
+def _tan(s, k):
+    # tan(a+bi) = (sin 2a + i sinh 2b) / (cos 2a + cosh 2b)
+    a = 2 * s[k]
+    b = 2 * s[k + 1]
+    e = exp(b)
+    den = cos(a) + 0.5 * (e + 1 / e)
+    if den == 0:
+        raise ValueError("tan pole")
+    s[k] = sin(a) / den
+    s[k + 1] = 0.5 * (e - 1 / e) / den
+
+
+def _sqrt(s, k):
+    a = s[k]
+    b = s[k + 1]
+    r = sqrt(a * a + b * b)
+    re = sqrt(0.5 * (r + a))
+    im = sqrt(0.5 * (r - a))
+    s[k] = re
+    s[k + 1] = -im if b < 0 else im
+
+
+def _pow(s, k, c, d):
+    # s[k] = s[k] ** (c + di)
+    a = s[k]
+    b = s[k + 1]
+    if d == 0 and c == int(c) and abs(c) <= MAX_INT_POW:
+        n = int(abs(c))
+        # Square and multiply
+        ra = 1.0
+        rb = 0.0
+        while n:
+            if n & 1:
+                ra, rb = ra * a - rb * b, ra * b + rb * a
+            a, b = a * a - b * b, 2 * a * b
+            n >>= 1
+        if c < 0:
+            s[k] = 1.0
+            s[k + 1] = 0.0
+            _div(s, k, ra, rb)
+        else:
+            s[k] = ra
+            s[k + 1] = rb
+        return
+    if a == 0 and b == 0:
+        if d == 0 and c > 0:
+            return
+        raise ValueError("zero to a complex power")
+    _log(s, k)
+    _mul(s, k, c, d)
+    _exp(s, k)
+
+
+def _real(s, k):
+    if s[k + 1] != 0:
+        raise ValueError("real argument needed")
+    return s[k]
+
+
+def run_complex(prog, x=0.0):
+    """Evaluate prog at the real x; returns (re, im)."""
+    code = prog.code
+    consts = prog.consts
+    s = _buffer(prog)
+    temps = 2 * prog.depth
+    n = len(code)
+    k = -2
+    pc = 0
+    while pc < n:
+        op = code[pc]
+        pc += 1
+        if op == OP_ARG:
+            k += 2
+            a = prog.complex_args
+            j = 2 * code[pc]
+            pc += 1
+            s[k] = a[j]
+            s[k + 1] = a[j + 1]
+        elif op == OP_CONST or op == OP_X or op == OP_VAR or op == OP_I:
+            k += 2
+            if op == OP_CONST:
+                s[k] = consts[code[pc]]
+                pc += 1
+            elif op == OP_X:
+                s[k] = x
+            elif op == OP_VAR:
+                s[k] = variables[code[pc]]
+                pc += 1
+            else:
+                s[k] = 0.0
+            s[k + 1] = 1.0 if op == OP_I else 0.0
+        elif op == OP_LOAD:
+            k += 2
+            t = temps + 2 * code[pc]
+            pc += 1
+            s[k] = s[t]
+            s[k + 1] = s[t + 1]
+        elif op == OP_STORE:
+            t = temps + 2 * code[pc]
+            pc += 1
+            s[t] = s[k]
+            s[t + 1] = s[k + 1]
+        elif op == OP_ADD:
+            k -= 2
+            s[k] += s[k + 2]
+            s[k + 1] += s[k + 3]
+        elif op == OP_SUB:
+            k -= 2
+            s[k] -= s[k + 2]
+            s[k + 1] -= s[k + 3]
+        elif op == OP_MUL:
+            k -= 2
+            _mul(s, k, s[k + 2], s[k + 3])
+        elif op == OP_DIV:
+            k -= 2
+            _div(s, k, s[k + 2], s[k + 3])
+        elif op == OP_POW:
+            k -= 2
+            _pow(s, k, s[k + 2], s[k + 3])
+        elif op == OP_NEG:
+            s[k] = -s[k]
+            s[k + 1] = -s[k + 1]
+        elif op == OP_SIN or op == OP_COS:
+            _sincos(s, k, op == OP_COS)
+        elif op == OP_TAN:
+            _tan(s, k)
+        elif op == OP_LOG:
+            _log(s, k)
+        elif op == OP_EXP:
+            _exp(s, k)
+        elif op == OP_SQRT:
+            _sqrt(s, k)
+        elif op == OP_ABS:
+            a = s[k]
+            b = s[k + 1]
+            s[k] = sqrt(a * a + b * b)
+            s[k + 1] = 0.0
+        elif op == OP_ASIN:
+            s[k] = asin(_real(s, k))
+        elif op == OP_ACOS:
+            s[k] = acos(_real(s, k))
+        elif op == OP_ATAN:
+            s[k] = atan(_real(s, k))
+        elif op == OP_DIF:
+            from autodiff import derivative
+            s[k] = derivative(prog.subs[code[pc]], _real(s, k), code[pc + 1])
+            pc += 2
+        elif op == OP_SOLVE or op == OP_INTEG:
+            k -= 2
+            a = _real(s, k)
+            b = _real(s, k + 2)
+            sub = prog.subs[code[pc]]
+            pc += 1
+            if op == OP_SOLVE:
+                from solver import first_root
+                s[k] = first_root(sub, a, b)
+            else:
+                from integrate import integral
+                s[k] = integral(sub, a, b)
+        elif op == OP_CALL:
+            fn = user_functions[code[pc]]
+            nargs = code[pc + 1]
+            pc += 2
+            k -= 2 * (nargs - 1)
+            a = _args(fn)
+            for j in range(2 * nargs):
+                a[j] = s[k + j]
+            s[k], s[k + 1] = run_complex(fn, x)
+        else:
+            raise ValueError("bad opcode %d" % op)
+    return s[0], s[1]
@@ -0,0 +1,1106 @@
+"""Compile-once expression engine for the calculator.
+
+Expressions typed on the keypad (numbers, + - * / **, parentheses, pow,
+sin/cos/tan/log and friends, and the variable x) are tokenized and parsed
+once into a postfix program held in an array. Evaluating the program is a
+tight loop over that array with a preallocated value stack, so pressing
+"=" again on the same text never re-lexes or re-compiles it.
+
+Before a program is built, constant sub-trees are folded (pow(10, 3) is
+stored as 1000) and repeated sub-expressions such as cos(x) in
+cos(x)*cos(x) are computed once per evaluation: the first occurrence is
+saved to a temp slot with OP_STORE and the others become OP_LOAD.
+
+dif(E, P) is the derivative of E with respect to x at x=P. E is compiled
+into its own sub-program and differentiated with dual numbers by autodiff,
+so dif(dif(E, x), P) gives the second derivative without any rewriting of
+the source text. solve(E, A, B) is the smallest root of E in [A, B], found
+by the solver module, and integ(E, A, B) the integral of E over [A, B].
+
+A program that mentions i, or is compiled in complex mode, is marked
+is_complex and evaluated by cmplx.run_complex over the same code; real
+programs keep the float loop below.
+
+User functions such as f(x) = x**2 + 1 are Programs whose parameters
+compile to OP_ARG reads. They sit in user_functions, and a call compiles
+to OP_CALL with the function's index, so it is resolved once at compile
+time. userfn.py parses definitions and keeps them on flash.
+"""
+
+from array import array
+from math import sin, cos, tan, log, exp, sqrt, asin, acos, atan, pi, e
+import units
+
+NAN = float("nan")
+INF = float("inf")
+
+# Opcodes. OP_CONST is followed by an index into the constant pool, OP_DIF
+# by an index into the sub-program list and the derivative order, OP_SOLVE
+# and OP_INTEG by a sub-program index, OP_LOAD/OP_STORE by a temp slot and OP_VAR by a
+# slot in the variable store. OP_I pushes the imaginary unit and only
+# appears in complex programs. OP_ARG is followed by a parameter index and
+# OP_CALL by a user function index and its argument count.
+OP_CONST = 0
+OP_X = 1
+OP_ADD = 2
+OP_SUB = 3
+OP_MUL = 4
+OP_DIV = 5
+OP_POW = 6
+OP_NEG = 7
+OP_SIN = 8
+OP_COS = 9
+OP_TAN = 10
+OP_LOG = 11
+OP_EXP = 12
+OP_SQRT = 13
+OP_ABS = 14
+OP_ASIN = 15
+OP_ACOS = 16
+OP_ATAN = 17
+OP_DIF = 18
+OP_LOAD = 19
+OP_STORE = 20
+OP_SOLVE = 21
+OP_VAR = 22
+OP_INTEG = 23
+OP_I = 24
+OP_ARG = 25
+OP_CALL = 26
+
+# Opcodes whose first operand is a sub-program index
+SUB_OPS = (OP_DIF, OP_SOLVE, OP_INTEG)
+
+# Number of operand words following each opcode that has any
+OPERANDS = {
+    OP_CONST: 1,
+    OP_DIF: 2,
+    OP_LOAD: 1,
+    OP_STORE: 1,
+    OP_SOLVE: 1,
+    OP_VAR: 1,
+    OP_INTEG: 1,
+    OP_ARG: 1,
+    OP_CALL: 2,
+}
+
+# Single-argument functions available by name
+FUNCS = {
+    "sin": OP_SIN,
+    "cos": OP_COS,
+    "tan": OP_TAN,
+    "log": OP_LOG,
+    "exp": OP_EXP,
+    "sqrt": OP_SQRT,
+    "abs": OP_ABS,
+    "asin": OP_ASIN,
+    "acos": OP_ACOS,
+    "atan": OP_ATAN,
+}
+
+CONSTS = {
+    "pi": pi,
+    "e": e,
+}
+
+# The variable store. The compiler resolves each name to a fixed slot and
+# programs read the slot at run time, so changing a variable never needs a
+# recompile. x is the argument of run(); its slot holds the value the
+# calculator passes in. ANS is written by history.History.add.
+VAR_NAMES = ("x", "y", "z", "u", "v", "w", "A", "B", "C", "D", "E", "F",
+             "G", "H", "I", "J", "K", "L", "M", "N", "O", "P", "Q", "R",
+             "S", "T", "U", "V", "W", "X", "Y", "Z", "ANS")
+
+VARS = {}
+for _slot in range(len(VAR_NAMES)):
+    VARS[VAR_NAMES[_slot]] = _slot
+
+X_SLOT = VARS["x"]
+
+variables = array("f", [0.0] * len(VAR_NAMES))
+
+# Names called with several arguments that are not in FUNCS
+CALLS = ("pow", "dif", "solve", "integ", "conv")
+
+# Matrix registers and functions, evaluated by matrix.py rather than compiled
+MATRICES = ("MA", "MB", "MC", "MD")
+MATRIX_FUNCS = ("det", "inv", "trn", "mat")
+
+# User functions: name -> index into user_functions
+USER_FUNCS = {}
+user_functions = []
+
+# Token kinds
+T_END = 0
+T_NUM = 1
+T_NAME = 2
+T_OP = 3
+
+# Number of compiled programs kept in the cache
+CACHE_SIZE = 16
+
+_programs = {}
+
+
+def is_function(name):
+    return name in FUNCS or name in CALLS or name in MATRIX_FUNCS or \
+        name in USER_FUNCS
+
+
+def is_operand(name):
+    return name == "x" or name == "i" or name in CONSTS or name in VARS or name in MATRICES or \
+        units.find(name) >= 0
+
+
+def next_token(src, i):
+    """Return (kind, value, start, end) for the token at or after src[i]."""
+    n = len(src)
+    while i < n and src[i] == " ":
+        i += 1
+    if i >= n:
+        return (T_END, None, n, n)
+    start = i
+    ch = src[i]
+    if ch.isdigit() or ch == ".":
+        while i < n and (src[i].isdigit() or src[i] == "."):
+            i += 1
+        # Exponent part, only if digits actually follow it
+        if i < n and src[i] in "eE":
+            j = i + 1
+            if j < n and src[j] in "+-":
+                j += 1
+            if j < n and src[j].isdigit():
+                i = j
+                while i < n and src[i].isdigit():
+                    i += 1
+        try:
+            value = float(src[start:i])
+        except ValueError:
+            raise SyntaxError("bad number at %d" % start)
+        return (T_NUM, value, start, i)
+    if ch.isalpha() or ch == "_":
+        while i < n and (src[i].isalpha() or src[i].isdigit() or src[i] == "_"):
+            i += 1
+        return (T_NAME, src[start:i], start, i)
+    if ch == "*" and i + 1 < n and src[i + 1] == "*":
+        return (T_OP, "**", start, i + 2)
+    if ch in "+-*/(),=":
+        return (T_OP, ch, start, i + 1)
+    raise SyntaxError("unexpected %r at %d" % (ch, start))
+
+
+class Program:
+    """A compiled expression: postfix code, constant pool and stack size."""
+
+    def __init__(self, source, code, consts, depth, subs=(), ntemps=0):
+        self.source = source
+        self.code = code
+        self.consts = consts
+        self.depth = depth
+        self.subs = subs
+        self.ntemps = ntemps
+        # Set by compile_expr; complex programs run in cmplx instead
+        self.is_complex = False
+        self.complex_stack = None
+        # Parameter names, count and values, for user function bodies
+        self.params = ()
+        self.nargs = 0
+        self.args = None
+        self.complex_args = None
+        self.find_var_slots()
+        # Temp slots sit right above the stack
+        self.stack = array("f", [0.0] * (depth + ntemps))
+        # Per-order jet buffers, allocated by autodiff on first use
+        self.jet_buffers = {}
+        # Per-length vector stacks for run_vector()
+        self.vec_buffers = {}
+        # Node and interval buffers of integrate and per-length sample
+        # buffers of solver, made on first use; per program, since an
+        # integrand or equation may itself integrate or solve (a
+        # sub-program) while they are in use
+        self.quad_buffers = None
+        self.sample_buffers = {}
+
+    def find_var_slots(self):
+        # Variable slots read here, by a sub-program or by a called
+        # function, in slot order
+        code = self.code
+        slots = set()
+        pc = 0
+        while pc < len(code):
+            if code[pc] == OP_VAR:
+                slots.add(code[pc + 1])
+            elif code[pc] == OP_CALL and code[pc + 1] < len(user_functions):
+                slots.update(user_functions[code[pc + 1]].var_slots)
+            pc += 1 + OPERANDS.get(code[pc], 0)
+        for sub in self.subs:
+            slots.update(sub.var_slots)
+        self.var_slots = tuple(sorted(slots))
+        self.uses_vars = bool(slots)
+
+    def run(self, x=0.0):
+        code = self.code
+        consts = self.consts
+        stack = self.stack
+        n = len(code)
+        sp = -1
+        pc = 0
+        while pc < n:
+            op = code[pc]
+            pc += 1
+            if op == OP_CONST:
+                sp += 1
+                stack[sp] = consts[code[pc]]
+                pc += 1
+            elif op == OP_X:
+                sp += 1
+                stack[sp] = x
+            elif op == OP_VAR:
+                sp += 1
+                stack[sp] = variables[code[pc]]
+                pc += 1
+            elif op == OP_LOAD:
+                sp += 1
+                stack[sp] = stack[self.depth + code[pc]]
+                pc += 1
+            elif op == OP_ARG:
+                sp += 1
+                stack[sp] = self.args[code[pc]]
+                pc += 1
+            elif op == OP_STORE:
+                stack[self.depth + code[pc]] = stack[sp]
+                pc += 1
+            elif op == OP_ADD:
+                sp -= 1
+                stack[sp] = stack[sp] + stack[sp + 1]
+            elif op == OP_SUB:
+                sp -= 1
+                stack[sp] = stack[sp] - stack[sp + 1]
+            elif op == OP_MUL:
+                sp -= 1
+                stack[sp] = stack[sp] * stack[sp + 1]
+            elif op == OP_DIV:
+                sp -= 1
+                stack[sp] = stack[sp] / stack[sp + 1]
+            elif op == OP_POW:
+                sp -= 1
+                v = stack[sp] ** stack[sp + 1]
+                if not isinstance(v, float):
+                    # Negative base to a fractional power
+                    raise ValueError("math domain error")
+                stack[sp] = v
+            elif op == OP_NEG:
+                stack[sp] = -stack[sp]
+            elif op == OP_SIN:
+                stack[sp] = sin(stack[sp])
+            elif op == OP_COS:
+                stack[sp] = cos(stack[sp])
+            elif op == OP_TAN:
+                stack[sp] = tan(stack[sp])
+            elif op == OP_LOG:
+                stack[sp] = log(stack[sp])
+            elif op == OP_EXP:
+                stack[sp] = exp(stack[sp])
+            elif op == OP_SQRT:
+                stack[sp] = sqrt(stack[sp])
+            elif op == OP_ABS:
+                stack[sp] = abs(stack[sp])
+            elif op == OP_ASIN:
+                stack[sp] = asin(stack[sp])
+            elif op == OP_ACOS:
+                stack[sp] = acos(stack[sp])
+            elif op == OP_ATAN:
+                stack[sp] = atan(stack[sp])
+            elif op == OP_DIF:
+                from autodiff import derivative
+                stack[sp] = derivative(self.subs[code[pc]], stack[sp], code[pc + 1])
+                pc += 2
+            elif op == OP_SOLVE:
+                from solver import first_root
+                sp -= 1
+                stack[sp] = first_root(self.subs[code[pc]], stack[sp], stack[sp + 1])
+                pc += 1
+            elif op == OP_INTEG:
+                from integrate import integral
+                sp -= 1
+                stack[sp] = integral(self.subs[code[pc]], stack[sp], stack[sp + 1])
+                pc += 1
+            elif op == OP_CALL:
+                fn = _callee(code[pc], code[pc + 1])
+                # The result replaces the first argument
+                sp -= code[pc + 1] - 1
+                args = fn.args
+                for j in range(fn.nargs):
+                    args[j] = stack[sp + j]
+                stack[sp] = fn.run(x)
+                pc += 2
+            else:
+                raise ValueError("bad opcode %d" % op)
+        return stack[0]
+
+
+    def run_vector(self, xs, out, n=None):
+        """Evaluate over xs[:n] into the preallocated out[:n].
+
+        Each opcode runs across the whole vector before the next one, and
+        the stack vectors are kept per length so redrawing allocates
+        nothing. Points outside the domain come out as nan instead of
+        raising, so one bad sample doesn't abort a plot.
+        """
+        if n is None:
+            n = len(xs)
+        stack = self.vec_buffers.get(n)
+        if stack is None:
+            stack = [None]
+            for _ in range(1, self.depth + self.ntemps):
+                stack.append(array("f", [0.0] * n))
+            self.vec_buffers[n] = stack
+        # The bottom of the stack is the caller's output buffer
+        stack[0] = out
+        code = self.code
+        consts = self.consts
+        r = range(n)
+        sp = -1
+        pc = 0
+        while pc < len(code):
+            op = code[pc]
+            pc += 1
+            if op == OP_CONST or op == OP_X or op == OP_LOAD or op == OP_VAR:
+                sp += 1
+                a = stack[sp]
+                if op == OP_CONST or op == OP_VAR:
+                    c = consts[code[pc]] if op == OP_CONST else variables[code[pc]]
+                    pc += 1
+                    for i in r:
+                        a[i] = c
+                elif op == OP_LOAD:
+                    t = stack[self.depth + code[pc]]
+                    pc += 1
+                    for i in r:
+                        a[i] = t[i]
+                else:
+                    for i in r:
+                        a[i] = xs[i]
+                continue
+            if op == OP_STORE:
+                a = stack[sp]
+                t = stack[self.depth + code[pc]]
+                pc += 1
+                for i in r:
+                    t[i] = a[i]
+                continue
+            if op == OP_CALL:
+                # Function bodies run point by point
+                fn = _callee(code[pc], code[pc + 1])
+                sp -= code[pc + 1] - 1
+                pc += 2
+                a = stack[sp]
+                args = fn.args
+                for i in r:
+                    for j in range(fn.nargs):
+                        args[j] = stack[sp + j][i]
+                    try:
+                        a[i] = fn.run(xs[i])
+                    except (ValueError, ZeroDivisionError):
+                        a[i] = NAN
+                continue
+            a = stack[sp]
+            if op <= OP_POW:
+                sp -= 1
+                b = a
+                a = stack[sp]
+                if op == OP_ADD:
+                    for i in r:
+                        a[i] = a[i] + b[i]
+                elif op == OP_SUB:
+                    for i in r:
+                        a[i] = a[i] - b[i]
+                elif op == OP_MUL:
+                    for i in r:
+                        a[i] = a[i] * b[i]
+                elif op == OP_DIV:
+                    for i in r:
+                        d = b[i]
+                        a[i] = a[i] / d if d != 0 else NAN
+                else:
+                    for i in r:
+                        try:
+                            v = a[i] ** b[i]
+                            a[i] = v if isinstance(v, float) else NAN
+                        except (ValueError, ZeroDivisionError):
+                            a[i] = NAN
+                        except OverflowError:
+                            a[i] = INF
+            elif op == OP_NEG:
+                for i in r:
+                    a[i] = -a[i]
+            elif op == OP_SIN:
+                for i in r:
+                    a[i] = sin(a[i])
+            elif op == OP_COS:
+                for i in r:
+                    a[i] = cos(a[i])
+            elif op == OP_TAN:
+                for i in r:
+                    a[i] = tan(a[i])
+            elif op == OP_LOG:
+                for i in r:
+                    v = a[i]
+                    a[i] = log(v) if v > 0 else NAN
+            elif op == OP_EXP:
+                for i in r:
+                    v = a[i]
+                    a[i] = exp(v) if v < 88 else INF
+            elif op == OP_SQRT:
+                for i in r:
+                    v = a[i]
+                    a[i] = sqrt(v) if v >= 0 else NAN
+            elif op == OP_ABS:
+                for i in r:
+                    a[i] = abs(a[i])
+            elif op == OP_ASIN or op == OP_ACOS:
+                f = asin if op == OP_ASIN else acos
+                for i in r:
+                    v = a[i]
+                    a[i] = f(v) if -1 <= v <= 1 else NAN
+            elif op == OP_ATAN:
+                for i in r:
+                    a[i] = atan(a[i])
+            elif op == OP_DIF:
+                from autodiff import derivative
+                sub = self.subs[code[pc]]
+                order = code[pc + 1]
+                pc += 2
+                for i in r:
+                    try:
+                        a[i] = derivative(sub, a[i], order)
+                    except (ValueError, ZeroDivisionError):
+                        a[i] = NAN
+            elif op == OP_SOLVE or op == OP_INTEG:
+                if op == OP_SOLVE:
+                    from solver import first_root as f
+                else:
+                    from integrate import integral as f
+                sub = self.subs[code[pc]]
+                pc += 1
+                sp -= 1
+                b = a
+                a = stack[sp]
+                for i in r:
+                    try:
+                        a[i] = f(sub, a[i], b[i])
+                    except (ValueError, ZeroDivisionError):
+                        a[i] = NAN
+            else:
+                raise ValueError("bad opcode %d" % op)
+        return out
+
+
+def _callee(index, nargs):
+    # A program compiled before its function was redefined must not run it
+    fn = user_functions[index]
+    if fn.nargs != nargs:
+        raise ValueError("function changed, recompile")
+    return fn
+
+
+class _Parser:
+    # Recursive descent parser emitting postfix code directly:
+    #   expr  := term (('+' | '-') term)*
+    #   term  := unary (('*' | '/') unary)*
+    #   unary := ('-' | '+') unary | power
+    #   power := atom ('**' unary)?
+    #   atom  := NUMBER | NAME | NAME '(' args ')' | '(' expr ')'
+
+    def __init__(self, src, complex_mode=False, params=()):
+        self.src = src
+        self.complex_mode = complex_mode
+        # Parameter names of a user function body, compiled to OP_ARG, and
+        # those out of reach inside a dif/solve/integ argument
+        self.params = params
+        self.hidden = ()
+        self.code = []
+        self.consts = []
+        self.subs = []
+        self.advance(0)
+
+    def advance(self, i):
+        self.kind, self.value, self.start, self.end = next_token(self.src, i)
+
+    def accept(self, op):
+        if self.kind == T_OP and self.value == op:
+            self.advance(self.end)
+            return True
+        return False
+
+    def expect(self, op):
+        if not self.accept(op):
+            raise SyntaxError("expected %r at %d" % (op, self.start))
+
+    def emit_const(self, value):
+        if value in self.consts:
+            index = self.consts.index(value)
+        else:
+            index = len(self.consts)
+            self.consts.append(value)
+        self.code.append(OP_CONST)
+        self.code.append(index)
+
+    def parse(self):
+        self.expr()
+        if self.kind != T_END:
+            raise SyntaxError("unexpected %r at %d" % (self.value, self.start))
+
+    def expr(self):
+        self.term()
+        while True:
+            if self.accept("+"):
+                self.term()
+                self.code.append(OP_ADD)
+            elif self.accept("-"):
+                self.term()
+                self.code.append(OP_SUB)
+            else:
+                return
+
+    def term(self):
+        self.unary()
+        while True:
+            if self.accept("*"):
+                self.unary()
+                self.code.append(OP_MUL)
+            elif self.accept("/"):
+                self.unary()
+                self.code.append(OP_DIV)
+            else:
+                return
+
+    def unary(self):
+        if self.accept("-"):
+            self.unary()
+            self.code.append(OP_NEG)
+        elif self.accept("+"):
+            self.unary()
+        else:
+            self.power()
+
+    def power(self):
+        self.atom()
+        if self.accept("**"):
+            self.unary()
+            self.code.append(OP_POW)
+
+    def atom(self):
+        kind = self.kind
+        value = self.value
+        if kind == T_NUM:
+            self.advance(self.end)
+            self.emit_const(value)
+        elif kind == T_NAME:
+            self.advance(self.end)
+            if self.accept("("):
+                self.call(value)
+            elif value in self.params:
+                self.code.append(OP_ARG)
+                self.code.append(self.params.index(value))
+            elif value in self.hidden and value != "x":
+                raise SyntaxError("parameter %s inside %r" % (value, self.src))
+            elif value == "x":
+                self.code.append(OP_X)
+            elif value == "i":
+                self.code.append(OP_I)
+                self.complex_mode = True
+            elif value in VARS:
+                self.code.append(OP_VAR)
+                self.code.append(VARS[value])
+            elif value in CONSTS:
+                self.emit_const(CONSTS[value])
+            elif value in MATRICES:
+                raise SyntaxError("matrix %s in a scalar expression" % value)
+            else:
+                raise SyntaxError("unknown name %r" % value)
+        elif self.accept("("):
+            self.expr()
+            self.expect(")")
+        elif kind == T_END:
+            raise SyntaxError("unexpected end")
+        else:
+            raise SyntaxError("unexpected %r at %d" % (value, self.start))
+
+    def call(self, name):
+        if name == "pow":
+            self.expr()
+            self.expect(",")
+            self.expr()
+            self.code.append(OP_POW)
+        elif name == "log":
+            self.expr()
+            self.code.append(OP_LOG)
+            # log(a, b) is log(a) / log(b)
+            if self.accept(","):
+                self.expr()
+                self.code.append(OP_LOG)
+                self.code.append(OP_DIV)
+        elif name == "dif":
+            self.dif()
+        elif name == "conv":
+            self.conv()
+        elif name == "solve" or name == "integ":
+            sub = self.sub_program()
+            self.expect(",")
+            self.expr()
+            self.expect(",")
+            self.expr()
+            self.code.append(OP_SOLVE if name == "solve" else OP_INTEG)
+            self.code.append(len(self.subs))
+            self.subs.append(sub)
+        elif name in FUNCS:
+            self.expr()
+            self.code.append(FUNCS[name])
+        elif name in USER_FUNCS:
+            index = USER_FUNCS[name]
+            fn = user_functions[index]
+            self.expr()
+            for _ in range(1, fn.nargs):
+                self.expect(",")
+                self.expr()
+            self.code.append(OP_CALL)
+            self.code.append(index)
+            self.code.append(fn.nargs)
+            if fn.is_complex:
+                self.complex_mode = True
+        else:
+            raise SyntaxError("unknown function %r" % name)
+        self.expect(")")
+
+    def sub_program(self):
+        # Compile the next expression argument into its own Program
+        code, consts = self.code, self.consts
+        self.code, self.consts = [], []
+        start = self.start
+        subs_before = len(self.subs)
+        # x is the variable of dif/solve/integ; parameters are not visible
+        params, hidden = self.params, self.hidden
+        self.params, self.hidden = (), params + hidden
+        self.expr()
+        self.params, self.hidden = params, hidden
+        if OP_I in opcodes(self.code):
+            raise SyntaxError("dif, solve and integ need a real expression")
+        sub = make_program(self.src[start:self.start].strip(), self.code,
+                           self.consts, self.subs[subs_before:])
+        del self.subs[subs_before:]
+        self.code, self.consts = code, consts
+        return sub
+
+    def unit(self):
+        if self.kind != T_NAME or units.find(self.value) < 0:
+            raise SyntaxError("expected unit at %d" % self.start)
+        index = units.find(self.value)
+        self.advance(self.end)
+        return index
+
+    def conv(self):
+        # conv(E, km, m) becomes E * m + c, so no opcode is needed
+        self.expr()
+        self.expect(",")
+        src = self.unit()
+        self.expect(",")
+        dst = self.unit()
+        try:
+            m, c = units.converter(src, dst)
+        except ValueError as e:
+            raise SyntaxError(str(e))
+        if m != 1:
+            self.emit_const(m)
+            self.code.append(OP_MUL)
+        if c != 0:
+            self.emit_const(c)
+            self.code.append(OP_ADD)
+
+    def dif(self):
+        sub = self.sub_program()
+        order = 1
+        # dif(dif(E, x), P) differentiates E twice
+        sub_code = sub.code
+        if len(sub_code) == 4 and sub_code[0] == OP_X and sub_code[1] == OP_DIF:
+            order += sub_code[3]
+            sub = sub.subs[sub_code[2]]
+        # The point defaults to x so dif(E) is the derivative function;
+        # in a function body with a parameter x, that argument
+        if self.accept(","):
+            self.expr()
+        elif "x" in self.params:
+            self.code.append(OP_ARG)
+            self.code.append(self.params.index("x"))
+        else:
+            self.code.append(OP_X)
+        self.code.append(OP_DIF)
+        self.code.append(len(self.subs))
+        self.code.append(order)
+        self.subs.append(sub)
+
+
+def stack_effect(op):
+    # OP_CALL takes its argument count from the code; see stack_depth
+    if op == OP_CONST or op == OP_X or op == OP_LOAD or op == OP_VAR or \
+            op == OP_I or op == OP_ARG:
+        return 1
+    if op >= OP_ADD and op <= OP_POW or op == OP_SOLVE or op == OP_INTEG:
+        return -1
+    return 0
+
+
+def opcodes(code):
+    # The opcodes of code, skipping operand words
+    ops = []
+    pc = 0
+    while pc < len(code):
+        ops.append(code[pc])
+        pc += 1 + OPERANDS.get(code[pc], 0)
+    return ops
+
+
+def stack_depth(code):
+    depth = 0
+    top = 0
+    pc = 0
+    n = len(code)
+    while pc < n:
+        op = code[pc]
+        if op == OP_CALL:
+            top += 1 - code[pc + 2]
+        else:
+            top += stack_effect(op)
+        if top > depth:
+            depth = top
+        pc += 1 + OPERANDS.get(op, 0)
+    return depth
+
+
+def arity(op):
+    if op == OP_CONST or op == OP_X or op == OP_LOAD or op == OP_VAR or \
+            op == OP_I or op == OP_ARG:
+        return 0
+    if op >= OP_ADD and op <= OP_POW or op == OP_SOLVE or op == OP_INTEG:
+        return 2
+    return 1
+
+
+def calls_user(prog):
+    """True if prog or one of its sub-programs calls a user function."""
+    code = prog.code
+    pc = 0
+    while pc < len(code):
+        if code[pc] == OP_CALL:
+            return True
+        pc += 1 + OPERANDS.get(code[pc], 0)
+    for sub in prog.subs:
+        if calls_user(sub):
+            return True
+    return False
+
+
+def _fold(op, args, a, b, subs):
+    # Value of op applied to constants, or None to leave it for run time
+    try:
+        if op == OP_ADD:
+            return a + b
+        if op == OP_SUB:
+            return a - b
+        if op == OP_MUL:
+            return a * b
+        if op == OP_DIV:
+            return a / b
+        if op == OP_POW:
+            v = a ** b
+            return v if isinstance(v, float) else None
+        if op == OP_NEG:
+            return -a
+        if op == OP_SIN:
+            return sin(a)
+        if op == OP_COS:
+            return cos(a)
+        if op == OP_TAN:
+            return tan(a)
+        if op == OP_LOG:
+            return log(a)
+        if op == OP_EXP:
+            return exp(a)
+        if op == OP_SQRT:
+            return sqrt(a)
+        if op == OP_ABS:
+            return abs(a)
+        if op == OP_ASIN:
+            return asin(a)
+        if op == OP_ACOS:
+            return acos(a)
+        if op == OP_ATAN:
+            return atan(a)
+        # Sub-programs reading variables must see their values at run time,
+        # and ones calling a user function its current definition
+        if op in SUB_OPS and (subs[args[0]].uses_vars or
+                              calls_user(subs[args[0]])):
+            return None
+        if op == OP_DIF:
+            from autodiff import derivative
+            return derivative(subs[args[0]], a, args[1])
+        if op == OP_SOLVE:
+            from solver import first_root
+            return first_root(subs[args[0]], a, b)
+        if op == OP_INTEG:
+            from integrate import integral
+            return integral(subs[args[0]], a, b)
+    except (ValueError, ZeroDivisionError, OverflowError):
+        pass
+    return None
+
+
+def _tree(code, consts, subs):
+    # Rebuild the expression tree from postfix as nested (op, args, kids)
+    # tuples, folding constant sub-trees on the way. Equal tuples are equal
+    # sub-expressions, which is what the CSE pass keys on.
+    canon = {}
+    stack = []
+    pc = 0
+    while pc < len(code):
+        op = code[pc]
+        nargs = OPERANDS.get(op, 0)
+        args = tuple(code[pc + 1:pc + 1 + nargs])
+        pc += 1 + nargs
+        if op == OP_CONST:
+            stack.append((OP_CONST, (float(consts[args[0]]),), ()))
+            continue
+        if op in SUB_OPS:
+            # Identical sub-program bodies share the first one
+            args = (canon.setdefault(subs[args[0]].source, args[0]),) + args[1:]
+        n = args[1] if op == OP_CALL else arity(op)
+        kids = tuple(stack[len(stack) - n:]) if n else ()
+        del stack[len(stack) - n:]
+        if n and all(kid[0] == OP_CONST for kid in kids):
+            value = _fold(op, args, kids[0][1][0], kids[-1][1][0], subs)
+            if value is not None:
+                stack.append((OP_CONST, (value,), ()))
+                continue
+        stack.append((op, args, kids))
+    return stack[0]
+
+
+class _Emitter:
+    # Writes a tree back out as postfix. Sub-trees met more than once get
+    # a temp slot: stored after their first evaluation, loaded afterwards.
+
+    def __init__(self, root):
+        self.code = []
+        self.consts = []
+        self.shared = {}
+        self.ntemps = 0
+        self.find_shared(root, {})
+        self.emit(root)
+
+    def find_shared(self, node, seen):
+        if not node[2]:
+            return
+        if node in seen:
+            self.shared[node] = -1
+            return
+        seen[node] = True
+        for kid in node[2]:
+            self.find_shared(kid, seen)
+
+    def emit(self, node):
+        op, args, kids = node
+        code = self.code
+        t = self.shared.get(node)
+        if t is not None and t >= 0:
+            code.append(OP_LOAD)
+            code.append(t)
+            return
+        for kid in kids:
+            self.emit(kid)
+        code.append(op)
+        if op == OP_CONST:
+            value = args[0]
+            if value not in self.consts:
+                self.consts.append(value)
+            code.append(self.consts.index(value))
+        else:
+            code.extend(args)
+        if t is not None:
+            self.shared[node] = self.ntemps
+            code.append(OP_STORE)
+            code.append(self.ntemps)
+            self.ntemps += 1
+
+
+def optimise(code, consts, subs=()):
+    """Fold constants and share repeated sub-expressions.
+
+    Returns (code, consts, ntemps).
+    """
+    out = _Emitter(_tree(code, consts, subs))
+    return out.code, out.consts, out.ntemps
+
+
+def make_program(src, code, consts, subs=()):
+    code, consts, ntemps = optimise(code, consts, subs)
+    code = array("H", code)
+    return Program(src, code, array("f", consts), stack_depth(code),
+                   tuple(subs), ntemps)
+
+
+def compile_expr(src, complex_mode=False, cache=True):
+    """Return the compiled Program for src, reusing a cached one if possible.
+
+    With cache False a newly compiled program is not kept, for one-off
+    texts such as the editor's preview of a partial expression.
+    """
+    key = (src, True) if complex_mode else src
+    prog = _programs.get(key)
+    if prog is not None:
+        return prog
+    parser = _Parser(src, complex_mode)
+    parser.parse()
+    prog = make_program(src, parser.code, parser.consts, parser.subs)
+    prog.is_complex = parser.complex_mode
+    if not cache:
+        return prog
+    if len(_programs) >= CACHE_SIZE:
+        _programs.clear()
+    _programs[key] = prog
+    return prog
+
+
+def cache_program(prog):
+    """Put an already compiled program in the cache under its source, so
+    compile_expr finds it without parsing (see saved)."""
+    key = (prog.source, True) if prog.is_complex else prog.source
+    if len(_programs) >= CACHE_SIZE:
+        _programs.clear()
+    _programs[key] = prog
+    return prog
+
+
+def define_function(name, params, body):
+    """Compile body with params and install it as the user function name.
+
+    Returns the function's index; redefining a name keeps its index.
+    """
+    parser = _Parser(body, params=tuple(params))
+    parser.parse()
+    prog = make_program(body, parser.code, parser.consts, parser.subs)
+    prog.is_complex = parser.complex_mode
+    install_function(name, prog, params)
+    return USER_FUNCS[name]
+
+
+def install_function(name, prog, params):
+    index = USER_FUNCS.get(name)
+    # Calls are resolved at compile time, so a call back to name from its
+    # own body (directly or through another function) would never end
+    if index is not None and _calls(prog, index):
+        raise SyntaxError("%s calls itself" % name)
+    prog.params = tuple(params)
+    prog.nargs = len(params)
+    prog.args = array("f", [0.0] * prog.nargs)
+    if index is None:
+        USER_FUNCS[name] = len(user_functions)
+        user_functions.append(prog)
+    else:
+        user_functions[index] = prog
+    # Cached programs may call the old body
+    _programs.clear()
+
+
+def _calls(prog, index):
+    code = prog.code
+    pc = 0
+    while pc < len(code):
+        op = code[pc]
+        if op == OP_CALL:
+            if code[pc + 1] == index or _calls(user_functions[code[pc + 1]], index):
+                return True
+        pc += 1 + OPERANDS.get(op, 0)
+    for sub in prog.subs:
+        if _calls(sub, index):
+            return True
+    return False
+
+
+def set_var(name, value):
+    variables[VARS[name]] = value
+
+
+def get_var(name):
+    return variables[VARS[name]]
+
+
+def call_args(src, name):
+    """Argument texts of src when it is a single call name(a, b, ...),
+    otherwise None; for forms the calculator handles outside the
+    compiler, such as sys() and roots()."""
+    src = src.strip()
+    if not src.startswith(name + "(") or not src.endswith(")"):
+        return None
+    # "sys(a)+(b)" is not a single call
+    return split_args(src[len(name) + 1:-1])
+
+
+def split_args(src):
+    """Texts of the comma-separated parts of src outside any parentheses,
+    or None if its parentheses do not balance."""
+    parts = []
+    depth = 0
+    start = 0
+    for i in range(len(src)):
+        c = src[i]
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+            if depth < 0:
+                return None
+        elif c == "," and depth == 0:
+            parts.append(src[start:i].strip())
+            start = i + 1
+    parts.append(src[start:].strip())
+    return parts
+
+
+def equation(src):
+    """"a = b" as a-(b), to be solved for zero; other text unchanged."""
+    if "=" not in src:
+        return src
+    lhs, rhs = src.split("=", 1)
+    return "%s-(%s)" % (lhs.strip(), rhs.strip())
+
+
+def assignment(src):
+    """For "NAME = expr" return (slot, offset of expr), otherwise None."""
+    kind, name, start, end = next_token(src, 0)
+    if kind != T_NAME or name not in VARS:
+        return None
+    kind, value, start, end = next_token(src, end)
+    if kind != T_OP or value != "=":
+        return None
+    return VARS[name], end
+
+
+def evaluate(src, x=0.0, cache=True):
+    """Real value of src; a complex program must come out real."""
+    prog = compile_expr(src, cache=cache)
+    if not prog.is_complex:
+        return prog.run(x)
+    from cmplx import run_complex
+    re, im = run_complex(prog, x)
+    if im != 0:
+        raise ValueError("complex result")
+    return re
+
+
+def evaluate_complex(src, x=0.0, complex_mode=True):
+    """Return (re, im); real programs still take the float path."""
+    prog = compile_expr(src, complex_mode)
+    if not prog.is_complex:
+        return prog.run(x), 0.0
+    from cmplx import run_complex
+    return run_complex(prog, x)
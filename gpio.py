@@ -0,0 +1,102 @@
+"""Key matrix access through the ESP32 GPIO registers.
+
+Reading a key with Pin(...).value() goes through the Pin layer for every
+column. MatrixPort instead writes the output register of a bank once to
+select a row and reads the input register of a bank once to sample every
+column. When the rows and the columns each sit in one bank (GPIO 0-31
+or 32-39) a scan of the 8x5 matrix is 8 writes and 8 reads, plus one
+read of the output latch and one write to release the rows; lines spread
+over both banks cost a few more.
+The pins must already be configured, which Keypad does once with Pin
+objects.
+
+mem is anything indexable by register address: machine.mem32 on the
+board, or gpio_stub.Registers on a PC. Only GPIOs below 30 and 32-39
+exist, so register values stay small ints and reading them allocates
+nothing.
+"""
+
+from array import array
+
+# ESP32 GPIO registers; index 0 is GPIO 0-31, index 1 is GPIO 32-39
+GPIO_OUT = (0x3FF44004, 0x3FF44010)
+GPIO_OUT_W1TS = (0x3FF44008, 0x3FF44014)
+GPIO_OUT_W1TC = (0x3FF4400C, 0x3FF44018)
+GPIO_IN = (0x3FF4403C, 0x3FF44040)
+
+
+def bank(pin):
+    return 1 if pin >= 32 else 0
+
+
+def bit(pin):
+    return 1 << (pin & 31)
+
+
+class MatrixPort:
+    def __init__(self, drive_pins, sense_pins, mem=None):
+        if mem is None:
+            # Looked up here rather than on import, so that a fake machine
+            # installed after this module was loaded (hostfake) is used
+            from machine import mem32  # type: ignore
+            mem = mem32
+        self.mem = mem
+        n = len(drive_pins)
+        # Per drive line: its bank and bit; per bank: all drive bits
+        self.drive_bank = bytearray([bank(p) for p in drive_pins])
+        self.drive_bit = array("L", [bit(p) for p in drive_pins])
+        self.drive_mask = array("L", [0, 0])
+        for p in drive_pins:
+            self.drive_mask[bank(p)] |= bit(p)
+        self.sense_bank = bytearray([bank(p) for p in sense_pins])
+        self.sense_bit = array("L", [bit(p) for p in sense_pins])
+        self.sense_mask = array("L", [0, 0])
+        for p in sense_pins:
+            self.sense_mask[bank(p)] |= bit(p)
+        # Input registers sampled per drive line by scan(), bank 0 then 1
+        self.samples = array("L", [0] * (2 * n))
+        self.scans = 0
+
+    def drive_all(self, level):
+        """Set every drive line to level."""
+        regs = GPIO_OUT_W1TS if level else GPIO_OUT_W1TC
+        for b in range(2):
+            if self.drive_mask[b]:
+                self.mem[regs[b]] = self.drive_mask[b]
+
+    def scan(self):
+        """Pull each drive line low in turn, the others high, and keep the
+        input registers in samples; leaves every drive line high."""
+        mem = self.mem
+        mask = self.drive_mask
+        samples = self.samples
+        read0 = self.sense_mask[0] != 0
+        read1 = self.sense_mask[1] != 0
+        # Outputs of the bank with every drive line high
+        high0 = (mem[GPIO_OUT[0]] | mask[0]) if mask[0] else 0
+        high1 = (mem[GPIO_OUT[1]] | mask[1]) if mask[1] else 0
+        out0 = -1
+        out1 = -1
+        for d in range(len(self.drive_bit)):
+            if self.drive_bank[d]:
+                v0 = high0
+                v1 = high1 & ~self.drive_bit[d]
+            else:
+                v0 = high0 & ~self.drive_bit[d]
+                v1 = high1
+            # Only write a bank whose value changes
+            if mask[0] and v0 != out0:
+                mem[GPIO_OUT[0]] = v0
+                out0 = v0
+            if mask[1] and v1 != out1:
+                mem[GPIO_OUT[1]] = v1
+                out1 = v1
+            samples[2 * d] = mem[GPIO_IN[0]] if read0 else 0
+            samples[2 * d + 1] = mem[GPIO_IN[1]] if read1 else 0
+        self.drive_all(1)
+        self.scans += 1
+
+    def closed(self, d, s):
+        """True if the key on drive line d and sense line s was closed in
+        the last scan (its sense line read low)."""
+        return not self.samples[2 * d + self.sense_bank[s]] & self.sense_bit[s]
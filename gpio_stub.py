@@ -0,0 +1,64 @@
+"""Host stand-in for the ESP32 GPIO registers used by gpio.MatrixPort.
+
+Registers keeps the output latches of both banks and works out the input
+registers from the keys held down: a closed key connects its drive pin
+to its sense pin, so the sense pin reads low while that drive pin is
+driven low; otherwise the pull-up keeps it high. It counts register
+reads and writes so a scan's cost can be checked without hardware.
+
+    regs = Registers()
+    port = MatrixPort(rows, cols, regs)
+    regs.press(rows[2], cols[4])
+"""
+
+from gpio import GPIO_OUT, GPIO_OUT_W1TS, GPIO_OUT_W1TC, GPIO_IN, bank, bit
+
+
+class Registers:
+    def __init__(self):
+        self.out = [0, 0]
+        # (drive pin, sense pin) of the keys held down
+        self.keys = set()
+        self.reads = 0
+        self.writes = 0
+
+    def press(self, drive_pin, sense_pin):
+        self.keys.add((drive_pin, sense_pin))
+
+    def release(self, drive_pin, sense_pin):
+        self.keys.discard((drive_pin, sense_pin))
+
+    def release_all(self):
+        self.keys.clear()
+
+    def level(self, pin):
+        return 1 if self.out[bank(pin)] & bit(pin) else 0
+
+    def __getitem__(self, address):
+        self.reads += 1
+        for b in range(2):
+            if address == GPIO_OUT[b]:
+                return self.out[b]
+            if address == GPIO_IN[b]:
+                # Everything floats high except sense lines pulled down
+                # through a closed key
+                value = 0x3FFFFFFF if b == 0 else 0xFF
+                for drive_pin, sense_pin in self.keys:
+                    if bank(sense_pin) == b and not self.level(drive_pin):
+                        value &= ~bit(sense_pin)
+                return value
+        raise ValueError("no register at 0x%08x" % address)
+
+    def __setitem__(self, address, value):
+        self.writes += 1
+        for b in range(2):
+            if address == GPIO_OUT[b]:
+                self.out[b] = value
+                return
+            if address == GPIO_OUT_W1TS[b]:
+                self.out[b] |= value
+                return
+            if address == GPIO_OUT_W1TC[b]:
+                self.out[b] &= ~value
+                return
+        raise ValueError("no register at 0x%08x" % address)
@@ -1,18 +1,18 @@
 from math import *
-def fun(x):
-    return sin(x)
+from expr import compile_expr
+from table import ValueTable
+fun=compile_expr("sin(x)")
 resolution=7
 x_range=2*resolution
 y_range=1*resolution
 x_dots=64
 y_dots=32
 
-for i in range(x_dots):
-    x_value=i*x_range/x_dots
-    j=y_dots*fun(x_value)/y_range
-    print("x_dot = ",i," y_dot = ",int(j), " x_value = ",x_value, " y_value = ",fun(x_value))
+# Each sweep is a lazy table, evaluated a few rows at a time
+for i, x, y in ValueTable(fun, 0, x_range/x_dots, x_dots).rows():
+    j=y_dots*y/y_range
+    print("x_dot = ",i," y_dot = ",int(j), " x_value = ",x, " y_value = ",y)
 print("")
-for i in range(x_dots):
-    x_value=-i*x_range/x_dots
-    j=y_dots*fun(x_value)/y_range
-    print("x_dot = ",-i," y_dot = ",int(j), " x_value = ",x_value, " y_value = ",fun(x_value))
+for i, x, y in ValueTable(fun, 0, -x_range/x_dots, x_dots).rows():
+    j=y_dots*y/y_range
+    print("x_dot = ",-i," y_dot = ",int(j), " x_value = ",x, " y_value = ",y)
@@ -0,0 +1,90 @@
+"""Fixed-capacity history of (expression, result) pairs.
+
+Entries live in a ring allocated once: expression text as bytes in one
+bytearray with a fixed stride, its length in an array('H'), and the result
+as a (re, im) pair in an array('f'). Adding an entry overwrites the oldest
+slot in place, so the history never grows the heap; text past text_len
+is cut off. A browse cursor walks the ring one slot per key press.
+
+The newest real result is also written to the ANS slot of the variable
+store, which is how ANS in an expression reads it without formatting and
+re-parsing the number.
+"""
+
+from array import array
+from expr import VARS, variables
+
+CAPACITY = 16
+TEXT_LEN = 64
+
+
+class History:
+    def __init__(self, capacity=CAPACITY, text_len=TEXT_LEN):
+        self.capacity = capacity
+        self.text_len = text_len
+        self.text = bytearray(capacity * text_len)
+        self.lengths = array("H", [0] * capacity)
+        self.values = array("f", [0.0] * (2 * capacity))
+        # Slot of the newest entry and number of entries held
+        self.head = -1
+        self.count = 0
+        # Entries back from the newest while browsing, -1 when not
+        self.cursor = -1
+
+    def add(self, expression, re, im=0.0):
+        slot = (self.head + 1) % self.capacity
+        n = min(len(expression), self.text_len)
+        base = slot * self.text_len
+        buf = self.text
+        for j in range(n):
+            buf[base + j] = ord(expression[j]) & 0x7F
+        self.lengths[slot] = n
+        self.values[2 * slot] = re
+        self.values[2 * slot + 1] = im
+        self.head = slot
+        if self.count < self.capacity:
+            self.count += 1
+        self.cursor = -1
+        if im == 0:
+            variables[VARS["ANS"]] = re
+
+    def _slot(self, back):
+        if not 0 <= back < self.count:
+            raise IndexError("no such entry")
+        return (self.head - back) % self.capacity
+
+    def expression(self, back=0):
+        """Text of the entry back steps before the newest."""
+        slot = self._slot(back)
+        base = slot * self.text_len
+        return self.text[base:base + self.lengths[slot]].decode()
+
+    def result(self, back=0):
+        slot = self._slot(back)
+        return self.values[2 * slot], self.values[2 * slot + 1]
+
+    def older(self):
+        """Step the browse cursor back; returns its expression or None."""
+        if self.cursor + 1 >= self.count:
+            return None
+        self.cursor += 1
+        return self.expression(self.cursor)
+
+    def newer(self):
+        """Step the browse cursor forward; None once past the newest."""
+        if self.cursor <= 0:
+            self.cursor = -1
+            return None
+        self.cursor -= 1
+        return self.expression(self.cursor)
+
+    def browsing(self):
+        return self.cursor >= 0
+
+    def stop(self):
+        self.cursor = -1
+
+    def clear(self):
+        self.head = -1
+        self.count = 0
+        self.cursor = -1
@@ -0,0 +1,135 @@
+"""Stand-ins for machine and utime, so the calculator runs on a PC.
+
+install() puts fake machine and utime modules in sys.modules; import it
+before anything that imports the hardware modules:
+
+    import hostfake
+    hostfake.install()
+    import calculate
+
+The fakes keep a virtual clock on top of the real one. utime.sleep_ms and
+friends advance it instead of sleeping, and so does every I2C or SPI
+transfer, by the time it would take on the bus. So ticks_us differences
+include the waits the real drivers would have, and a replay of a session
+runs as fast as the host allows. The I2C and SPI fakes count the bytes
+written, which is what the display drivers send. machine.mem32 is a
+gpio_stub.Registers.
+"""
+
+import sys
+import time
+from types import ModuleType
+from gpio_stub import Registers
+
+# Extra microseconds from fake sleeps and bus transfers
+_offset_us = 0
+
+
+def advance_us(us):
+    global _offset_us
+    _offset_us += int(us)
+
+
+def ticks_us():
+    return time.perf_counter_ns() // 1000 + _offset_us
+
+
+def ticks_ms():
+    return ticks_us() // 1000
+
+
+def ticks_diff(a, b):
+    return a - b
+
+
+def sleep(s):
+    advance_us(s * 1000000)
+
+
+def sleep_ms(ms):
+    advance_us(ms * 1000)
+
+
+def sleep_us(us):
+    advance_us(us)
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 2
+    IRQ_RISING = 1
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.level = 1 if value is None else value
+        self.handler = None
+
+    def value(self, v=None):
+        if v is None:
+            return self.level
+        self.level = 1 if v else 0
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+    def on(self):
+        self.level = 1
+
+    def off(self):
+        self.level = 0
+
+    def irq(self, trigger=0, handler=None):
+        self.handler = handler
+
+
+class I2C:
+    def __init__(self, id=0, scl=None, sda=None, freq=400000):
+        self.freq = freq
+        self.bytes_written = 0
+
+    def writeto(self, addr, buf):
+        self.bytes_written += len(buf)
+        # Address byte plus data, 9 clocks each
+        advance_us((len(buf) + 1) * 9 * 1000000 / self.freq)
+        return len(buf)
+
+    def scan(self):
+        return [0x27]
+
+
+class SPI:
+    def __init__(self, id=1, baudrate=1000000, polarity=0, phase=0,
+                 sck=None, mosi=None, miso=None):
+        self.baudrate = baudrate
+        self.bytes_written = 0
+
+    def write(self, buf):
+        self.bytes_written += len(buf)
+        advance_us(len(buf) * 8 * 1000000 / self.baudrate)
+
+
+def idle():
+    pass
+
+
+def _module(name, **attrs):
+    module = ModuleType(name)
+    for key in attrs:
+        setattr(module, key, attrs[key])
+    return module
+
+
+def install():
+    """Register the fake machine and utime modules; returns machine."""
+    machine = _module("machine", Pin=Pin, I2C=I2C, SPI=SPI, idle=idle,
+                      mem32=Registers())
+    utime = _module("utime", ticks_us=ticks_us, ticks_ms=ticks_ms,
+                    ticks_diff=ticks_diff, sleep=sleep, sleep_ms=sleep_ms,
+                    sleep_us=sleep_us)
+    sys.modules["machine"] = machine
+    sys.modules["utime"] = utime
+    return machine
@@ -1,5 +1,6 @@
 from machine import Pin, I2C, SPI  # type: ignore
 import utime as time  # type: ignore
+from keypad import Keypad
 
 
 # # Constants for the number of rows and columns
@@ -126,52 +127,23 @@ init_display()
 
 # Clear the display
 clear_display()
-for pin in colPins:
-    Pin(pin, Pin.IN, Pin.PULL_UP)
-
-# Set column pins as OUTPUT and HIGH
-for pin in rowPins:
-    p = Pin(pin, Pin.OUT)
-    p.value(1)
+# Rows are driven, columns read with pull-ups
+keypad = Keypad(rowPins, colPins)
+keypad.start()
 def loop():
-    
-    global numRows, rowPins, numCols, colPins, graph_letters
+    global graph_letters
     while True:
-        # Loop through each column
-        # for col in range(numCols):
-        for row in range(numRows):
-            # Activate the current column
-            # Pin(colPins[col], Pin.OUT).value(0)
-            Pin(rowPins[row], Pin.OUT).value(0)
-            
-            
-            # Check each row in the current column
-            # for row in range(numRows):
-            for col in range(numCols):
-                # buttonState = Pin(rowPins[row], Pin.IN, Pin.PULL_UP).value()
-                buttonState = Pin(colPins[col], Pin.IN, Pin.PULL_UP).value()
-                
-                # If button is pressed (LOW), print the row and column
-                if buttonState == 0:
-                    # default_key(row, col)
-                    print("row= ",row, " ", "col= ",col)
-                    str_pnt="R"+str(row)+"C"+str(col)
-                    set_page_address(0)
-                    set_column_address(0)
-                    for i in str_pnt:
-                        write_data(0b00000000)
-                        for j in graph_letters[i]:
-                            
-                            write_data(j)
-                            
-                    
-                    time.sleep(0.2)  # Debounce delay
-                    # write_data(0b00000000)
-            
-            # Deactivate the current column
-            
-            Pin(rowPins[row], Pin.OUT).value(1)
-
+        keypad.wait()
+        while keypad.any():
+            row, col, kind, t = keypad.get()
+            print("row= ",row, " ", "col= ",col)
+            str_pnt="R"+str(row)+"C"+str(col)
+            set_page_address(0)
+            set_column_address(0)
+            for i in str_pnt:
+                write_data(0b00000000)
+                for j in graph_letters[i]:
+                    write_data(j)
 
 
 loop()
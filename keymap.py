@@ -0,0 +1,121 @@
+"""Key layout of the 8x5 keypad, shared by the calculator, the menu and
+the ST7565 front end.
+
+Each shift layer is a flat tuple of 40 entries indexed by row * COLS + col,
+so a key press is one tuple lookup. An entry is either a string to insert
+into the expression or an action ID (an int); None in the alpha or beta
+layer means the key does what it does in the base layer, which keeps
+navigation the same in every layer.
+
+The alpha and beta keys shift the next key press only; pressing the same
+shift key again goes back to the base layer.
+"""
+
+ROWS = 8
+COLS = 5
+
+# Action IDs
+NONE = 0
+ALPHA = 1
+BETA = 2
+UP = 3
+DOWN = 4
+LEFT = 5
+RIGHT = 6
+HOME = 7
+POWER = 8
+BACKLIGHT = 9
+OK = 10
+FX = 11
+BACKSPACE = 12
+CLEAR = 13
+ANSWER = 14
+SOLVE = 15
+STAT = 16
+STAT_CLEAR = 17
+N_ACTIONS = 18
+
+# Actions that repeat while their key is held
+REPEATING = (UP, DOWN, LEFT, RIGHT, BACKSPACE)
+
+LAYER_BASE = 0
+LAYER_ALPHA = 1
+LAYER_BETA = 2
+
+BASE_KEYS = (
+    ALPHA, BETA, UP, HOME, POWER,
+    BACKLIGHT, LEFT, OK, RIGHT, "x",
+    "dif( , ", FX, DOWN, "(", ")",
+    "pow( , ", "sin(", "cos(", "tan(", "log(",
+    "7", "8", "9", BACKSPACE, CLEAR,
+    "4", "5", "6", "*", "/",
+    "1", "2", "3", "+", "-",
+    ".", "0", "pow(10, ", ANSWER, SOLVE,
+)
+
+# Variables: y, z, u, v on the second row and A to Z from the fourth
+ALPHA_KEYS = (
+    None, None, None, None, None,
+    None, None, None, None, "Z",
+    "y", "z", None, "u", "v",
+    "A", "B", "C", "D", "E",
+    "F", "G", "H", "I", "J",
+    "K", "L", "M", "N", "O",
+    "P", "Q", "R", "S", "T",
+    "U", "V", "W", "X", "Y",
+)
+
+BETA_KEYS = (
+    None, None, None, None, None,
+    None, None, None, None, "=",
+    "integ( , , ", "solve( , , ", None, ",", "conv( , , ",
+    "sqrt(", "asin(", "acos(", "atan(", "exp(",
+    "abs(", "pi", "e", None, None,
+    "i", "det(", "inv(", "trn(", "mat(",
+    "MA", "MB", "MC", "MD", None,
+    None, "ANS", STAT, STAT_CLEAR, None,
+)
+
+LAYERS = (BASE_KEYS, ALPHA_KEYS, BETA_KEYS)
+
+
+def lookup(layer, row, col):
+    """Entry of the key in layer: an insert string or an action ID."""
+    i = row * COLS + col
+    entry = LAYERS[layer][i]
+    if entry is None:
+        return BASE_KEYS[i]
+    return entry
+
+
+def repeat_keys():
+    """(row, col) of the base-layer keys whose action repeats."""
+    return [(i // COLS, i % COLS) for i in range(ROWS * COLS)
+            if BASE_KEYS[i] in REPEATING]
+
+
+def action_table(handlers):
+    """Tuple indexed by action ID from a dict of ID -> handler; actions
+    not in handlers map to None."""
+    table = [None] * N_ACTIONS
+    for action in handlers:
+        table[action] = handlers[action]
+    return tuple(table)
+
+
+class Keymap:
+    """Current shift layer of one front end."""
+
+    def __init__(self):
+        self.layer = LAYER_BASE
+
+    def key(self, row, col):
+        """Entry for a key press. The shift keys switch the layer for the
+        next press and give NONE."""
+        entry = lookup(self.layer, row, col)
+        if entry == ALPHA or entry == BETA:
+            target = LAYER_ALPHA if entry == ALPHA else LAYER_BETA
+            self.layer = LAYER_BASE if self.layer == target else target
+            return NONE
+        self.layer = LAYER_BASE
+        return entry
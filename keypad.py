@@ -0,0 +1,221 @@
+"""Interrupt-driven scanner for the 8x5 key matrix.
+
+While no key is down every drive line is held low, so a press pulls its
+sense line low and the falling edge raises a pin interrupt. The handler
+only sets a flag; the next poll() then scans the matrix once per call
+until every key is released again, and then goes back to waiting for
+the interrupt. Key events are pushed as (row, col, kind, ticks_ms) onto
+a ring queue allocated once, which the application drains with get().
+The Pin objects are made once in start() instead of on every probe, and
+wait() idles the CPU between interrupts rather than polling. Scans do not
+go through the Pin objects at all: gpio.MatrixPort selects rows and
+samples all the columns with single register accesses.
+
+Each key runs its own state machine on ticks_ms, so nothing sleeps:
+
+    IDLE -> BOUNCING      contact seen
+    BOUNCING -> PRESSED   still closed after debounce_ms: PRESS
+    PRESSED -> HELD       still closed after long_ms: LONG
+    HELD -> REPEATING     after repeat_ms, for keys with repeat on: REPEAT
+    REPEATING             another REPEAT every repeat_ms
+
+and back to IDLE as soon as the contact opens (a bounce on release cannot
+make a new press, since that needs debounce_ms of contact again).
+"""
+
+from machine import Pin, idle  # type: ignore
+import utime as time  # type: ignore
+from array import array
+from gpio import MatrixPort
+
+QUEUE_SIZE = 16
+
+# Least time between scans while a key is down
+SCAN_MS = 5
+
+DEBOUNCE_MS = 20
+LONG_MS = 600
+REPEAT_MS = 100
+
+# Key states
+IDLE = 0
+BOUNCING = 1
+PRESSED = 2
+HELD = 3
+REPEATING = 4
+
+# Event kinds
+PRESS = 0
+LONG = 1
+REPEAT = 2
+
+
+class Keypad:
+    def __init__(self, drive_pins, sense_pins, rows_driven=True,
+                 size=QUEUE_SIZE, debounce_ms=DEBOUNCE_MS, long_ms=LONG_MS,
+                 repeat_ms=REPEAT_MS, mem=None):
+        # rows_driven: rows are the outputs and columns the pulled-up
+        # inputs, as in calculate.py; menu.py is wired the other way round
+        self.drive_pins = drive_pins
+        self.sense_pins = sense_pins
+        self.rows_driven = rows_driven
+        self.drive = []
+        self.sense = []
+        # mem: register interface for MatrixPort, machine.mem32 by default
+        self.port = MatrixPort(drive_pins, sense_pins, mem)
+        self.debounce_ms = debounce_ms
+        self.long_ms = long_ms
+        self.repeat_ms = repeat_ms
+        # Per key, at drive index * len(sense) + sense index: state, when
+        # it was entered, and whether holding the key repeats it
+        n = len(drive_pins) * len(sense_pins)
+        self.state = bytearray(n)
+        self.since = array("L", [0] * n)
+        self.repeats = bytearray(n)
+        self.active = False
+        self.last_scan = 0
+        # Set by the interrupt handler
+        self.woken = False
+        # Event ring
+        self.size = size
+        self.rows = bytearray(size)
+        self.cols = bytearray(size)
+        self.kinds = bytearray(size)
+        self.times = array("L", [0] * size)
+        self.head = 0
+        self.count = 0
+        self.dropped = 0
+        # Bound once: making a bound method in the handler would allocate
+        self._wake_ref = self._wake
+
+    def start(self):
+        """Configure the pins and arm the interrupts."""
+        self.drive = [Pin(p, Pin.OUT, value=0) for p in self.drive_pins]
+        self.sense = [Pin(p, Pin.IN, Pin.PULL_UP) for p in self.sense_pins]
+        for i in range(len(self.state)):
+            self.state[i] = IDLE
+        self.clear()
+        self.active = False
+        self.woken = False
+        for pin in self.sense:
+            pin.irq(trigger=Pin.IRQ_FALLING, handler=self._wake_ref)
+        # A key already down when started would give no edge
+        self.woken = True
+
+    def stop(self):
+        for pin in self.sense:
+            pin.irq(handler=None)
+        self.port.drive_all(1)
+
+    def _wake(self, pin):
+        self.woken = True
+
+    def _index(self, row, col):
+        if self.rows_driven:
+            return row * len(self.sense_pins) + col
+        return col * len(self.sense_pins) + row
+
+    def set_repeat(self, row, col, on=True):
+        """Let holding the key send REPEAT events, as for the arrows."""
+        self.repeats[self._index(row, col)] = 1 if on else 0
+
+    def _push(self, d, s, kind, now):
+        if self.count == self.size:
+            self.dropped += 1
+            return
+        slot = (self.head + self.count) % self.size
+        if self.rows_driven:
+            self.rows[slot] = d
+            self.cols[slot] = s
+        else:
+            self.rows[slot] = s
+            self.cols[slot] = d
+        self.kinds[slot] = kind
+        self.times[slot] = now
+        self.count += 1
+
+    def _step(self, d, s, closed, now):
+        # Advance one key's state machine; returns True unless it is idle
+        k = d * len(self.sense_pins) + s
+        state = self.state[k]
+        if not closed:
+            self.state[k] = IDLE
+            return False
+        if state == IDLE:
+            self.state[k] = BOUNCING
+            self.since[k] = now
+            return True
+        elapsed = time.ticks_diff(now, self.since[k])
+        if state == BOUNCING:
+            if elapsed >= self.debounce_ms:
+                self._enter(k, PRESSED, now)
+                self._push(d, s, PRESS, now)
+        elif state == PRESSED:
+            if elapsed >= self.long_ms:
+                self._enter(k, HELD, now)
+                self._push(d, s, LONG, now)
+        elif self.repeats[k] and elapsed >= self.repeat_ms:
+            # HELD or REPEATING
+            self._enter(k, REPEATING, now)
+            self._push(d, s, REPEAT, now)
+        return True
+
+    def _enter(self, k, state, now):
+        self.state[k] = state
+        self.since[k] = now
+
+    def scan(self, now):
+        """Read the whole matrix once and step every key; returns True
+        while any key is not idle."""
+        port = self.port
+        port.scan()
+        busy = False
+        for d in range(len(self.drive_pins)):
+            for s in range(len(self.sense_pins)):
+                if self._step(d, s, port.closed(d, s), now):
+                    busy = True
+        return busy
+
+    def poll(self):
+        """Scan if woken, or if a key is down and the last scan is SCAN_MS
+        old; returns the number of queued events. Never blocks."""
+        now = time.ticks_ms()
+        if self.woken or (self.active and
+                          time.ticks_diff(now, self.last_scan) >= SCAN_MS):
+            self.last_scan = now
+            self.active = self.scan(now)
+            # Pulling the rows low in turn makes edges of its own on the
+            # columns of held keys; cleared only now, or a held key would
+            # keep waking wait() into back-to-back scans. Scans end with
+            # the rows high, so a press after its row was read still
+            # makes an edge when they go low below
+            self.woken = False
+            if not self.active:
+                # Everything released: hold the lines low for the next edge
+                self.port.drive_all(0)
+        return self.count
+
+    def wait(self):
+        """Block until at least one event is queued, idling between
+        interrupts (the tick interrupt paces the scans of a held key)."""
+        while self.poll() == 0:
+            if not self.woken:
+                idle()
+
+    def any(self):
+        return self.count > 0
+
+    def get(self):
+        """Oldest event as (row, col, kind, ticks_ms), or None if the queue
+        is empty."""
+        if self.count == 0:
+            return None
+        slot = self.head
+        self.head = (slot + 1) % self.size
+        self.count -= 1
+        return (self.rows[slot], self.cols[slot], self.kinds[slot],
+                self.times[slot])
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
@@ -161,6 +161,21 @@ class LcdApi:
         for char in string:
             self.putchar(char)
 
+    def putbytes(self, data):
+        """Write ASCII codes from a bytes-like object at the cursor, as
+        putstr does for a string, without decoding it first.
+        """
+        for code in data:
+            self.hal_write_data(code)
+            self.cursor_x += 1
+            if self.cursor_x >= self.num_columns:
+                self.cursor_x = 0
+                self.cursor_y += 1
+                self.implied_newline = True
+                if self.cursor_y >= self.num_lines:
+                    self.cursor_y = 0
+                self.move_to(self.cursor_x, self.cursor_y)
+
     def custom_char(self, location, charmap):
         """Write a character to one of the 8 CGRAM locations, available
         as chr(0) through chr(7).
@@ -0,0 +1,203 @@
+"""Incremental parse state for the calculator editor.
+
+The editor text is kept as a token list with a small parse state recorded
+after every token (paren depth and whether an operand or an operator comes
+next). An edit at position p only drops the tokens from the one touching p
+onwards and re-lexes that suffix, restarting from the saved state, so a
+keypress costs a few tokens of work however long the expression is.
+
+The resulting status is a plain code rather than an exception, which lets
+the editor preview a partial result on every key and lets sol_steps()
+refuse a broken expression without trying to compile it. Only the token
+structure is tracked here; argument counts are still checked by the
+compiler.
+"""
+
+from expr import next_token, is_function, is_operand, evaluate, assignment, VARS, \
+    T_END, T_NUM, T_NAME, USER_FUNCS, user_functions, SUB_OPS, OP_CALL, OPERANDS, \
+    variables, X_SLOT, MATRICES
+
+# Parse status
+OK = 0           # complete expression
+INCOMPLETE = 1   # valid so far, needs more input (open paren, trailing op)
+ERROR = 2        # cannot become valid by appending text
+
+# What the next token must be
+WANT_OPERAND = 0
+WANT_OPERATOR = 1
+WANT_PAREN = 2   # after a function name
+
+# Calls running a whole numeric method, too slow to redo on every key
+SLOW_CALLS = ("dif", "solve", "integ")
+
+
+def _slow_function(fn):
+    # True if the user function's body, or one it calls, has dif, solve
+    # or integ in it
+    if fn.subs:
+        return True
+    code = fn.code
+    pc = 0
+    while pc < len(code):
+        op = code[pc]
+        if op in SUB_OPS:
+            return True
+        if op == OP_CALL and code[pc + 1] < len(user_functions) and \
+                _slow_function(user_functions[code[pc + 1]]):
+            return True
+        pc += 1 + OPERANDS.get(op, 0)
+    return False
+
+
+class LiveExpr:
+    def __init__(self):
+        self.text = ""
+        self.tokens = []
+        # State after each token: depth * 4 + want
+        self.states = []
+        self.status = INCOMPLETE
+        self.error_pos = -1
+        self.depth = 0
+        self._value = None
+        self._x = 0.0
+        self._valid = False
+
+    def update(self, text, pos):
+        """Re-parse text, which is unchanged before position pos."""
+        self.text = text
+        tokens = self.tokens
+        states = self.states
+        # Drop every token touching or following the edit
+        keep = len(tokens)
+        while keep > 0 and tokens[keep - 1][3] >= pos:
+            keep -= 1
+        # "1e+5" lexes as 1, e, + until the last digit arrives, so back up
+        # two more tokens to let the lexer merge them
+        keep = max(0, keep - 2)
+        del tokens[keep:]
+        del states[keep:]
+        self._valid = False
+        self.error_pos = -1
+        if keep:
+            state = states[-1]
+            i = tokens[-1][3]
+        else:
+            state = WANT_OPERAND
+            i = 0
+        depth = state >> 2
+        want = state & 3
+        while True:
+            try:
+                tok = next_token(text, i)
+            except SyntaxError:
+                return self._fail(i, depth)
+            kind, value, start, end = tok
+            if kind == T_END:
+                break
+            if want == WANT_PAREN:
+                if value != "(":
+                    return self._fail(start, depth)
+                depth += 1
+                want = WANT_OPERAND
+            elif want == WANT_OPERAND:
+                if kind == T_NUM:
+                    want = WANT_OPERATOR
+                elif kind == T_NAME:
+                    # A user function g shares its name with the gram
+                    # unit; the token after it decides which it is
+                    if is_function(value) and not is_operand(value):
+                        want = WANT_PAREN
+                    elif is_operand(value):
+                        want = WANT_OPERATOR
+                    else:
+                        return self._fail(start, depth)
+                elif value == "(":
+                    depth += 1
+                elif value != "-" and value != "+":
+                    return self._fail(start, depth)
+            else:
+                if value == ")":
+                    if depth == 0:
+                        return self._fail(start, depth)
+                    depth -= 1
+                elif value == ",":
+                    if depth == 0:
+                        return self._fail(start, depth)
+                    want = WANT_OPERAND
+                elif value == "(" and tokens[-1][0] == T_NAME and \
+                        is_function(tokens[-1][1]):
+                    depth += 1
+                    want = WANT_OPERAND
+                elif kind == T_NUM or kind == T_NAME or value == "(":
+                    return self._fail(start, depth)
+                elif value == "=":
+                    # Only as "NAME = expr", assigning a variable or a
+                    # matrix register
+                    if len(tokens) != 1 or (tokens[0][1] not in VARS and
+                                            tokens[0][1] not in MATRICES):
+                        return self._fail(start, depth)
+                    want = WANT_OPERAND
+                else:
+                    want = WANT_OPERAND
+            tokens.append(tok)
+            states.append(depth * 4 + want)
+            i = end
+        self.depth = depth
+        if want == WANT_OPERATOR and depth == 0:
+            self.status = OK
+        else:
+            self.status = INCOMPLETE
+        return self.status
+
+    def _fail(self, pos, depth):
+        self.status = ERROR
+        self.error_pos = pos
+        self.depth = depth
+        return ERROR
+
+    def slow(self):
+        """True if evaluating the text runs a solver, integral or
+        derivative, directly or through a user function."""
+        for tok in self.tokens:
+            if tok[0] != T_NAME:
+                continue
+            name = tok[1]
+            if name in SLOW_CALLS:
+                return True
+            if name in USER_FUNCS and \
+                    _slow_function(user_functions[USER_FUNCS[name]]):
+                return True
+        return False
+
+    def closable(self):
+        # Only missing close parens stand between the text and a result
+        return bool(self.states) and self.states[-1] & 3 == WANT_OPERATOR
+
+    def preview(self):
+        """Return the value of the text so far, closing open parens, or None.
+
+        Texts calling solve, integ or dif get no preview: each key would
+        rerun the whole method, and = evaluates them anyway.
+        """
+        # At the x = evaluates with; an assignment to x since the last
+        # preview makes it stale
+        x = variables[X_SLOT]
+        if self._valid and self._x == x:
+            return self._value
+        value = None
+        if self.status != ERROR and self.closable() and not self.slow():
+            try:
+                src = self.text
+                target = assignment(src)
+                if target is not None:
+                    src = src[target[1]:]
+                # Each key makes a new partial text; caching them would
+                # push out the programs worth keeping
+                value = evaluate(src + ")" * self.depth, x, cache=False)
+            except (SyntaxError, ValueError, TypeError, ZeroDivisionError,
+                    OverflowError):
+                value = None
+        self._value = value
+        self._x = x
+        self._valid = True
+        return value
@@ -1,4 +1,4 @@
-from calculate import cal_fun
+from calculate import cal_async
 
 # Call the main calculation function
-cal_fun()
+cal_async()
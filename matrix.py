@@ -0,0 +1,423 @@
+"""Matrices backed by one flat array('f').
+
+A Matrix holds a row-major array with room for its capacity and the
+current row and column counts, so a result buffer can be reshaped and
+reused instead of reallocated. Every operation writes into an output
+matrix (which may be an operand, where that is safe) and returns it, so
+chained operations allocate nothing. LU comes from systems.lu_decompose.
+
+Matrix expressions use the registers MA .. MD, + - *, numbers, scalar
+variables, det(), inv(), trn() and mat(rows, cols, a11, a12, ...), which
+lists the entries row by row. evaluate() runs them with a fixed pool of
+temporaries, so e.g. "inv(MA)*MB+2*MC" makes no heap allocations for the
+matrices once the pool exists. "MA = expr" fills a register (see
+assignment()).
+"""
+
+from array import array
+from expr import (next_token, CONSTS, MATRICES, MATRIX_FUNCS, VARS,
+                  variables, T_END, T_NUM, T_NAME, T_OP)
+from systems import lu_decompose, lu_solve
+
+MAX_SIZE = 8
+
+# Scratch for det and inv, allocated once
+_work = array("f", [0.0] * (MAX_SIZE * MAX_SIZE))
+_col = array("f", [0.0] * MAX_SIZE)
+_piv = array("B", [0] * MAX_SIZE)
+
+
+class Matrix:
+    def __init__(self, rows, cols, values=None, capacity=None):
+        if capacity is None:
+            capacity = rows * cols
+        self.data = array("f", [0.0] * capacity)
+        self.rows = 0
+        self.cols = 0
+        self.reshape(rows, cols)
+        if values is not None:
+            for i in range(rows * cols):
+                self.data[i] = values[i]
+
+    def reshape(self, rows, cols):
+        if rows * cols > len(self.data):
+            raise ValueError("matrix too big")
+        self.rows = rows
+        self.cols = cols
+        return self
+
+    def get(self, i, j):
+        return self.data[i * self.cols + j]
+
+    def set(self, i, j, v):
+        self.data[i * self.cols + j] = v
+
+    def copy_from(self, other):
+        self.reshape(other.rows, other.cols)
+        src = other.data
+        dst = self.data
+        for i in range(other.rows * other.cols):
+            dst[i] = src[i]
+        return self
+
+    def identity(self, n):
+        self.reshape(n, n)
+        d = self.data
+        for i in range(n * n):
+            d[i] = 0.0
+        for i in range(n):
+            d[i * n + i] = 1.0
+        return self
+
+    def __repr__(self):
+        return "Matrix(%d, %d, %r)" % (self.rows, self.cols,
+                                       list(self.data[:self.rows * self.cols]))
+
+
+def _same_shape(a, b):
+    if a.rows != b.rows or a.cols != b.cols:
+        raise ValueError("shape mismatch")
+
+
+def add(a, b, out):
+    """out = a + b; out may be a or b."""
+    _same_shape(a, b)
+    out.reshape(a.rows, a.cols)
+    x = a.data
+    y = b.data
+    z = out.data
+    for i in range(a.rows * a.cols):
+        z[i] = x[i] + y[i]
+    return out
+
+
+def sub(a, b, out):
+    _same_shape(a, b)
+    out.reshape(a.rows, a.cols)
+    x = a.data
+    y = b.data
+    z = out.data
+    for i in range(a.rows * a.cols):
+        z[i] = x[i] - y[i]
+    return out
+
+
+def scale(a, k, out):
+    """out = k * a; out may be a."""
+    out.reshape(a.rows, a.cols)
+    x = a.data
+    z = out.data
+    for i in range(a.rows * a.cols):
+        z[i] = k * x[i]
+    return out
+
+
+def mul(a, b, out):
+    """out = a b; out must not be a or b."""
+    if a.cols != b.rows:
+        raise ValueError("shape mismatch")
+    if out is a or out is b:
+        raise ValueError("output aliases an operand")
+    n = a.rows
+    m = b.cols
+    p = a.cols
+    out.reshape(n, m)
+    x = a.data
+    y = b.data
+    z = out.data
+    for i in range(n):
+        row = i * p
+        for j in range(m):
+            s = 0.0
+            for k in range(p):
+                s += x[row + k] * y[k * m + j]
+            z[i * m + j] = s
+    return out
+
+
+def transpose(a, out):
+    """out = a transposed; out may be a when a is square."""
+    n = a.rows
+    m = a.cols
+    x = a.data
+    if out is a:
+        if n != m:
+            raise ValueError("in-place transpose needs a square matrix")
+        for i in range(n):
+            for j in range(i + 1, n):
+                t = x[i * n + j]
+                x[i * n + j] = x[j * n + i]
+                x[j * n + i] = t
+        return a
+    out.reshape(m, n)
+    z = out.data
+    for i in range(n):
+        for j in range(m):
+            z[j * n + i] = x[i * m + j]
+    return out
+
+
+def lu(a, piv):
+    """Factorise the square a in place; returns the permutation sign."""
+    n = a.rows
+    if n != a.cols:
+        raise ValueError("matrix not square")
+    lu_decompose(a.data, n, piv)
+    sign = 1
+    for k in range(n):
+        if piv[k] != k:
+            sign = -sign
+    return sign
+
+
+def _factor_copy(a):
+    if a.rows != a.cols:
+        raise ValueError("matrix not square")
+    n = a.rows
+    if n > MAX_SIZE:
+        raise ValueError("matrix too big")
+    w = _work
+    x = a.data
+    for i in range(n * n):
+        w[i] = x[i]
+    lu_decompose(w, n, _piv)
+    return n
+
+
+def det(a):
+    try:
+        n = _factor_copy(a)
+    except ValueError as e:
+        if str(e) == "singular matrix":
+            return 0.0
+        raise
+    d = 1.0
+    for k in range(n):
+        d *= _work[k * n + k]
+        if _piv[k] != k:
+            d = -d
+    return d
+
+
+def inverse(a, out):
+    """out = a^-1; out may be a. Raises ValueError if a is singular."""
+    n = _factor_copy(a)
+    out.reshape(n, n)
+    z = out.data
+    col = _col
+    for j in range(n):
+        for i in range(n):
+            col[i] = 0.0
+        col[j] = 1.0
+        lu_solve(_work, n, _piv, col)
+        for i in range(n):
+            z[i * n + j] = col[i]
+    return out
+
+
+# Matrix registers used by expressions
+registers = {}
+for _name in MATRICES:
+    registers[_name] = Matrix(0, 0, capacity=MAX_SIZE * MAX_SIZE)
+
+POOL_SIZE = 6
+_pool = [Matrix(0, 0, capacity=MAX_SIZE * MAX_SIZE) for _ in range(POOL_SIZE)]
+
+
+def set_matrix(name, rows, cols, values):
+    m = registers[name]
+    m.reshape(rows, cols)
+    for i in range(rows * cols):
+        m.data[i] = values[i]
+    return m
+
+
+def uses_matrices(src):
+    """True if src names a matrix register or builds a matrix."""
+    i = 0
+    while True:
+        kind, value, start, end = next_token(src, i)
+        if kind == T_END:
+            return False
+        if kind == T_NAME and (value in MATRICES or value == "mat"):
+            return True
+        i = end
+
+
+def assignment(src):
+    """For "MA = expr" return (register name, offset of expr), otherwise
+    None."""
+    kind, name, start, end = next_token(src, 0)
+    if kind != T_NAME or name not in MATRICES:
+        return None
+    kind, value, start, end = next_token(src, end)
+    if kind != T_OP or value != "=":
+        return None
+    return name, end
+
+
+def store(name, value):
+    """Copy a matrix result into register name; returns the register."""
+    if not isinstance(value, Matrix):
+        raise ValueError("%s needs a matrix" % name)
+    return registers[name].copy_from(value)
+
+
+class _Evaluator:
+    # Recursive descent straight to values: floats or pool matrices
+
+    def __init__(self, src):
+        self.src = src
+        self.used = 0
+        self.advance(0)
+
+    def advance(self, i):
+        self.kind, self.value, self.start, self.end = next_token(self.src, i)
+
+    def accept(self, op):
+        if self.kind == T_OP and self.value == op:
+            self.advance(self.end)
+            return True
+        return False
+
+    def expect(self, op):
+        if not self.accept(op):
+            raise SyntaxError("expected %r at %d" % (op, self.start))
+
+    def temp(self):
+        if self.used >= POOL_SIZE:
+            raise ValueError("matrix expression too long")
+        m = _pool[self.used]
+        self.used += 1
+        return m
+
+    def result(self, a):
+        # A temporary to write into: a itself if it is one, else a fresh one
+        for i in range(self.used):
+            if _pool[i] is a:
+                return a
+        return self.temp()
+
+    def parse(self):
+        value = self.expr()
+        if self.kind != T_END:
+            raise SyntaxError("unexpected %r at %d" % (self.value, self.start))
+        return value
+
+    def expr(self):
+        a = self.term()
+        while True:
+            if self.accept("+"):
+                a = self.combine(a, self.term(), 1)
+            elif self.accept("-"):
+                a = self.combine(a, self.term(), -1)
+            else:
+                return a
+
+    def combine(self, a, b, sign):
+        a_mat = isinstance(a, Matrix)
+        if a_mat != isinstance(b, Matrix):
+            raise ValueError("matrix plus scalar")
+        if not a_mat:
+            return a + sign * b
+        out = self.result(a)
+        return add(a, b, out) if sign > 0 else sub(a, b, out)
+
+    def term(self):
+        a = self.unary()
+        while True:
+            if self.accept("*"):
+                b = self.unary()
+                if isinstance(a, Matrix) and isinstance(b, Matrix):
+                    a = mul(a, b, self.temp())
+                elif isinstance(a, Matrix):
+                    a = scale(a, b, self.result(a))
+                elif isinstance(b, Matrix):
+                    a = scale(b, a, self.result(b))
+                else:
+                    a = a * b
+            elif self.accept("/"):
+                b = self.unary()
+                if isinstance(b, Matrix):
+                    raise ValueError("division by a matrix")
+                if isinstance(a, Matrix):
+                    a = scale(a, 1 / b, self.result(a))
+                else:
+                    a = a / b
+            else:
+                return a
+
+    def unary(self):
+        if self.accept("-"):
+            a = self.unary()
+            if isinstance(a, Matrix):
+                return scale(a, -1.0, self.result(a))
+            return -a
+        if self.accept("+"):
+            return self.unary()
+        return self.atom()
+
+    def atom(self):
+        kind = self.kind
+        value = self.value
+        if kind == T_NUM:
+            self.advance(self.end)
+            return value
+        if kind == T_NAME:
+            self.advance(self.end)
+            if value in MATRICES:
+                return registers[value]
+            if value in CONSTS:
+                return CONSTS[value]
+            if value in VARS:
+                return variables[VARS[value]]
+            if value == "mat":
+                return self.literal()
+            if value in MATRIX_FUNCS:
+                self.expect("(")
+                a = self.expr()
+                self.expect(")")
+                if not isinstance(a, Matrix):
+                    raise ValueError("%s needs a matrix" % value)
+                if value == "det":
+                    return det(a)
+                if value == "inv":
+                    return inverse(a, self.result(a))
+                if a.rows == a.cols:
+                    return transpose(a, self.result(a))
+                return transpose(a, self.temp())
+            raise SyntaxError("unknown name %r" % value)
+        if self.accept("("):
+            a = self.expr()
+            self.expect(")")
+            return a
+        raise SyntaxError("unexpected %r at %d" % (value, self.start))
+
+    def scalar(self):
+        a = self.expr()
+        if isinstance(a, Matrix):
+            raise ValueError("mat needs numbers")
+        return a
+
+    def literal(self):
+        # mat(rows, cols, entries row by row)
+        self.expect("(")
+        rows = int(self.scalar())
+        self.expect(",")
+        cols = int(self.scalar())
+        if not (0 < rows <= MAX_SIZE and 0 < cols <= MAX_SIZE):
+            raise ValueError("matrix size")
+        m = self.temp().reshape(rows, cols)
+        for i in range(rows * cols):
+            self.expect(",")
+            m.data[i] = self.scalar()
+        self.expect(")")
+        return m
+
+
+def evaluate(src):
+    """Evaluate a matrix expression; returns a float or a Matrix.
+
+    A Matrix result is a pool temporary, valid until the next call.
+    """
+    return _Evaluator(src).parse()
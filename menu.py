@@ -3,6 +3,11 @@ from lcd_api import LcdApi
 from i2c_lcd import I2cLcd
 import utime as time  # type: ignore
 from math import *
+import units
+import userfn
+import saved
+from keypad import Keypad, LONG
+import keymap
 
 # LCD address, width, and height
 I2C_ADDR = 0x27
@@ -22,34 +27,94 @@ rowPins = [13, 12, 14, 26, 25, 5, 17, 15]
 colPins = [23, 16, 4, 19, 18]
 # rowPins = [13, 4, 25, 26, 27, 34, 35, 32]
 # colPins = [32, 17, 16, 14, 33]
+# Here the columns are driven and the rows read with pull-ups
+keypad = Keypad(colPins, rowPins, rows_driven=False)
+# Holding an arrow scrolls through the entries
+for _key in keymap.repeat_keys():
+    keypad.set_repeat(*_key)
+
 # Backlight toggle
 on = -1
 
 # Exit flag for the loop
 continue_running = True
 
+# Text handed to the calculator when a menu entry opens it
+pending_text = ""
+
+def open_in_calc(template):
+    # Leaf action: leave the menu and start editing template
+    def action():
+        global pending_text, continue_running
+        pending_text = template
+        continue_running = False
+    return action
+
+# Settings > Complex: the calculator evaluates in complex mode when set
+complex_mode = False
+
+def toggle_complex():
+    global complex_mode
+    complex_mode = not complex_mode
+
+def complex_enabled():
+    return complex_mode
+
+def take_pending():
+    global pending_text
+    text = pending_text
+    pending_text = ""
+    return text
+
+def unit_menu():
+    # One entry per unit category, opening conv() between its first two units
+    entries = {}
+    for index in range(len(units.CATEGORIES)):
+        names = units.category_units(index)
+        entries[units.CATEGORIES[index][0]] = open_in_calc(
+            "conv( , %s, %s)" % (names[1], names[0]))
+    return entries
+
+def user_menu():
+    # One entry per user function, opening a call to it; None while empty
+    entries = {}
+    for name in userfn.names():
+        entries[userfn.signature(name)] = open_in_calc(userfn.template(name))
+    return entries or None
+
+def open_saved(index):
+    # Leaf action: recall a saved expression, already compiled, and edit it
+    def action():
+        global pending_text, continue_running
+        pending_text = saved.recall(index)
+        continue_running = False
+    return action
+
+def saved_menu():
+    # One entry per saved expression, labelled with its text; None while empty
+    entries = {}
+    for index in range(saved.count()):
+        entries[saved.text(index)] = open_saved(index)
+    return entries or None
+
 menu = {
     "Home": {
         "Calculate": None,
+        "Table": open_in_calc("table( , , "),
         "Equation Solver": {
-            "Multi-variable": None,
-            "Single-variable": None
-        },
-        "Unit Conversion": {
-            "Length": "Km to m",
-            "Area": None,
-            "Mass": None,
-            "Pressure": None,
-            "Energy": None,
-            "Power": None
+            "Multi-variable": open_in_calc("sys( , "),
+            "Single-variable": open_in_calc("roots( , , ")
         },
+        "Unit Conversion": unit_menu(),
         "Saved Data": {
             "Predefined": None,
-            "User Defined": None
+            "User Defined": user_menu(),
+            "Equations": saved_menu()
         },
         "Settings": {
             "User Account": None,
             "Angle": None,
+            "Complex": toggle_complex,
             "Sync": None,
             "Wifi": None,
             "Bluetooth": None
@@ -57,6 +122,14 @@ menu = {
     }
 }
 
+def refresh_user_menu():
+    # After a function is defined or the table is loaded
+    menu["Home"]["Saved Data"]["User Defined"] = user_menu()
+
+def refresh_saved_menu():
+    # After an expression is saved or the file is loaded
+    menu["Home"]["Saved Data"]["Equations"] = saved_menu()
+
 # Position
 menu_nav = ["Home"]
 menu_list = []
@@ -98,10 +171,17 @@ def navigate(dir):
             cursor_pos = max(0, menu_pos - I2C_NUM_ROWS + 1)
         update_display()
     elif dir == "r":
-        menu_nav.append(menu_list[menu_pos])
-        menu_pos = 0
-        cursor_pos = 0
-        update_display()
+        current_state = menu
+        for i in menu_nav:
+            current_state = current_state[i]
+        item = current_state[menu_list[menu_pos]]
+        if callable(item):
+            item()
+        elif isinstance(item, dict):
+            menu_nav.append(menu_list[menu_pos])
+            menu_pos = 0
+            cursor_pos = 0
+            update_display()
     elif dir == "l":
         if len(menu_nav) > 1:
             menu_nav.pop()
@@ -121,22 +201,21 @@ def home():
     update_display()
     return 0
 
+# Action IDs from the keymap to what they do in the menu; OK selects
+actions = keymap.action_table({
+    keymap.UP: lambda: navigate("u"),
+    keymap.DOWN: lambda: navigate("d"),
+    keymap.LEFT: lambda: navigate("l"),
+    keymap.RIGHT: lambda: navigate("r"),
+    keymap.OK: lambda: navigate("r"),
+    keymap.HOME: home,
+})
+
 def default_key(r, c):
-    if r == 0:
-        if c == 2:
-            navigate("u")
-        elif c == 3:
-            home()
-    elif r == 1:
-        if c == 1:
-            navigate("l")
-        elif c == 2:
-            navigate("r")
-        elif c == 3:
-            navigate("r")
-    elif r == 2:
-        if c == 2:
-            navigate("d")
+    # The menu only has actions, so there are no shift layers
+    entry = keymap.lookup(keymap.LAYER_BASE, r, c)
+    if not isinstance(entry, str) and actions[entry] is not None:
+        actions[entry]()
     return 0
 
 def setup():
@@ -147,36 +226,28 @@ def setup():
     lcd.show_cursor()
     lcd.clear()
     
-    # Set row pins as INPUT_PULLUP
-    for pin in rowPins:
-        Pin(pin, Pin.IN, Pin.PULL_UP)
-    
-    # Set column pins as OUTPUT and HIGH
-    for pin in colPins:
-        p = Pin(pin, Pin.OUT)
-        p.value(1)
+    keypad.start()
 
 def loop():
     global continue_running
     while continue_running:
-        # Loop through each column
-        for col in range(numCols):
-            # Activate the current column
-            Pin(colPins[col], Pin.OUT).value(0)
-            
-            # Check each row in the current column
-            for row in range(numRows):
-                buttonState = Pin(rowPins[row], Pin.IN, Pin.PULL_UP).value()
-                
-                # If button is pressed (LOW), print the row and column
-                if buttonState == 0:
-                    default_key(row, col)
-                    time.sleep(0.2)  # Debounce delay
-            
-            # Deactivate the current column
-            Pin(colPins[col], Pin.OUT).value(1)
-        if not continue_running:
-            break
+        keypad.wait()
+        while continue_running and keypad.any():
+            row, col, kind, t = keypad.get()
+            if kind != LONG:
+                default_key(row, col)
+    # Hand the pins back to whoever runs next
+    keypad.stop()
+
+def menu_open():
+    # For the runtime, which keeps the keypad and passes keys to default_key
+    global continue_running
+    continue_running = True
+    lcd.show_cursor()
+    home()
+
+def menu_active():
+    return continue_running
 
 def menu_fun():
     setup()
@@ -1,5 +1,7 @@
 from machine import Pin, I2C, SPI  # type: ignore
 import utime as time  # type: ignore
+from keypad import Keypad, LONG
+import keymap
 
 
 # # Constants for the number of rows and columns
@@ -176,148 +178,38 @@ init_display()
 
 # Clear the display
 clear_display()
-for pin in colPins:
-    Pin(pin, Pin.IN, Pin.PULL_UP)
+# Rows are driven, columns read with pull-ups
+keypad = Keypad(rowPins, colPins)
+keypad.start()
 
-# Set column pins as OUTPUT and HIGH
-for pin in rowPins:
-    p = Pin(pin, Pin.OUT)
-    p.value(1)
+
+keys = keymap.Keymap()
+
+# Action IDs this front end hands back, by the names it uses for them
+action_names = keymap.action_table({
+    keymap.UP: "nav_u",
+    keymap.DOWN: "nav_d",
+    keymap.LEFT: "nav_l",
+    keymap.RIGHT: "nav_r",
+    keymap.BACKSPACE: "nav_b",
+})
 
 
 def default_key(r, c):
-    if r == 0:
-        if c == 0:
-            return ""
-        elif c == 1:
-            return ""
-        elif c == 2:
-            return "nav_u"
-        elif c == 3:
-            return ""
-        elif c == 4:
-            return ""
-    elif r == 1:
-        if c == 0:
-            return ""
-        elif c == 1:
-            return "nav_l"
-        elif c == 2:
-            return ""
-        elif c == 3:
-            return "nav_r"
-        elif c == 4:
-            return ""
-    elif r == 2:
-        if c == 0:
-            return ""
-        elif c == 1:
-            return ""
-        elif c == 2:
-            return "nav_d"
-        elif c == 3:
-            return "("
-        elif c == 4:
-            return ")"
-    elif r == 3:
-        if c == 0:
-            return "pow( , "
-        elif c == 1:
-            return "sin("
-        elif c == 2:
-            return "cos("
-        elif c == 3:
-            return "tan("
-        elif c == 4:
-            return "log("
-    elif r == 4:
-        if c == 0:
-            return "7"
-        elif c == 1:
-            return "8"
-        elif c == 2:
-            return "9"
-        elif c == 3:
-            return "nav_b"
-        elif c == 4:
-            return ""
-    elif r == 5:
-        if c == 0:
-            return "4"
-        elif c == 1:
-            return "5"
-        elif c == 2:
-            return "6"
-        elif c == 3:
-            return "*"
-        elif c == 4:
-            return "/"
-    elif r == 6:
-        if c == 0:
-            return "1"
-        elif c == 1:
-            return "2"
-        elif c == 2:
-            return "3"
-        elif c == 3:
-            return "+"
-        elif c == 4:
-            return "-"
-    elif r == 7:
-        if c == 0:
-            return "."
-        elif c == 1:
-            return "0"
-        elif c == 2:
-            return "pow(10, "
-        elif c == 3:
-            return ""
-        elif c == 4:
-            return ""
-    return 0
+    # Text to insert, the name of a navigation action, or ""
+    entry = keys.key(r, c)
+    if isinstance(entry, str):
+        return entry
+    return action_names[entry] or ""
 
 
 def loop():
-    
-    global numRows, rowPins, numCols, colPins, graph_letters
+    # Wait for the next key and return what it stands for
     while True:
-        # Loop through each column
-        # for col in range(numCols):
-        for row in range(numRows):
-            # Activate the current column
-            # Pin(colPins[col], Pin.OUT).value(0)
-            Pin(rowPins[row], Pin.OUT).value(0)
-            
-            
-            # Check each row in the current column
-            # for row in range(numRows):
-            for col in range(numCols):
-                # buttonState = Pin(rowPins[row], Pin.IN, Pin.PULL_UP).value()
-                buttonState = Pin(colPins[col], Pin.IN, Pin.PULL_UP).value()
-                
-                # If button is pressed (LOW), print the row and column
-                if buttonState == 0:
-                    str=default_key(row, col)
-                    # print("row= ",row, " ", "col= ",col)
-                    # str_pnt="R"+str(row)+"C"+str(col)
-                    # set_page_address(r)
-                    # set_column_address(0)
-                    # for i in txt:
-                    #     write_data(0b00000000)
-                    #     for j in graph_letters[i]:
-                            
-                    #         write_data(j)
-                    # time.sleep(0.1) 
-                    # return str
-                    time.sleep(0.01)  # Debounce delay
-                    Pin(rowPins[row], Pin.OUT).value(1)
-                    return str
-                    # write_data(0b00000000)
-            
-            # Deactivate the current column
-            
-            Pin(rowPins[row], Pin.OUT).value(1)
-        # break
+        keypad.wait()
+        row, col, kind, t = keypad.get()
+        if kind != LONG:
+            return default_key(row, col)
 
 
 
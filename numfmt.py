@@ -0,0 +1,207 @@
+"""Fixed-width number formatting without allocation.
+
+Results are written as ASCII straight into a caller-supplied bytearray
+the width of the display line (16 on the HD44780, 20 on the ST7565 text
+grid). For each value the formatter works out how many significant
+digits fixed notation and scientific (or engineering) notation would show
+in that width, and uses whichever shows more, so 1e20 and 1e-9 come out
+as exponents instead of being cut off or rounded to 0.000000.
+
+Digits are produced with small-integer arithmetic into a preallocated
+digit buffer, so no strings are built on the way.
+"""
+
+from math import log10, floor
+
+# Values are computed in single precision, so more digits would be noise
+MAX_SIG = 7
+
+AUTO = 0   # fixed or scientific, whichever shows more digits
+ENG = 1    # fixed or engineering (exponent a multiple of 3)
+
+_digits = bytearray(MAX_SIG)
+
+INF = float("inf")
+
+_MINUS = 45
+_POINT = 46
+_ZERO = 48
+_SPACE = 32
+_E = 101
+
+
+def _put_text(buf, pos, text):
+    # Short constant words such as "nan"; the literal is not a new object
+    for j in range(len(text)):
+        buf[pos + j] = ord(text[j])
+    return pos + len(text)
+
+
+def _scale(v, n):
+    # v * 10**n in steps that stay inside the float32 range
+    while n > 30:
+        v *= 1e30
+        n -= 30
+    while n < -30:
+        v *= 1e-30
+        n += 30
+    return v * 10.0 ** n
+
+
+def _round_digits(v, p, e10):
+    """Round |v| to p significant digits into _digits.
+
+    Returns (exponent of the first digit, digits used after dropping
+    trailing zeros).
+    """
+    n = int(_scale(v, p - 1 - e10) + 0.5)
+    if n >= 10 ** p:
+        # Rounding carried into a new digit, as in 9.9999 -> 10.000
+        e10 += 1
+        n = int(_scale(v, p - 1 - e10) + 0.5)
+    for j in range(p - 1, -1, -1):
+        _digits[j] = n % 10
+        n //= 10
+    used = p
+    while used > 1 and _digits[used - 1] == 0:
+        used -= 1
+    return e10, used
+
+
+def _exp_len(e):
+    n = 1 if e < 0 else 0
+    e = -e if e < 0 else e
+    n += 1
+    while e >= 10:
+        e //= 10
+        n += 1
+    return n
+
+
+def _put_int(buf, pos, e):
+    if e < 0:
+        buf[pos] = _MINUS
+        pos += 1
+        e = -e
+    # Count digits, then fill them in from the right
+    end = pos + _exp_len(e)
+    j = end - 1
+    while True:
+        buf[j] = _ZERO + e % 10
+        e //= 10
+        j -= 1
+        if e == 0:
+            break
+    return end
+
+
+def format_number(value, buf, start=0, width=None, mode=AUTO):
+    """Write value left-aligned into buf[start:start+width].
+
+    Returns the number of bytes written; the rest of the field is left
+    alone. Raises ValueError if even an exponent form does not fit.
+    """
+    if width is None:
+        width = len(buf) - start
+    pos = start
+    if value != value:
+        return _put_text(buf, pos, "nan") - start
+    if value < 0:
+        buf[pos] = _MINUS
+        pos += 1
+        value = -value
+    room = width - (pos - start)
+    if value == INF:
+        return _put_text(buf, pos, "inf") - start
+    if value == 0:
+        buf[pos] = _ZERO
+        return pos + 1 - start
+    e10 = int(floor(log10(value)))
+    # log10 can be one off near powers of ten
+    if _scale(value, -e10) >= 10:
+        e10 += 1
+    elif _scale(value, -e10) < 1:
+        e10 -= 1
+    # Significant digits each notation has room for
+    if e10 >= 0:
+        fixed = e10 + 1 + max(0, room - e10 - 2) if e10 + 1 <= room else 0
+    else:
+        fixed = room + e10 - 1
+    e_show = e10
+    lead = 1
+    if mode == ENG:
+        e_show = e10 - e10 % 3
+        lead = e10 - e_show + 1
+    sci = room - 2 - _exp_len(e_show)
+    if sci < lead and fixed < 1:
+        raise ValueError("number does not fit")
+    use_fixed = min(fixed, MAX_SIG) >= min(sci, MAX_SIG) or sci < lead
+    if use_fixed:
+        e_fixed, used = _round_digits(value, min(fixed, MAX_SIG), e10)
+        # Rounding 9.99... up may push the integer part past the width
+        use_fixed = e_fixed + 1 <= room or sci < lead
+    if use_fixed:
+        e10 = e_fixed
+        if e10 < 0:
+            buf[pos] = _ZERO
+            buf[pos + 1] = _POINT
+            pos += 2
+            for _ in range(-e10 - 1):
+                buf[pos] = _ZERO
+                pos += 1
+            for j in range(used):
+                buf[pos] = _ZERO + _digits[j]
+                pos += 1
+        else:
+            for j in range(max(used, e10 + 1)):
+                if j == e10 + 1:
+                    buf[pos] = _POINT
+                    pos += 1
+                buf[pos] = _ZERO + (_digits[j] if j < used else 0)
+                pos += 1
+        return pos - start
+    p = min(sci, MAX_SIG)
+    e10, used = _round_digits(value, p, e10)
+    if mode == ENG:
+        e_show = e10 - e10 % 3
+        lead = e10 - e_show + 1
+    else:
+        e_show = e10
+        lead = 1
+    for j in range(max(used, lead)):
+        if j == lead:
+            buf[pos] = _POINT
+            pos += 1
+        buf[pos] = _ZERO + (_digits[j] if j < used else 0)
+        pos += 1
+    buf[pos] = _E
+    pos = _put_int(buf, pos + 1, e_show)
+    return pos - start
+
+
+def format_result(re, im, buf, mode=AUTO):
+    """Fill all of buf with a result, right-aligned and space padded.
+
+    A complex result is written as re+imi with the width shared between
+    the two parts.
+    """
+    width = len(buf)
+    if im == 0:
+        n = format_number(re, buf, 0, width, mode)
+    else:
+        half = (width - 2) // 2
+        n = format_number(re, buf, 0, half, mode)
+        if im >= 0:
+            buf[n] = 43  # "+"
+            n += 1
+        n += format_number(im, buf, n, width - 1 - n, mode)
+        buf[n] = 105  # "i"
+        n += 1
+    # Shift right in place and pad on the left
+    shift = width - n
+    if shift:
+        for j in range(n - 1, -1, -1):
+            buf[j + shift] = buf[j]
+        for j in range(shift):
+            buf[j] = _SPACE
+    return n
@@ -0,0 +1,68 @@
+"""Binary form of compiled programs, for keeping them on flash.
+
+A program is written as a small fixed header followed by its raw code
+(array 'H'), constant pool (array 'f') and source text, then its
+sub-programs in the same form. Loading one copies those bytes straight
+back into arrays; nothing is tokenized or parsed.
+
+    <HHHBBBB  code words, constants, source bytes,
+              stack depth, temp slots, sub-programs, flags
+"""
+
+import struct
+from array import array
+from expr import Program
+
+VERSION = 1
+
+_HEADER = "<HHHBBBB"
+_HEADER_SIZE = struct.calcsize(_HEADER)
+
+FLAG_COMPLEX = 1
+
+
+def _from_bytes(typecode, data):
+    # MicroPython has no frombytes, and array(typecode, x) copies raw bytes
+    # only when x is bytes or a bytearray; anything else, a memoryview
+    # slice too, is read one element per byte. So data is made bytes
+    # first. CPython needs frombytes
+    data = bytes(data)
+    a = array(typecode)
+    try:
+        a.frombytes(data)
+    except AttributeError:
+        a = array(typecode, data)
+    return a
+
+
+def pack(prog, out):
+    """Append the binary form of prog to the list of byte strings out."""
+    src = prog.source.encode()
+    flags = FLAG_COMPLEX if prog.is_complex else 0
+    out.append(struct.pack(_HEADER, len(prog.code), len(prog.consts), len(src),
+                           prog.depth, prog.ntemps, len(prog.subs), flags))
+    out.append(bytes(prog.code))
+    out.append(bytes(prog.consts))
+    out.append(src)
+    for sub in prog.subs:
+        pack(sub, out)
+
+
+def unpack(data, pos=0):
+    """Return (program, position after it) for the program at data[pos:]."""
+    ncode, nconsts, nsrc, depth, ntemps, nsubs, flags = \
+        struct.unpack_from(_HEADER, data, pos)
+    pos += _HEADER_SIZE
+    code = _from_bytes("H", data[pos:pos + 2 * ncode])
+    pos += 2 * ncode
+    consts = _from_bytes("f", data[pos:pos + 4 * nconsts])
+    pos += 4 * nconsts
+    source = str(bytes(data[pos:pos + nsrc]), "utf-8")
+    pos += nsrc
+    subs = []
+    for _ in range(nsubs):
+        sub, pos = unpack(data, pos)
+        subs.append(sub)
+    prog = Program(source, code, consts, depth, tuple(subs), ntemps)
+    prog.is_complex = bool(flags & FLAG_COMPLEX)
+    return prog, pos
@@ -0,0 +1,300 @@
+"""Record keystroke sessions and replay them as end-to-end benchmarks.
+
+A Session is a compact log of key presses: for each, the milliseconds
+since the one before and the key. RecordingKeypad wraps a Keypad and logs
+every event the application takes from it (calculate.cal_async(record=
+True) does this; save calculate.recording afterwards). replay() feeds a
+session through an on_key(row, col, kind) handler, the same path the
+keypad events take to default_key(), and after each key lets the runtime
+finish the jobs and the frame it asked for. It reports per-key latency
+from the key event to the display bytes having been written, and
+throughput in keys per second.
+
+On the board this runs against the real LCD. On a PC, "python replay.py
+[session.keys ...]" runs it against hostfake's machine and utime, whose
+virtual clock adds the I2C transfer times and driver sleeps; without
+arguments it replays the built-in editor, menu and plot sessions.
+
+Log format:
+
+    "KEYS" version count
+    per event <HB  milliseconds since the previous event (at most
+                   65535), then row << 4 | col
+"""
+
+import struct
+from array import array
+import keymap
+
+MAGIC = b"KEYS"
+VERSION = 1
+MAX_EVENTS = 1024
+
+# Gap between keys of sessions built with from_keys()
+GAP_MS = 150
+
+_HEADER = "<BH"
+_EVENT = "<HB"
+
+
+def _clock():
+    # Looked up at call time, so hostfake's utime is used once installed
+    try:
+        from utime import ticks_us, ticks_diff, sleep_ms  # type: ignore
+    except ImportError:
+        from time import perf_counter_ns, sleep
+
+        def ticks_us():
+            return perf_counter_ns() // 1000
+
+        def ticks_diff(a, b):
+            return a - b
+
+        def sleep_ms(ms):
+            sleep(ms / 1000)
+    return ticks_us, ticks_diff, sleep_ms
+
+
+class Session:
+    def __init__(self, capacity=MAX_EVENTS):
+        self.delays = array("H", [0] * capacity)
+        self.keys = bytearray(capacity)
+        self.count = 0
+        self.dropped = 0
+        self.last = None
+        self._diff = _clock()[1]
+
+    def add(self, row, col, ticks_ms):
+        if self.count == len(self.keys):
+            self.dropped += 1
+            return
+        delay = 0
+        if self.last is not None:
+            delay = min(max(self._diff(ticks_ms, self.last), 0), 65535)
+        self.last = ticks_ms
+        self.delays[self.count] = delay
+        self.keys[self.count] = row << 4 | col
+        self.count += 1
+
+    def events(self):
+        """(delay_ms, row, col) for each key press in order."""
+        for i in range(self.count):
+            key = self.keys[i]
+            yield self.delays[i], key >> 4, key & 15
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack(_HEADER, VERSION, self.count))
+            for i in range(self.count):
+                f.write(struct.pack(_EVENT, self.delays[i], self.keys[i]))
+
+
+def load(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != MAGIC:
+        raise ValueError("not a key session")
+    version, count = struct.unpack_from(_HEADER, data, 4)
+    if version != VERSION:
+        raise ValueError("session version %d" % version)
+    session = Session(max(count, 1))
+    pos = 4 + struct.calcsize(_HEADER)
+    for i in range(count):
+        delay, key = struct.unpack_from(_EVENT, data, pos)
+        pos += struct.calcsize(_EVENT)
+        session.delays[i] = delay
+        session.keys[i] = key
+    session.count = count
+    return session
+
+
+def from_keys(keys, gap_ms=GAP_MS):
+    """A session pressing each (row, col) in keys, gap_ms apart."""
+    session = Session(max(len(keys), 1))
+    t = 0
+    for row, col in keys:
+        session.add(row, col, t)
+        t += gap_ms
+    return session
+
+
+def keys_for(*items):
+    """(row, col) of the base-layer keys for items: action IDs, key
+    entries such as "sin(", or text typed one key per character."""
+    out = []
+    for item in items:
+        if item in keymap.BASE_KEYS:
+            i = keymap.BASE_KEYS.index(item)
+            out.append((i // keymap.COLS, i % keymap.COLS))
+        elif isinstance(item, str) and len(item) > 1:
+            out.extend(keys_for(*item))
+        else:
+            raise ValueError("no key for %r" % (item,))
+    return out
+
+
+class RecordingKeypad:
+    """Keypad wrapper that logs the events taken from it into session."""
+
+    def __init__(self, keypad, session):
+        self.keypad = keypad
+        self.session = session
+
+    def poll(self):
+        return self.keypad.poll()
+
+    def wait(self):
+        self.keypad.wait()
+
+    def any(self):
+        return self.keypad.any()
+
+    def get(self):
+        event = self.keypad.get()
+        # Long presses only mark time; replay sends presses
+        if event is not None and event[2] != LONG:
+            self.session.add(event[0], event[1], event[3])
+        return event
+
+
+# keypad.PRESS and keypad.LONG; not imported, so that sessions can be
+# built and saved without the hardware modules
+PRESS = 0
+LONG = 1
+
+
+class Report:
+    def __init__(self, count):
+        self.latency = array("f", [0.0] * count)
+        self.count = 0
+        self.elapsed_us = 0
+        self.bytes = 0
+
+    def summary(self, name=""):
+        n = self.count
+        if n == 0:
+            return "%s: no keys" % name
+        ordered = sorted(self.latency[:n])
+        ms = 1000.0
+        return ("%s: %d keys in %.1f ms, %.1f keys/s\n"
+                "  latency ms  min %.2f  median %.2f  p95 %.2f  max %.2f\n"
+                "  display bytes %d, %.1f per key" % (
+                    name, n, self.elapsed_us / ms,
+                    n * 1e6 / self.elapsed_us if self.elapsed_us else 0.0,
+                    ordered[0] / ms, ordered[n // 2] / ms,
+                    ordered[min(n - 1, n * 95 // 100)] / ms,
+                    ordered[-1] / ms, self.bytes, self.bytes / n))
+
+
+def replay(session, on_key, settle=None, bytes_written=None, realtime=False):
+    """Press the keys of session through on_key and time each one.
+
+    settle() runs whatever a key set off (pending jobs and the frame) and
+    bytes_written() counts the display bytes sent so far. With realtime
+    the recorded gaps are waited out between keys; they never count
+    towards latency. Returns a Report.
+    """
+    ticks_us, ticks_diff, sleep_ms = _clock()
+    report = Report(session.count)
+    before = bytes_written() if bytes_written else 0
+    for delay, row, col in session.events():
+        if realtime and delay:
+            sleep_ms(delay)
+        start = ticks_us()
+        on_key(row, col, PRESS)
+        if settle is not None:
+            settle()
+        took = ticks_diff(ticks_us(), start)
+        report.latency[report.count] = took
+        report.count += 1
+        report.elapsed_us += took
+    if bytes_written:
+        report.bytes = bytes_written() - before
+    return report
+
+
+class CountingI2C:
+    """I2C wrapper counting the bytes written, for any bus object."""
+
+    def __init__(self, i2c):
+        self.i2c = i2c
+        self.bytes_written = 0
+
+    def writeto(self, addr, buf, *args):
+        self.bytes_written += len(buf)
+        return self.i2c.writeto(addr, buf, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.i2c, name)
+
+
+def calculator():
+    """Set calculate up for replay; returns (on_key, settle, bytes_written).
+
+    The keys go to calculate.on_key with a Runtime that is stepped by
+    settle() rather than run, so each key's redraw and evaluation finish
+    before the next key, and the menu is entered inline.
+    """
+    import calculate
+    import menu
+    from runtime import Runtime
+    calculate.setup()
+    buses = []
+    for lcd in (calculate.lcd, menu.lcd):
+        lcd.i2c = CountingI2C(lcd.i2c)
+        buses.append(lcd.i2c)
+    runtime = Runtime(None, calculate.on_key, calculate.update_display)
+    calculate.runtime = runtime
+
+    def bytes_written():
+        return sum([bus.bytes_written for bus in buses])
+
+    return calculate.on_key, runtime.settle, bytes_written
+
+
+def editor_session():
+    return from_keys(keys_for(
+        "12", "+", "34", "*", "sin(", "0.5", ")", keymap.SOLVE,
+        keymap.ANSWER, "*", "2", keymap.SOLVE, keymap.CLEAR,
+        "pow( , ", keymap.LEFT, keymap.LEFT, "3", keymap.RIGHT, "4",
+        keymap.RIGHT, ")", keymap.SOLVE, keymap.BACKSPACE, keymap.BACKSPACE, keymap.CLEAR))
+
+
+def menu_session():
+    # Home, into Unit Conversion and back, into Saved Data and out
+    return from_keys(keys_for(
+        keymap.HOME, keymap.DOWN, keymap.DOWN, keymap.DOWN, keymap.RIGHT,
+        keymap.DOWN, keymap.DOWN, keymap.UP, keymap.LEFT, keymap.DOWN,
+        keymap.DOWN, keymap.DOWN, keymap.DOWN, keymap.RIGHT, keymap.LEFT,
+        keymap.LEFT))
+
+
+def plot_session():
+    # The calculator's function screen is the value table: Home > Table,
+    # fill in table(sin(x), 0, 0.1), then scroll down through the samples
+    # and back, each new row evaluated as it comes into view
+    return from_keys(keys_for(
+        keymap.HOME, keymap.DOWN, keymap.RIGHT, keymap.LEFT, keymap.LEFT,
+        keymap.LEFT, keymap.LEFT, keymap.LEFT, "sin(", "x", ")",
+        keymap.RIGHT, keymap.RIGHT, "0", keymap.RIGHT, keymap.RIGHT, "0.1",
+        ")", keymap.SOLVE) + keys_for(keymap.DOWN) * 24 +
+        keys_for(keymap.UP) * 8 + keys_for(keymap.CLEAR))
+
+
+def main(paths):
+    import hostfake
+    hostfake.install()
+    on_key, settle, bytes_written = calculator()
+    if paths:
+        sessions = [(path, load(path)) for path in paths]
+    else:
+        sessions = [("editor", editor_session()), ("menu", menu_session()),
+                    ("plot", plot_session())]
+    for name, session in sessions:
+        print(replay(session, on_key, settle, bytes_written).summary(name))
+
+
+if __name__ == "__main__":
+    import sys
+    main(sys.argv[1:])
@@ -0,0 +1,70 @@
+"""Bounded LRU cache of evaluated results.
+
+Keys are the expression text with spaces removed plus the mode settings
+the result depends on (angle unit, variable values). The cache holds at
+most max_entries results and roughly max_bytes of key text, evicting the
+least recently used entry first, so its footprint on the ESP32 stays
+fixed. The hit, miss and eviction counters are there for sizing it.
+"""
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ucollections import OrderedDict  # type: ignore
+
+# Rough per-entry cost on the heap besides the key text
+ENTRY_OVERHEAD = 32
+
+
+def normalise(text):
+    return "".join(text.split())
+
+
+class ResultCache:
+    def __init__(self, max_entries=32, max_bytes=2048):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, text, mode):
+        return normalise(text) + "|" + str(mode)
+
+    def get(self, text, mode=None):
+        """Return the cached result, or None on a miss."""
+        key = self.key(text, mode)
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        # Re-insert to mark it most recently used
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, text, mode, value):
+        key = self.key(text, mode)
+        size = len(key) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= size
+        while self.entries and (len(self.entries) >= self.max_entries
+                                or self.bytes + size > self.max_bytes):
+            oldest = next(iter(self.entries))
+            del self.entries[oldest]
+            self.bytes -= len(oldest) + ENTRY_OVERHEAD
+            self.evictions += 1
+        self.entries[key] = value
+        self.bytes += size
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.bytes = 0
+
+    def stats(self):
+        return (self.hits, self.misses, self.evictions, len(self.entries), self.bytes)
@@ -0,0 +1,205 @@
+"""One cooperative runtime for the keypad, the display and computations.
+
+Instead of each screen owning a blocking while-loop, Runtime runs three
+asyncio tasks side by side:
+
+    keys     polls the Keypad and hands each event to the current key
+             handler; between polls it sleeps, so the others get to run
+    render   redraws when asked to; any number of request_render() calls
+             before the next frame come out as one redraw, and frames are
+             at least frame_ms apart
+    compute  runs submitted jobs, which are iterators (usually
+             generators) that yield between pieces of work; it advances
+             a job for slice_ms and then gives the other tasks a turn
+
+A job's return value (the StopIteration value) goes to its done callback.
+integrate.integrate_steps and solver.find_roots_steps are written this
+way, and calculate runs = on a text that is one integ(E, A, B) or
+roots(E, A, B) through them, so those keep the keys and the display
+going. Other evaluations, integ/solve/dif inside a larger expression
+included, are one step each.
+
+It uses uasyncio on the board and asyncio on a PC; the keypad and the
+display are whatever objects are passed in, so fakes work for tests.
+"""
+
+try:
+    import uasyncio as asyncio  # type: ignore
+except ImportError:
+    import asyncio
+
+try:
+    from utime import ticks_ms, ticks_diff  # type: ignore
+except ImportError:
+    from time import monotonic
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+KEY_MS = 5
+FRAME_MS = 40
+SLICE_MS = 20
+MAX_JOBS = 4
+
+
+class Runtime:
+    def __init__(self, keypad, on_key, render, key_ms=KEY_MS,
+                 frame_ms=FRAME_MS, slice_ms=SLICE_MS):
+        # on_key(row, col, kind) handles one key event; render() draws
+        self.keypad = keypad
+        self.on_key = on_key
+        self.render = render
+        self.key_ms = key_ms
+        self.frame_ms = frame_ms
+        self.slice_ms = slice_ms
+        self.running = False
+        self.dirty = False
+        self.frames = 0
+        self.render_requests = 0
+        # Pending jobs as [steps, done] pairs, oldest first
+        self.jobs = []
+        self._wake_render = None
+        self._wake_compute = None
+
+    def request_render(self):
+        """Ask for a redraw; requests before the next frame are merged."""
+        self.render_requests += 1
+        self.dirty = True
+        if self._wake_render is not None:
+            self._wake_render.set()
+
+    def submit(self, steps, done=None):
+        """Queue a job; done(result) is called when it finishes."""
+        if len(self.jobs) >= MAX_JOBS:
+            raise ValueError("too many jobs")
+        self.jobs.append([steps, done])
+        if self._wake_compute is not None:
+            self._wake_compute.set()
+
+    def busy(self):
+        return len(self.jobs) > 0
+
+    def full(self):
+        """True when submit() would refuse another job."""
+        return len(self.jobs) >= MAX_JOBS
+
+    def cancel(self):
+        """Drop every pending job without calling its done callback."""
+        for job in self.jobs:
+            job[1] = None
+        self.jobs = []
+
+    def stop(self):
+        self.running = False
+        # Let the waiting tasks see it
+        self._wake_render.set()
+        self._wake_compute.set()
+
+    def settle(self):
+        """Finish every pending job and draw the frame asked for, without
+        the event loop; for replays and tests that step the runtime."""
+        while self.jobs:
+            job = self.jobs.pop(0)
+            result = None
+            try:
+                while True:
+                    next(job[0])
+            except StopIteration as stop:
+                result = stop.value
+            except Exception as e:
+                print(e)
+                job[1] = None
+            if job[1] is not None:
+                job[1](result)
+        if self.dirty:
+            self._draw()
+
+    def _draw(self):
+        self.dirty = False
+        try:
+            self.render()
+        except Exception as e:
+            # A failing redraw must not stop the display for good
+            print(e)
+        self.frames += 1
+
+    async def keys_task(self):
+        keypad = self.keypad
+        while self.running:
+            keypad.poll()
+            while keypad.any():
+                row, col, kind, t = keypad.get()
+                try:
+                    self.on_key(row, col, kind)
+                except Exception as e:
+                    # Nor may a failing key handler stop the keys
+                    print(e)
+            await asyncio.sleep(self.key_ms / 1000)
+
+    async def render_task(self):
+        wake = self._wake_render
+        while self.running:
+            await wake.wait()
+            wake.clear()
+            if not self.running:
+                break
+            if self.dirty:
+                self._draw()
+            # Requests during the pause are drawn together next time
+            await asyncio.sleep(self.frame_ms / 1000)
+
+    async def compute_task(self):
+        wake = self._wake_compute
+        while self.running:
+            if not self.jobs:
+                await wake.wait()
+                wake.clear()
+                continue
+            job = self.jobs[0]
+            start = ticks_ms()
+            finished = False
+            result = None
+            try:
+                while ticks_diff(ticks_ms(), start) < self.slice_ms:
+                    next(job[0])
+            except StopIteration as stop:
+                finished = True
+                result = stop.value
+            except Exception as e:
+                # A failing job must not take the runtime down with it
+                print(e)
+                finished = True
+                job[1] = None
+            if finished:
+                if self.jobs and self.jobs[0] is job:
+                    self.jobs.pop(0)
+                if job[1] is not None:
+                    job[1](result)
+            await asyncio.sleep(0)
+
+    async def main(self):
+        self.running = True
+        self._wake_render = asyncio.Event()
+        self._wake_compute = asyncio.Event()
+        if self.dirty:
+            self._wake_render.set()
+        if self.jobs:
+            self._wake_compute.set()
+        await asyncio.gather(self.keys_task(), self.render_task(),
+                             self.compute_task())
+
+    def run(self):
+        asyncio.run(self.main())
+
+
+def run_steps(steps):
+    """Run a job to the end at once and return its result, for when there
+    is no runtime to hand it to."""
+    while True:
+        try:
+            next(steps)
+        except StopIteration as done:
+            return done.value
@@ -0,0 +1,131 @@
+"""Saved expressions, kept on flash already compiled.
+
+The file is read in one go at boot and kept as a buffer; only the header
+is checked then. Each entry is the text as typed (which may be an
+assignment such as "A = 2*r") followed by the program for its
+expression in progfile form. A small index at the front gives the
+offsets, so recalling entry i is a slice of the buffer and a copy of
+its code and constants into arrays, with no tokenizing or parsing.
+
+    "SEQ" version count
+    index: per entry <HHH  text offset, text length, program offset
+    bodies: text bytes, then the packed program
+"""
+
+import struct
+from expr import cache_program, calls_user
+import progfile
+
+PATH = "saved.bin"
+MAGIC = b"SEQ"
+MAX_SAVED = 100
+
+_HEADER = "<BH"
+_ENTRY = "<HHH"
+_INDEX = len(MAGIC) + struct.calcsize(_HEADER)
+_ENTRY_SIZE = struct.calcsize(_ENTRY)
+
+# Contents of the file and the number of entries in it
+_data = memoryview(b"")
+_count = 0
+
+
+def load(path=PATH):
+    """Read the saved file into memory; returns the number of entries."""
+    global _data, _count
+    _data = memoryview(b"")
+    _count = 0
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return 0
+    if data[:3] != MAGIC:
+        return 0
+    version, count = struct.unpack_from(_HEADER, data, len(MAGIC))
+    if version != progfile.VERSION:
+        return 0
+    _data = memoryview(data)
+    _count = count
+    return count
+
+
+def count():
+    return _count
+
+
+def text(i):
+    """Text of entry i as it was typed."""
+    start, n, _ = _entry(i)
+    return str(bytes(_data[start:start + n]), "utf-8")
+
+
+def texts():
+    return [text(i) for i in range(_count)]
+
+
+def find(entry_text):
+    for i in range(_count):
+        if text(i) == entry_text:
+            return i
+    return -1
+
+
+def _entry(i):
+    if not 0 <= i < _count:
+        raise IndexError("no such entry")
+    return struct.unpack_from(_ENTRY, _data, _INDEX + i * _ENTRY_SIZE)
+
+
+def program(i):
+    """Compiled program of entry i."""
+    return progfile.unpack(_data, _entry(i)[2])[0]
+
+
+def recall(i):
+    """Return the text of entry i with its program ready in the compile
+    cache, so evaluating it does not parse it again."""
+    prog = program(i)
+    # Calls are bound to function indexes, which a redefinition may have
+    # moved; those are compiled again from the text instead
+    if not calls_user(prog):
+        cache_program(prog)
+    return text(i)
+
+
+def add(entry_text, prog, path=PATH):
+    """Append entry_text with its compiled prog and rewrite the file.
+
+    Returns the entry's index; text already saved is not added twice.
+    """
+    i = find(entry_text)
+    if i >= 0:
+        return i
+    if _count >= MAX_SAVED:
+        raise ValueError("saved data full")
+    bodies = []
+    for j in range(_count):
+        start, n, _ = _entry(j)
+        end = _entry(j + 1)[0] if j + 1 < _count else len(_data)
+        bodies.append((n, _data[start:end]))
+    encoded = entry_text.encode()
+    packed = [encoded]
+    progfile.pack(prog, packed)
+    bodies.append((len(encoded), b"".join(packed)))
+    # Offsets are 16 bits, which holds far more than MAX_SAVED entries
+    offset = _INDEX + len(bodies) * _ENTRY_SIZE
+    index = []
+    for n, body in bodies:
+        index.append(struct.pack(_ENTRY, offset, n, offset + n))
+        offset += len(body)
+    if offset > 0xFFFF:
+        raise ValueError("saved data full")
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack(_HEADER, progfile.VERSION, len(bodies)))
+        for part in index:
+            f.write(part)
+        for n, body in bodies:
+            f.write(body)
+    load(path)
+    return _count - 1
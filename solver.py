@@ -0,0 +1,190 @@
+"""Single-variable equation solver for f(x) = 0.
+
+The interval is first sampled coarsely with one vectorised pass to find
+sign changes, then each bracket is refined with a safeguarded Newton
+iteration: Newton steps use the analytic slope from autodiff, and any step
+that leaves the bracket or stops shrinking it falls back to a secant or
+bisection step, so every root converges like Newton near the end but can
+never escape its bracket. Touching roots (x**2 at 0) show up as a local
+minimum of |f| between samples and get a few unbracketed Newton steps.
+"""
+
+from array import array
+from autodiff import eval_dual
+from expr import compile_expr, call_args, equation
+
+# Coarse samples across the interval
+SAMPLES = 64
+MAX_ITER = 40
+MAX_ROOTS = 8
+TOL = 1e-6
+
+
+def _samples(prog, n):
+    # Sample buffers of prog by length, allocated once; a nested solve()
+    # has its own, being another program
+    buf = prog.sample_buffers.get(n)
+    if buf is None:
+        buf = (array("f", [0.0] * n), array("f", [0.0] * n))
+        prog.sample_buffers[n] = buf
+    return buf
+
+
+def refine(prog, lo, hi, flo, fhi, tol=TOL, max_iter=MAX_ITER):
+    """Converge on the root bracketed by [lo, hi].
+
+    Returns (root, f(root), iterations, evaluations).
+    """
+    x = lo if abs(flo) < abs(fhi) else hi
+    fx = flo if x == lo else fhi
+    last_width = abs(hi - lo)
+    evals = 0
+    for it in range(1, max_iter + 1):
+        fx, dfx = eval_dual(prog, x)
+        evals += 1
+        if fx == 0:
+            return x, fx, it, evals
+        if (fx < 0) == (flo < 0):
+            lo, flo = x, fx
+        else:
+            hi, fhi = x, fx
+        width = abs(hi - lo)
+        a, b = (lo, hi) if lo < hi else (hi, lo)
+        new = None
+        # Newton, unless the bracket stopped halving
+        if dfx != 0 and width < 0.5 * last_width + tol:
+            new = x - fx / dfx
+            if not (a < new < b):
+                new = None
+        # Secant through the bracket ends
+        if new is None and fhi != flo:
+            new = lo - flo * (hi - lo) / (fhi - flo)
+            if not (a < new < b):
+                new = None
+        if new is None:
+            new = 0.5 * (lo + hi)
+        last_width = width
+        if abs(new - x) <= tol * (1 + abs(x)) or width <= tol * (1 + abs(x)):
+            return new, fx, it, evals
+        x = new
+    return x, fx, max_iter, evals
+
+
+def polish(prog, x, lo, hi, tol=TOL, max_iter=20):
+    # Unbracketed Newton from a local minimum of |f|, for touching roots
+    evals = 0
+    for it in range(1, max_iter + 1):
+        fx, dfx = eval_dual(prog, x)
+        evals += 1
+        if fx == 0 or dfx == 0:
+            return x, fx, it, evals
+        new = x - fx / dfx
+        if not (lo <= new <= hi):
+            return None
+        if abs(new - x) <= tol * (1 + abs(x)):
+            return new, fx, it, evals
+        x = new
+    return x, fx, max_iter, evals
+
+
+def find_roots(prog, a, b, samples=SAMPLES, max_roots=MAX_ROOTS, tol=TOL):
+    """Return up to max_roots roots of prog in [a, b], in increasing order.
+
+    Each root is reported as (root, iterations, evaluations), where the
+    evaluations count the f/f' pairs used to refine that root on top of
+    the samples + 1 values of the coarse pass.
+    """
+    xs, ys = _samples(prog, samples + 1)
+    steps = _roots(prog, a, b, samples, max_roots, tol, xs, ys)
+    while True:
+        try:
+            next(steps)
+        except StopIteration as done:
+            return done.value
+
+
+def find_roots_steps(prog, a, b, samples=SAMPLES, max_roots=MAX_ROOTS,
+                     tol=TOL):
+    """Generator form of find_roots(): yields after the coarse pass and
+    after each root it refines, and returns the roots (see runtime).
+
+    It has its own sample buffers, so find_roots() can run while it is
+    suspended.
+    """
+    n = samples + 1
+    xs = array("f", [0.0] * n)
+    ys = array("f", [0.0] * n)
+    return _roots(prog, a, b, samples, max_roots, tol, xs, ys)
+
+
+def _roots(prog, a, b, samples, max_roots, tol, xs, ys):
+    if a > b:
+        a, b = b, a
+    n = samples + 1
+    step = (b - a) / samples
+    for i in range(n):
+        xs[i] = a + i * step
+    prog.run_vector(xs, ys, n)
+    yield
+    roots = []
+    scale = 0.0
+    for i in range(n):
+        if ys[i] == ys[i]:
+            scale = max(scale, abs(ys[i]))
+    # Residual above which a "root" is really a pole like tan at pi/2
+    limit = 1e-3 * max(scale, 1.0)
+    for i in range(n):
+        if len(roots) >= max_roots:
+            break
+        y0 = ys[i]
+        if y0 != y0:
+            continue
+        found = None
+        if y0 == 0:
+            found = (xs[i], 0, 0)
+        elif i + 1 < n:
+            y1 = ys[i + 1]
+            if y1 == y1 and y1 != 0 and (y0 < 0) != (y1 < 0):
+                try:
+                    r, fr, it, ev = refine(prog, xs[i], xs[i + 1], y0, y1, tol)
+                    if abs(fr) <= limit:
+                        found = (r, it, ev)
+                except (ValueError, ZeroDivisionError):
+                    pass
+                yield
+            elif 0 < i and ys[i - 1] == ys[i - 1] and y1 == y1 and \
+                    abs(y0) < abs(ys[i - 1]) and abs(y0) < abs(y1) and \
+                    (ys[i - 1] < 0) == (y0 < 0) == (y1 < 0):
+                try:
+                    res = polish(prog, xs[i], xs[i - 1], xs[i + 1], tol)
+                    if res is not None and abs(res[1]) <= tol * max(scale, 1.0):
+                        found = (res[0], res[2], res[3])
+                except (ValueError, ZeroDivisionError):
+                    pass
+                yield
+        if found is not None:
+            if roots and abs(found[0] - roots[-1][0]) <= 10 * tol * (1 + abs(found[0])):
+                continue
+            roots.append(found)
+    return roots
+
+
+def first_root(prog, a, b):
+    """Smallest root of prog in [a, b], for solve() in expressions."""
+    roots = find_roots(prog, a, b, max_roots=1)
+    if not roots:
+        raise ValueError("no root")
+    return roots[0][0]
+
+
+def split(text):
+    """(equation, a, b) texts of "roots(E, A, B)", the calculator's form
+    for all the roots of E in [A, B], or None for any other text."""
+    parts = call_args(text, "roots")
+    if parts is None or len(parts) != 3:
+        return None
+    return equation(parts[0]), parts[1], parts[2]
+
+
+def solve(text, a, b):
+    return find_roots(compile_expr(text), a, b)
@@ -1,7 +1,9 @@
 import machine
 import time
 import framebuf
+from array import array
 from math import *
+from expr import compile_expr
 # Pin definitions for ESP32
 CS1 = machine.Pin(5, machine.Pin.OUT)  # Chip Select
 RS = machine.Pin(19, machine.Pin.OUT)  # Register Select (A0 on ST7565R)
@@ -149,30 +151,37 @@ graph_letters = {
 }
 
 
-def plot_function(fb, func, x_min, x_max, y_min, y_max, width, height):
+# Sample buffers for plot_function, allocated once and reused on every redraw
+x_values = array('f', [0.0] * 128)
+y_values = array('f', [0.0] * 128)
+
+def plot_function(fb, prog, x_min, x_max, y_min, y_max, width, height):
     global x_past, y_past, graph_letters
     # Scale factors to map function values to the display's pixel coordinates
     x_scale = (x_max - x_min) /(width)
     y_scale = (y_max - y_min) / (height)
 
-    # Loop through each x pixel
+    # Convert each pixel x-coordinate to the mathematical x-value
     for x_pixel in range(width):
-        
-        # Convert the pixel x-coordinate to the mathematical x-value
-        x_value = x_min + (x_pixel) * x_scale
+        x_values[x_pixel] = x_min + (x_pixel) * x_scale
 
-        # Calculate the corresponding y-value for the function
-        y_value = func(x_value)
+    # Evaluate the compiled function over the whole column range in one pass
+    prog.run_vector(x_values, y_values, width)
 
-        # Scale the y-value to the display height and invert it (because displays usually have y=0 at the top)
-        y_pixel = int(height - (y_value - y_min) / y_scale)
-        
-        if func(x_value)>y_max or func(x_value)<y_min:
+    # Loop through each x pixel
+    for x_pixel in range(width):
+        x_value = x_values[x_pixel]
+        y_value = y_values[x_pixel]
 
-            print(" pixel= ",x_pixel," ", y_pixel," value= ",x_value," ", y_value ," past= ",x_past," ",y_past)
+        # Out of range or undefined (nan): break the line here
+        if not (y_min <= y_value <= y_max):
+            print(" pixel= ",x_pixel," value= ",x_value," ", y_value ," past= ",x_past," ",y_past)
             x_past=0
             y_past=0
-            # fb.vline(x_pixel,y_pixel, 100,1)
+            continue
+
+        # Scale the y-value to the display height and invert it (because displays usually have y=0 at the top)
+        y_pixel = int(height - (y_value - y_min) / y_scale)
 
         # Ensure y_pixel is within the display range
         if 0 <= y_pixel < height:
@@ -190,7 +199,10 @@ def plot_function(fb, func, x_min, x_max, y_min, y_max, width, height):
     fb.hline(62,63,4,1)
 
 
-def polynom(x):
+# sin(x)/x is undefined at 0, that column is simply left out of the plot
+polynom = compile_expr("sin(x)/x")
+
+# def polynom(x):
     # y=sin(x)
     # y=x*sin(x)
     # y=e**x
@@ -202,11 +214,11 @@ def polynom(x):
     #     y=-1
     # if x>0:
     #     y=1
-    if x == 0:
-        y=25
-    else:
-        y=sin(x)/x  
-    return y
+    # if x == 0:
+    #     y=25
+    # else:
+    #     y=sin(x)/x  
+    # return y
 
 # def polynom2(x):
 #     # y=sin(x)
@@ -0,0 +1,147 @@
+"""Single-pass statistics over data entered one point at a time.
+
+Stats keeps running moments with Welford's updates, which stay accurate
+where the textbook sum-of-squares formulas cancel catastrophically in
+single precision. Paired (x, y) points also update the co-moment needed
+for linear regression. Every summary is O(1) to read and the object is a
+fixed handful of numbers however many points go in. Median and quantiles
+need the data itself, so they come from an optional Store: a flat
+array('f') that is sorted in place only when a quantile is asked for.
+"""
+
+from array import array
+from math import sqrt
+
+NAN = float("nan")
+
+
+class Store:
+    def __init__(self, capacity=256):
+        self.data = array("f", [0.0] * capacity)
+        self.n = 0
+        self.ordered = True
+
+    def add(self, x):
+        if self.n >= len(self.data):
+            raise ValueError("store full")
+        self.data[self.n] = x
+        self.n += 1
+        self.ordered = False
+
+    def clear(self):
+        self.n = 0
+        self.ordered = True
+
+    def _sort(self):
+        # Shell sort in place; no allocation, and fast enough for a few
+        # hundred points
+        a = self.data
+        n = self.n
+        gap = 1
+        while gap < n // 3:
+            gap = 3 * gap + 1
+        while gap:
+            for i in range(gap, n):
+                v = a[i]
+                j = i
+                while j >= gap and a[j - gap] > v:
+                    a[j] = a[j - gap]
+                    j -= gap
+                a[j] = v
+            gap //= 3
+        self.ordered = True
+
+    def quantile(self, q):
+        """Linearly interpolated quantile, q in [0, 1]."""
+        if not self.n:
+            return NAN
+        if not 0 <= q <= 1:
+            raise ValueError("quantile out of range")
+        if not self.ordered:
+            self._sort()
+        pos = q * (self.n - 1)
+        i = int(pos)
+        if i + 1 >= self.n:
+            return self.data[i]
+        frac = pos - i
+        return self.data[i] + frac * (self.data[i + 1] - self.data[i])
+
+    def median(self):
+        return self.quantile(0.5)
+
+
+class Stats:
+    def __init__(self, store=None):
+        self.store = store
+        self.clear()
+
+    def clear(self):
+        self.n = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        # Sums of squared deviations and the co-moment
+        self.m2_x = 0.0
+        self.m2_y = 0.0
+        self.c_xy = 0.0
+        self.min = NAN
+        self.max = NAN
+        self.paired = 0
+        if self.store is not None:
+            self.store.clear()
+
+    def add(self, x, y=None):
+        """Add a point; with y it also counts towards the regression."""
+        # The store may be full; then nothing below may count the point
+        if self.store is not None:
+            self.store.add(x)
+        n = self.n + 1
+        self.n = n
+        dx = x - self.mean_x
+        self.mean_x += dx / n
+        self.m2_x += dx * (x - self.mean_x)
+        if n == 1 or x < self.min:
+            self.min = x
+        if n == 1 or x > self.max:
+            self.max = x
+        if y is not None:
+            self.paired += 1
+            dy = y - self.mean_y
+            self.mean_y += dy / self.paired
+            self.m2_y += dy * (y - self.mean_y)
+            # Uses the old x deviation and the new y mean
+            self.c_xy += dx * (y - self.mean_y)
+
+    def extend(self, xs, ys=None):
+        for i in range(len(xs)):
+            self.add(xs[i], None if ys is None else ys[i])
+
+    def mean(self):
+        return self.mean_x if self.n else NAN
+
+    def variance(self, sample=True):
+        d = self.n - 1 if sample else self.n
+        return self.m2_x / d if d > 0 else NAN
+
+    def stdev(self, sample=True):
+        v = self.variance(sample)
+        return sqrt(v) if v == v else NAN
+
+    def regression(self):
+        """Return (slope, intercept, r) of the least-squares line y = a x + b."""
+        if self.paired != self.n:
+            raise ValueError("points are not paired")
+        if self.n < 2 or self.m2_x == 0:
+            return NAN, NAN, NAN
+        slope = self.c_xy / self.m2_x
+        intercept = self.mean_y - slope * self.mean_x
+        d = self.m2_x * self.m2_y
+        r = self.c_xy / sqrt(d) if d > 0 else NAN
+        return slope, intercept, r
+
+    def median(self):
+        return self.quantile(0.5)
+
+    def quantile(self, q):
+        if self.store is None:
+            raise ValueError("no data store")
+        return self.store.quantile(q)
@@ -0,0 +1,156 @@
+"""Multi-variable equation solver for the "Equation Solver > Multi-variable" menu.
+
+The menu entry starts "sys( , " in the calculator; = on a text such as
+sys(x+y-3, x-y=1) solves the equations for x, y, z, ... in that order.
+
+Linear systems A x = b are solved by LU decomposition with partial
+pivoting. A is a flat row-major array('f') that is factorised in place,
+and b is overwritten with the solution. Non-linear systems of up to MAX_N
+equations in the unknowns x, y, z, u, v, w use Newton's method. The
+Jacobian is built column by column with autodiff, seeding one unknown at
+a time. The Newton matrices live in module-level arrays allocated once,
+so a solve makes no heap allocations for its matrices.
+"""
+
+from array import array
+from autodiff import eval_dual, WRT_X
+from expr import VARS, variables, compile_expr, call_args, equation
+
+MAX_N = 6
+
+# Unknowns in order; x is passed as the run argument, the rest are slots
+UNKNOWNS = ("x", "y", "z", "u", "v", "w")
+
+TOL = 1e-6
+MAX_ITER = 30
+
+# Preallocated Newton storage
+_jac = array("f", [0.0] * (MAX_N * MAX_N))
+_rhs = array("f", [0.0] * MAX_N)
+_guess = array("f", [0.0] * MAX_N)
+_piv = array("B", [0] * MAX_N)
+
+
+def lu_decompose(a, n, piv):
+    """Factorise the n x n matrix a in place into L and U, with pivots.
+
+    Raises ValueError if a is singular.
+    """
+    for k in range(n):
+        # Partial pivoting: largest entry of column k on or below the diagonal
+        p = k
+        big = abs(a[k * n + k])
+        for i in range(k + 1, n):
+            v = abs(a[i * n + k])
+            if v > big:
+                big = v
+                p = i
+        if big == 0:
+            raise ValueError("singular matrix")
+        piv[k] = p
+        if p != k:
+            for j in range(n):
+                t = a[k * n + j]
+                a[k * n + j] = a[p * n + j]
+                a[p * n + j] = t
+        pivot = a[k * n + k]
+        for i in range(k + 1, n):
+            f = a[i * n + k] / pivot
+            a[i * n + k] = f
+            if f != 0:
+                for j in range(k + 1, n):
+                    a[i * n + j] -= f * a[k * n + j]
+
+
+def lu_solve(a, n, piv, b):
+    """Solve with the factors from lu_decompose, overwriting b."""
+    for k in range(n):
+        p = piv[k]
+        if p != k:
+            t = b[k]
+            b[k] = b[p]
+            b[p] = t
+    # Forward substitution with the unit lower triangle
+    for i in range(1, n):
+        s = b[i]
+        for j in range(i):
+            s -= a[i * n + j] * b[j]
+        b[i] = s
+    # Back substitution with the upper triangle
+    for i in range(n - 1, -1, -1):
+        s = b[i]
+        for j in range(i + 1, n):
+            s -= a[i * n + j] * b[j]
+        b[i] = s / a[i * n + i]
+    return b
+
+
+def solve_linear(a, b, n, piv=_piv):
+    """Solve a x = b for the n x n row-major a; returns b holding x."""
+    lu_decompose(a, n, piv)
+    return lu_solve(a, n, piv, b)
+
+
+def _set_unknowns(x, n):
+    for j in range(1, n):
+        variables[VARS[UNKNOWNS[j]]] = x[j]
+
+
+def solve_system(progs, guess, tol=TOL, max_iter=MAX_ITER):
+    """Solve progs[i] == 0 for the first len(progs) unknowns by Newton.
+
+    guess holds the starting point and receives the solution; the y, z, ...
+    slots of the variable store are left at the solution as well.
+    Returns the number of iterations used.
+    """
+    n = len(progs)
+    if n > MAX_N:
+        raise ValueError("too many unknowns")
+    jac = _jac
+    rhs = _rhs
+    for it in range(1, max_iter + 1):
+        _set_unknowns(guess, n)
+        x = guess[0]
+        err = 0.0
+        for i in range(n):
+            prog = progs[i]
+            for j in range(n):
+                wrt = WRT_X if j == 0 else VARS[UNKNOWNS[j]]
+                f, d = eval_dual(prog, x, wrt)
+                jac[i * n + j] = d
+            rhs[i] = -f
+            if abs(f) > err:
+                err = abs(f)
+        solve_linear(jac, rhs, n)
+        step = 0.0
+        for j in range(n):
+            guess[j] += rhs[j]
+            if abs(rhs[j]) > step:
+                step = abs(rhs[j])
+        scale = 0.0
+        for j in range(n):
+            scale = max(scale, abs(guess[j]))
+        if step <= tol * (1 + scale) or err == 0:
+            _set_unknowns(guess, n)
+            return it
+    raise ValueError("no convergence")
+
+
+def split(text):
+    """Equation texts of "sys(E1, E2, ...)", the calculator's form of a
+    system, or None for any other text. An equation "a = b" becomes
+    a-(b), to be solved for zero like a plain expression."""
+    parts = call_args(text, "sys")
+    if parts is None:
+        return None
+    return [equation(part) for part in parts]
+
+
+def solve(texts, guess=None):
+    """Compile and solve a list of equations; returns the solution list."""
+    n = len(texts)
+    x = _guess
+    for j in range(n):
+        x[j] = guess[j] if guess else 1.0
+    solve_system([compile_expr(t) for t in texts], x)
+    return [x[j] for j in range(n)]
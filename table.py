@@ -0,0 +1,122 @@
+"""Table of values for a compiled expression.
+
+A table is just (x0, step, count): row i is x0 + i * step and nothing is
+computed up front. Rows are evaluated when a display asks for them, in one
+vectorised pass over the rows that are missing, and kept in a small ring
+cache indexed by row number so scrolling back a few rows costs nothing.
+Memory is the ring alone, so a 10,000-row table uses the same few hundred
+bytes as a 10-row one.
+"""
+
+from array import array
+from expr import compile_expr, call_args
+
+# Ring slots; at least the visible rows of the biggest display
+CACHE_ROWS = 16
+
+# Rows of a table opened from the calculator with table(E, X0, STEP)
+ROWS = 10000
+
+
+class ValueTable:
+    def __init__(self, prog, x0, step, count, cache_rows=CACHE_ROWS):
+        self.prog = prog
+        self.x0 = x0
+        self.step = step
+        self.count = count
+        self.size = cache_rows
+        self.xs = array("f", [0.0] * cache_rows)
+        self.ys = array("f", [0.0] * cache_rows)
+        # Row held by each ring slot, -1 when empty
+        self.tags = array("l", [-1] * cache_rows)
+        # Gather buffers for the rows missing from a window
+        self._gx = array("f", [0.0] * cache_rows)
+        self._gy = array("f", [0.0] * cache_rows)
+        self._slot = array("H", [0] * cache_rows)
+        self.computed = 0
+
+    def x(self, i):
+        # Multiplied rather than accumulated, so row 9999 does not drift
+        return self.x0 + i * self.step
+
+    def fill(self, top, rows):
+        """Make sure rows top .. top+rows-1 are in the ring."""
+        size = self.size
+        if rows > size:
+            raise ValueError("window larger than cache")
+        stop = min(top + rows, self.count)
+        tags = self.tags
+        gx = self._gx
+        slots = self._slot
+        m = 0
+        for i in range(max(top, 0), stop):
+            s = i % size
+            if tags[s] != i:
+                gx[m] = self.x(i)
+                slots[m] = s
+                tags[s] = i
+                m += 1
+        if m:
+            gy = self._gy
+            self.prog.run_vector(gx, gy, m)
+            for k in range(m):
+                s = slots[k]
+                self.xs[s] = gx[k]
+                self.ys[s] = gy[k]
+            self.computed += m
+
+    def row(self, i):
+        """Return (x, f(x)) for row i."""
+        if not 0 <= i < self.count:
+            raise IndexError("row out of range")
+        s = i % self.size
+        if self.tags[s] != i:
+            self.fill(i, 1)
+        return self.xs[s], self.ys[s]
+
+    def rows(self, start=0, stop=None, chunk=8):
+        """Yield (i, x, f(x)) lazily, computing chunk rows at a time."""
+        if stop is None or stop > self.count:
+            stop = self.count
+        chunk = min(chunk, self.size)
+        for top in range(start, stop, chunk):
+            self.fill(top, chunk)
+            for i in range(top, min(top + chunk, stop)):
+                s = i % self.size
+                yield i, self.xs[s], self.ys[s]
+
+    def text(self, i, width=16):
+        x, y = self.row(i)
+        half = width // 2
+        return ("%-*.*g%*.*g" % (half, half - 2, x, width - half,
+                                 width - half - 2, y))[:width]
+
+    def show_lcd(self, lcd, top, lines=2, width=16):
+        # Character LCD: one row per line, blank past the end
+        self.fill(top, lines)
+        for line in range(lines):
+            lcd.move_to(0, line)
+            i = top + line
+            lcd.putstr(self.text(i, width) if i < self.count else " " * width)
+
+    def show_fb(self, fb, top, lines=8, width=16):
+        # ST7565 frame buffer: 8 pixel text rows
+        self.fill(top, lines)
+        fb.fill_rect(0, 0, width * 8, lines * 8, 0)
+        for line in range(lines):
+            i = top + line
+            if i < self.count:
+                fb.text(self.text(i, width), 0, line * 8, 1)
+
+
+def table(text, x0, step, count):
+    return ValueTable(compile_expr(text), x0, step, count)
+
+
+def split(text):
+    """(expression, x0, step) texts of "table(E, X0, STEP)", the
+    calculator's form of a table, or None for any other text."""
+    parts = call_args(text, "table")
+    if parts is None or len(parts) != 3:
+        return None
+    return parts[0], parts[1], parts[2]
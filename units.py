@@ -0,0 +1,159 @@
+"""Unit conversion engine.
+
+Every unit is stored as an edge to a parent unit in the same category:
+value_in_parent = value * factor + offset. The category root is its own
+parent. The table and the category index are constant tuples, which stay
+in flash when the module is frozen. A pair of units is folded into a
+single multiply-add, (m, c), through their nearest common ancestor rather
+than the category root, so F to C is the one edge 5/9, -160/9 and 32 F
+comes out as exactly 0 C instead of a residue of two offsets cancelling.
+The folded pair is cached.
+"""
+
+# name, parent index, factor, offset
+UNITS = (
+    # Length, base m
+    ("m", 0, 1.0, 0.0),
+    ("km", 0, 1000.0, 0.0),
+    ("cm", 0, 0.01, 0.0),
+    ("mm", 0, 0.001, 0.0),
+    ("um", 3, 0.001, 0.0),
+    ("nm", 4, 0.001, 0.0),
+    ("inch", 2, 2.54, 0.0),
+    ("ft", 6, 12.0, 0.0),
+    ("yd", 7, 3.0, 0.0),
+    ("mi", 8, 1760.0, 0.0),
+    ("nmi", 0, 1852.0, 0.0),
+    # Area, base m2
+    ("m2", 11, 1.0, 0.0),
+    ("km2", 11, 1e6, 0.0),
+    ("cm2", 11, 1e-4, 0.0),
+    ("mm2", 13, 0.01, 0.0),
+    ("ha", 11, 1e4, 0.0),
+    ("acre", 11, 4046.8564224, 0.0),
+    ("ft2", 11, 0.09290304, 0.0),
+    ("in2", 13, 6.4516, 0.0),
+    # Mass, base kg
+    ("kg", 19, 1.0, 0.0),
+    ("g", 19, 0.001, 0.0),
+    ("mg", 20, 0.001, 0.0),
+    ("t", 19, 1000.0, 0.0),
+    ("lb", 19, 0.45359237, 0.0),
+    ("oz", 23, 0.0625, 0.0),
+    # Pressure, base Pa
+    ("Pa", 25, 1.0, 0.0),
+    ("kPa", 25, 1000.0, 0.0),
+    ("MPa", 26, 1000.0, 0.0),
+    ("bar", 25, 1e5, 0.0),
+    ("atm", 25, 101325.0, 0.0),
+    ("psi", 25, 6894.757293168, 0.0),
+    ("mmHg", 29, 1.0 / 760, 0.0),
+    # Energy, base J
+    ("J", 32, 1.0, 0.0),
+    ("kJ", 32, 1000.0, 0.0),
+    ("cal", 32, 4.184, 0.0),
+    ("kcal", 34, 1000.0, 0.0),
+    ("Wh", 32, 3600.0, 0.0),
+    ("kWh", 36, 1000.0, 0.0),
+    ("eV", 32, 1.602176634e-19, 0.0),
+    ("BTU", 32, 1055.05585262, 0.0),
+    # Power, base W
+    ("W", 40, 1.0, 0.0),
+    ("kW", 40, 1000.0, 0.0),
+    ("MW", 41, 1000.0, 0.0),
+    ("hp", 40, 745.69987158, 0.0),
+    # Temperature, base K
+    ("K", 44, 1.0, 0.0),
+    ("C", 44, 1.0, 273.15),
+    ("F", 45, 5.0 / 9, -160.0 / 9),
+)
+
+# name, first unit, unit count
+CATEGORIES = (
+    ("Length", 0, 11),
+    ("Area", 11, 8),
+    ("Mass", 19, 6),
+    ("Pressure", 25, 7),
+    ("Energy", 32, 8),
+    ("Power", 40, 4),
+    ("Temperature", 44, 3),
+)
+
+# Pair conversions already folded into (m, c)
+_pairs = {}
+PAIR_CACHE_SIZE = 32
+
+
+def category_units(index):
+    """Names of the units in category index, straight from the index."""
+    name, start, count = CATEGORIES[index]
+    return [UNITS[i][0] for i in range(start, start + count)]
+
+
+def category_of(unit):
+    for c in range(len(CATEGORIES)):
+        start, count = CATEGORIES[c][1], CATEGORIES[c][2]
+        if start <= unit < start + count:
+            return c
+    raise ValueError("bad unit")
+
+
+def find(name):
+    """Index of the unit called name, or -1."""
+    for i in range(len(UNITS)):
+        if UNITS[i][0] == name:
+            return i
+    return -1
+
+
+def _ancestors(i):
+    # i and the units above it, up to the category root
+    chain = [i]
+    while UNITS[i][1] != i:
+        i = UNITS[i][1]
+        chain.append(i)
+    return chain
+
+
+def _to_ancestor(i, top):
+    # Composite multiply-add from unit i to top, one of its ancestors
+    m = 1.0
+    c = 0.0
+    while i != top:
+        name, parent, factor, offset = UNITS[i]
+        m, c = m * factor, c * factor + offset
+        i = parent
+    return m, c
+
+
+def converter(src, dst):
+    """Return (m, c) such that value * m + c converts src units to dst."""
+    key = src * len(UNITS) + dst
+    pair = _pairs.get(key)
+    if pair is not None:
+        return pair
+    if category_of(src) != category_of(dst):
+        raise ValueError("incompatible units")
+    above = _ancestors(src)
+    top = dst
+    while top not in above:
+        top = UNITS[top][1]
+    ma, ca = _to_ancestor(src, top)
+    mb, cb = _to_ancestor(dst, top)
+    pair = (ma / mb, (ca - cb) / mb)
+    if len(_pairs) >= PAIR_CACHE_SIZE:
+        _pairs.clear()
+    _pairs[key] = pair
+    return pair
+
+
+def convert(value, src, dst):
+    """Convert value between units given by name or index."""
+    if isinstance(src, str):
+        src = find(src)
+    if isinstance(dst, str):
+        dst = find(dst)
+    if src < 0 or dst < 0:
+        raise ValueError("unknown unit")
+    m, c = converter(src, dst)
+    return value * m + c
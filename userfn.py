@@ -0,0 +1,154 @@
+"""User-defined functions: f(x) = ..., g(x, y) = ...
+
+A definition is parsed once and compiled by expr.define_function into the
+same bytecode as any other expression; calls to it are then resolved to
+its index at compile time. The whole table is kept on flash in one binary
+file (see progfile), so the functions are back at boot without parsing
+any source text.
+
+    "UFN" version count
+    per function: name, parameter count, parameter names, program
+    (names are a length byte followed by the bytes)
+"""
+
+import struct
+from expr import (next_token, define_function, install_function, is_function,
+                  USER_FUNCS, user_functions, VARS, CONSTS, MATRICES,
+                  T_NAME, T_OP)
+import progfile
+
+PATH = "userfn.bin"
+MAGIC = b"UFN"
+
+
+def parse_header(text):
+    """For "name(p1, p2) = body" return (name, params, offset of body)."""
+    kind, name, start, i = next_token(text, 0)
+    if kind != T_NAME:
+        return None
+    kind, value, start, i = next_token(text, i)
+    if kind != T_OP or value != "(":
+        return None
+    params = []
+    while True:
+        kind, value, start, i = next_token(text, i)
+        if kind != T_NAME:
+            return None
+        params.append(value)
+        kind, value, start, i = next_token(text, i)
+        if kind != T_OP:
+            return None
+        if value == ")":
+            break
+        if value != ",":
+            return None
+    kind, value, start, i = next_token(text, i)
+    if kind != T_OP or value != "=":
+        return None
+    return name, params, i
+
+
+def is_definition(text):
+    try:
+        return parse_header(text) is not None
+    except SyntaxError:
+        return False
+
+
+def _is_name(name):
+    return name == "x" or name == "i" or name in VARS or name in CONSTS or \
+        name in MATRICES
+
+
+def define(text):
+    """Compile and install the definition in text; returns the name."""
+    header = parse_header(text)
+    if header is None:
+        raise SyntaxError("not a definition")
+    name, params, start = header
+    # Built-in names and variables stay what they are
+    if name not in USER_FUNCS and (is_function(name) or _is_name(name)):
+        raise SyntaxError("%s is reserved" % name)
+    for p in params:
+        if is_function(p) or params.count(p) > 1:
+            raise SyntaxError("bad parameter %s" % p)
+    define_function(name, params, text[start:].strip())
+    return name
+
+
+def names():
+    """Function names in index order."""
+    out = [None] * len(user_functions)
+    for name in USER_FUNCS:
+        out[USER_FUNCS[name]] = name
+    return out
+
+
+def signature(name):
+    return "%s(%s)" % (name, ",".join(user_functions[USER_FUNCS[name]].params))
+
+
+def template(name):
+    # Editor text for a call, in the style of the "pow( , " key
+    n = user_functions[USER_FUNCS[name]].nargs
+    return name + "(" + " ," * (n - 1) + (" " if n > 1 else "")
+
+
+def _pack_name(name, out):
+    encoded = name.encode()
+    out.append(struct.pack("<B", len(encoded)))
+    out.append(encoded)
+
+
+def _unpack_name(data, pos):
+    n = data[pos]
+    return str(data[pos + 1:pos + 1 + n], "utf-8"), pos + 1 + n
+
+
+def save(path=PATH):
+    out = [MAGIC, struct.pack("<BH", progfile.VERSION, len(user_functions))]
+    for name in names():
+        fn = user_functions[USER_FUNCS[name]]
+        _pack_name(name, out)
+        out.append(struct.pack("<B", fn.nargs))
+        for p in fn.params:
+            _pack_name(p, out)
+        progfile.pack(fn, out)
+    with open(path, "wb") as f:
+        for part in out:
+            f.write(part)
+
+
+def load(path=PATH):
+    """Install the functions saved in path; returns how many were loaded."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return 0
+    if data[:3] != MAGIC:
+        return 0
+    version, count = struct.unpack_from("<BH", data, 3)
+    if version != progfile.VERSION:
+        return 0
+    pos = 6
+    for _ in range(count):
+        name, pos = _unpack_name(data, pos)
+        nargs = data[pos]
+        pos += 1
+        params = []
+        for _ in range(nargs):
+            p, pos = _unpack_name(data, pos)
+            params.append(p)
+        prog, pos = progfile.unpack(data, pos)
+        install_function(name, prog, params)
+    # A redefined function may call one stored after it, whose variables
+    # were not known yet when it was loaded
+    changed = True
+    while changed:
+        changed = False
+        for fn in user_functions:
+            before = fn.var_slots
+            fn.find_var_slots()
+            changed = changed or fn.var_slots != before
+    return count